@@ -0,0 +1,56 @@
+"""
+Memory and pickle size of the per-object state classes (PlayerState, ObjectState, SoupState).
+
+Each record is a 3-ingredient pot soup, two players (one holding an onion and one holding a finished soup), and a
+dish. Memory is measured with tracemalloc, pickles with pickle.HIGHEST_PROTOCOL.
+
+To compare with another version of the classes, pass a copy of that version's overcooked_mdp.py, e.g.
+    git show <rev>:src/overcooked_ai_py/mdp/overcooked_mdp.py > /tmp/old_overcooked_mdp.py
+    python benchmarks/state_memory.py --baseline /tmp/old_overcooked_mdp.py
+"""
+import pickle, tracemalloc, importlib.util, sys
+from argparse import ArgumentParser
+from overcooked_ai_py.mdp import overcooked_mdp
+
+
+def load_module(path, name="baseline_overcooked_mdp"):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_records(m, num_records):
+    records = []
+    for i in range(num_records):
+        soup = m.SoupState.get_soup((i % 7, 2), num_onions=2, num_tomatoes=1, cooking_tick=i % 20)
+        p0 = m.PlayerState((1, 1), (0, -1), m.ObjectState('onion', (1, 1)))
+        p1 = m.PlayerState((2, 1), (1, 0), m.SoupState.get_soup((2, 1), num_onions=3, finished=True))
+        records.append((soup, p0, p1, m.ObjectState('dish', (3, 0))))
+    return records
+
+
+def measure(m, num_records):
+    m.Recipe.configure({})
+    tracemalloc.start()
+    records = make_records(m, num_records)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    bulk = pickle.dumps(records, protocol=pickle.HIGHEST_PROTOCOL)
+    single = pickle.dumps(records[0], protocol=pickle.HIGHEST_PROTOCOL)
+    return memory / num_records, len(bulk) / num_records, len(single)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--num_records", type=int, default=20000)
+    parser.add_argument("--baseline", help="path to another version of overcooked_mdp.py to compare with")
+    args = parser.parse_args()
+
+    modules = [("current", overcooked_mdp)]
+    if args.baseline:
+        modules.insert(0, ("baseline", load_module(args.baseline)))
+    for label, module in modules:
+        print("{}: {:.1f} bytes/record in memory, {:.1f} bytes/record pickled (bulk), {} bytes single record".format(
+            label, *measure(module, args.num_records)))
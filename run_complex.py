@@ -1,4 +1,6 @@
 import pygame
+import time
+import numpy as np
 import matplotlib
 
 matplotlib.use('TkAgg')
@@ -7,7 +9,7 @@ from argparse import ArgumentParser
 
 from overcooked_ai_py.mdp.overcooked_mdp import OvercookedGridworld, Direction, Action
 from overcooked_ai_py.mdp.overcooked_env import OvercookedEnv
-from overcooked_ai_py.agents.agent import StayAgent, RandomAgent, AgentFromPolicy, GreedyHumanModel
+from overcooked_ai_py.agents.agent import StayAgent, RandomAgent, AgentFromPolicy, GreedyHumanModel, ThreadedAgent
 from overcooked_ai_py.planning.planners import MediumLevelPlanner
 from overcooked_ai_py.mdp.layout_generator import LayoutGenerator
 from overcooked_ai_py.utils import load_dict_from_file
@@ -46,13 +48,16 @@ class App:
     """Class to run an Overcooked Gridworld game, leaving one of the agents as fixed.
     Useful for debugging. Most of the code from http://pygametutorials.wikidot.com/tutorials-basic."""
 
-    def __init__(self, env, agent, player_idx, slow_time):
+    def __init__(self, env, agent, player_idx, slow_time, agent_timeout=0.1, agent_fallback="stay"):
         self._running = True
         self._display_surf = None
         self.env = env
-        self.agent = agent
+        # The agent computes its next action in a background thread while waiting for the human's input,
+        # so that slow agents don't stall the event loop
+        self.agent = ThreadedAgent(agent, timeout=agent_timeout, fallback=agent_fallback)
         self.agent_idx = player_idx
         self.slow_time = slow_time
+        self.frame_latencies = []
         print("Human agent index:", player_idx)
 
     def on_init(self):
@@ -61,6 +66,7 @@ class App:
         # Adding pre-trained agent as teammate
         self.agent.set_agent_index(self.agent_idx)
         self.agent.set_mdp(self.env.mdp)
+        self.agent.request_action(self.env.state)
 
         print(self.env)
         self._running = True
@@ -99,7 +105,7 @@ class App:
             self._running = False
 
     def step_env(self, my_action):
-        agent_action = self.agent.action(self.env.state)
+        agent_action, _ = self.agent.get_action()
 
         if self.agent_idx == 0:
             joint_action = (agent_action, my_action)
@@ -107,6 +113,8 @@ class App:
             joint_action = (my_action, agent_action)
 
         s_t, r_t, done, info = self.env.step(joint_action)
+        if not done:
+            self.agent.request_action(s_t)
 
         print(self.env)
         print("Curr reward: (sparse)", r_t, "\t(dense)", info["shaped_r"])
@@ -120,17 +128,25 @@ class App:
         pass
 
     def on_cleanup(self):
+        self.agent.close()
         pygame.quit()
+        for name, latencies in [("Frame", self.frame_latencies), ("Agent", self.agent.agent_latencies)]:
+            if len(latencies):
+                print("{} latency (ms): p50 {:.1f}, p90 {:.1f}, p99 {:.1f}, max {:.1f}".format(
+                    name, *np.percentile(np.array(latencies) * 1000, [50, 90, 99, 100])))
+        print("Agent fallback actions:", self.agent.num_fallbacks)
 
     def on_execute(self):
         if self.on_init() == False:
             self._running = False
 
         while (self._running):
+            frame_start = time.perf_counter()
             for event in pygame.event.get():
                 self.on_event(event)
             self.on_loop()
             self.on_render()
+            self.frame_latencies.append(time.perf_counter() - frame_start)
         self.on_cleanup()
 
 
@@ -173,6 +189,9 @@ if __name__ == "__main__":
     parser.add_argument("-s", "--seed", dest="seed", required=False, default=0)
     parser.add_argument("-a", "--agent_num", dest="agent_num", default=0)
     parser.add_argument("-i", "--idx", dest="idx", default=0)
+    parser.add_argument("--agent_timeout", dest="agent_timeout", type=float, default=0.1,
+                        help="Seconds to wait for the agent's action before playing the fallback action")
+    parser.add_argument("--agent_fallback", dest="agent_fallback", choices=ThreadedAgent.FALLBACKS, default="stay")
 
     args = parser.parse_args()
     run_type, run_dir, slow_time, run_seed, agent_num, player_idx = args.type, args.run, bool(args.slow), int(
@@ -180,6 +199,6 @@ if __name__ == "__main__":
 
     env, agent, player_idx = setup_game(run_type, run_dir, run_seed, agent_num, player_idx)
 
-    theApp = App(env, agent, player_idx, slow_time)
+    theApp = App(env, agent, player_idx, slow_time, args.agent_timeout, args.agent_fallback)
     print("Slowed time:", slow_time)
     theApp.on_execute()
\ No newline at end of file
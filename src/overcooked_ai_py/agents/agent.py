@@ -1,6 +1,6 @@
-import itertools, math
+import itertools, math, threading, time
 import numpy as np
-from collections import defaultdict
+from collections import defaultdict, deque
 from overcooked_ai_py.mdp.actions import Action
 
 
@@ -78,6 +78,26 @@ class AgentGroup(object):
         actions_and_probs_n = tuple(a.action(state) for a in self.agents)
         return actions_and_probs_n
 
+    def joint_actions(self, states):
+        """
+        Multi-state version of joint_action, which queries each agent once for all states through Agent.actions
+        (or calls Agent.action on each state, for agents that don't implement it).
+
+        NOTE: as the same agent instances act in all states, this is only meant for agents that don't keep
+        trajectory-specific history.
+
+        Returns a list with the joint action and infos for each state
+        """
+        actions_and_infos_by_agent = []
+        for agent_idx, agent in enumerate(self.agents):
+            # Needed when the same instance is used for multiple agents
+            agent.set_agent_index(agent_idx)
+            if type(agent).actions is Agent.actions:
+                actions_and_infos_by_agent.append([agent.action(state) for state in states])
+            else:
+                actions_and_infos_by_agent.append(agent.actions(states, [agent_idx] * len(states)))
+        return list(zip(*actions_and_infos_by_agent))
+
     def set_mdp(self, mdp):
         for a in self.agents:
             a.set_mdp(mdp)
@@ -472,6 +492,131 @@ class SampleAgent(Agent):
         return Action.sample(action_probs), {"action_probs": action_probs}
     """
     """
+
+
+class ThreadedAgent(Agent):
+    """
+    Wraps an agent to compute its actions in a background thread, e.g. so that a slow agent doesn't stall the
+    event loop of an interactive game. Each action must be ready by a deadline, otherwise a fallback action
+    is played (STAY, or the last computed action) and the late result is discarded.
+
+    To hide the agent's latency, the next action can be requested as soon as the state is known (request_action),
+    and collected when it is needed (get_action). Computation times of the wrapped agent are recorded in
+    `agent_latencies` (in seconds), and the number of missed deadlines in `num_fallbacks`.
+
+    E.g. of how to use ThreadedAgent:
+    > agent = ThreadedAgent(GreedyHumanModel(mlam), timeout=0.05)
+    > agent.request_action(env.state)
+    > ... # handle user input
+    > action, action_info = agent.get_action()
+    """
+
+    FALLBACKS = ["stay", "last"]
+
+    def __init__(self, agent, timeout=0.1, fallback="stay", max_recorded_latencies=100000):
+        """
+        timeout (float):    default time (in seconds) get_action waits for, after which the fallback action is used
+        fallback (str):     "stay" to fall back to STAY, or "last" to repeat the last action computed by the agent
+        """
+        assert fallback in self.FALLBACKS, "Unrecognized fallback {}".format(fallback)
+        self.agent = agent
+        self.timeout = timeout
+        self.fallback = fallback
+        self.agent_latencies = deque(maxlen=max_recorded_latencies)
+        self.num_fallbacks = 0
+        # Only the latest request is kept: if the agent is busy, older unprocessed requests are dropped
+        self._cond = threading.Condition()
+        self._request_id = 0
+        self._pending = None
+        self._result = None
+        self._busy = False
+        self._closed = False
+        # Also resets the wrapped agent and last_action
+        super().__init__()
+        self._thread = threading.Thread(target=self._worker, daemon=True)
+        self._thread.start()
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending is not None or self._closed)
+                if self._closed:
+                    return
+                request_id, state = self._pending
+                self._pending = None
+                self._busy = True
+            start = time.perf_counter()
+            try:
+                result = (True, self.agent.action(state))
+            except Exception as e:
+                result = (False, e)
+            latency = time.perf_counter() - start
+            with self._cond:
+                self.agent_latencies.append(latency)
+                self._result = (request_id,) + result
+                self._busy = False
+                self._cond.notify_all()
+
+    def request_action(self, state):
+        """Starts computing the agent's action for state in the background, superseding any previous request"""
+        with self._cond:
+            self._request_id += 1
+            self._pending = (self._request_id, state)
+            self._cond.notify_all()
+
+    def get_action(self, timeout=None):
+        """
+        Returns the (action, action_info) for the last requested state, waiting at most `timeout` seconds
+        (defaults to self.timeout). If it is not ready by then, returns the fallback action, with the action
+        info {"fallback": True}
+        """
+        timeout = self.timeout if timeout is None else timeout
+        with self._cond:
+            request_id = self._request_id
+            ready = self._cond.wait_for(lambda: self._result is not None and self._result[0] == request_id, timeout)
+            if not ready:
+                self.num_fallbacks += 1
+                action = Action.STAY if self.fallback == "stay" else self.last_action
+                return action, {"fallback": True}
+            _, success, result = self._result
+        if not success:
+            raise result
+        self.last_action = result[0]
+        return result
+
+    def action(self, state):
+        self.request_action(state)
+        return self.get_action()
+
+    def _wait_until_idle(self):
+        # The wrapped agent must not be modified while it is computing an action
+        with self._cond:
+            self._pending = None
+            self._cond.wait_for(lambda: not self._busy)
+
+    def set_agent_index(self, agent_index):
+        self._wait_until_idle()
+        super().set_agent_index(agent_index)
+        self.agent.set_agent_index(agent_index)
+
+    def set_mdp(self, mdp):
+        self._wait_until_idle()
+        super().set_mdp(mdp)
+        self.agent.set_mdp(mdp)
+
+    def reset(self):
+        self._wait_until_idle()
+        super().reset()
+        self.agent.reset()
+        self.last_action = Action.STAY
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+
 # Deprecated. Need to fix Heuristic to work with the new MDP to reactivate Planning
 # class CoupledPlanningAgent(Agent):
 #     """
@@ -122,7 +122,7 @@ class AgentEvaluator(object):
         return self.evaluate_agent_pair(agent_pair, num_games=num_games, display=display, native_eval=native_eval)
 
     def evaluate_agent_pair(self, agent_pair, num_games, game_length=None, start_state_fn=None, metadata_fn=None, metadata_info_fn=None, display=False, dir=None,
-                            display_phi=False, info=True, native_eval=False):
+                            display_phi=False, info=True, native_eval=False, num_workers=1, seed=None, lockstep_games=1):
         # this index has to be 0 because the Agent_Evaluator only has 1 env initiated
         # if you would like to evaluate on a different env using rllib, please modifiy
         # rllib/ -> rllib.py -> get_rllib_eval_function -> _evaluate
@@ -130,16 +130,19 @@ class AgentEvaluator(object):
         # native eval: using self.env in evaluation instead of creating a copy
         # this is particulally helpful with variable MDP, where we want to make sure
         # the mdp used in evaluation is the same as the native self.env.mdp
+        # num_workers, seed and lockstep_games: see OvercookedEnv.get_rollouts
         if native_eval:
             return self.env.get_rollouts(agent_pair, num_games=num_games, display=display, dir=dir, display_phi=display_phi,
-                                         info=info, metadata_fn=metadata_fn, metadata_info_fn=metadata_info_fn)
+                                         info=info, metadata_fn=metadata_fn, metadata_info_fn=metadata_info_fn,
+                                         num_workers=num_workers, seed=seed, lockstep_games=lockstep_games)
         else:
             horizon_env = self.env.copy()
             horizon_env.horizon = self.env.horizon if game_length is None else game_length
             horizon_env.start_state_fn = self.env.start_state_fn if start_state_fn is None else start_state_fn
             horizon_env.reset()
             return horizon_env.get_rollouts(agent_pair, num_games=num_games, display=display, dir=dir, display_phi=display_phi,
-                                            info=info, metadata_fn=metadata_fn, metadata_info_fn=metadata_info_fn)
+                                            info=info, metadata_fn=metadata_fn, metadata_info_fn=metadata_info_fn,
+                                            num_workers=num_workers, seed=seed, lockstep_games=lockstep_games)
 
     def get_agent_pair_trajs(self, a0, a1=None, num_games=100, game_length=None, start_state_fn=None, display=False, info=True):
         """Evaluate agent pair on both indices, and return trajectories by index"""
@@ -199,17 +202,20 @@ class AgentEvaluator(object):
                 len(states), len(actions), len(rewards)
             )
 
-            # Checking that actions would give rise to same behaviour in current MDP
-            for i in range(len(states) - 1):
-                curr_state = states[i]
+            # Checking that actions would give rise to same behaviour in current MDP. States are iterated over
+            # rather than indexed, as indexing a compact ActionTrajectory replays actions from a checkpoint
+            states_iter = iter(states)
+            curr_state = next(states_iter, None)
+            for i, expected_next_state in enumerate(states_iter):
                 simulation_env.state = curr_state
 
                 next_state, reward, done, info = simulation_env.step(actions[i])
 
-                assert states[i + 1] == next_state, "States differed (expected vs actual): {}\n\nexpected dict: \t{}\nactual dict: \t{}".format(
-                    simulation_env.display_states(states[i + 1], next_state), states[i+1].to_dict(), next_state.to_dict()
+                assert expected_next_state == next_state, "States differed (expected vs actual): {}\n\nexpected dict: \t{}\nactual dict: \t{}".format(
+                    simulation_env.display_states(expected_next_state, next_state), expected_next_state.to_dict(), next_state.to_dict()
                 )
                 assert rewards[i] == reward, "{} \t {}".format(rewards[i], reward)
+                curr_state = expected_next_state
 
     @staticmethod
     def get_mdps_and_envs_from_trajectories(trajectories):
@@ -0,0 +1,297 @@
+import glob, hashlib, json, multiprocessing, os, time, traceback
+from collections import deque
+from multiprocessing.connection import wait
+import numpy as np
+from overcooked_ai_py.utils import save_pickle, load_pickle
+from overcooked_ai_py.planning.planners import NO_COUNTERS_PARAMS
+from overcooked_ai_py.mdp.overcooked_mdp import OvercookedGridworld
+from overcooked_ai_py.mdp.overcooked_env import OvercookedEnv
+from overcooked_ai_py.mdp.overcooked_trajectory import RolloutSummary
+
+
+class SweepCell(object):
+    """
+    One (agent pair, layout, start state fn) combination of a sweep, evaluated for num_games episodes.
+
+    agent_pair_fn (callable):   takes the OvercookedEnv of the layout (whose planners are shared by all cells on the
+                                layout, e.g. `lambda env: AgentPair(GreedyHumanModel(env.mlam), GreedyHumanModel(env.mlam))`)
+                                and returns the agent pair to evaluate
+    mdp_params (dict):          params for OvercookedGridworld.from_layout_name
+    name (str):                 should identify the agent pair and start state fn, as it is part of the key under
+                                which episodes are checkpointed (defaults to the layout name)
+    """
+
+    def __init__(self, agent_pair_fn, mdp_params, num_games, horizon=400, start_state_fn=None, name=None):
+        assert type(mdp_params) is dict and "layout_name" in mdp_params
+        self.agent_pair_fn = agent_pair_fn
+        self.mdp_params = mdp_params
+        self.num_games = num_games
+        self.horizon = horizon
+        self.start_state_fn = start_state_fn
+        self.name = mdp_params["layout_name"] if name is None else name
+
+    @property
+    def layout_key(self):
+        return json.dumps(self.mdp_params, sort_keys=True)
+
+
+class SweepRunner(object):
+    """
+    Evaluates many SweepCells, of very different costs, on a pool of forked worker processes.
+
+    Cells are split into episode-level tasks. Each worker gets its own queue of tasks, made of whole layouts
+    (balanced by estimated cost), so that it only builds the env and planners of few layouts. A worker that
+    runs out of tasks steals from the back of another worker's queue, preferring tasks on layouts it has
+    already loaded, and otherwise stealing from the most loaded queue. Stealing is brokered by the parent
+    process, which hands out tasks one (or `prefetch`) at a time.
+
+    Episodes are seeded (game i of each cell with seed + i), so results don't depend on the scheduling.
+
+    If a results_dir is given, completed episodes are checkpointed there, in small shard files written every
+    `checkpoint_every` episodes. Each episode is stored under a key made from the cell name, the content of its
+    layout, the horizon and the seed, so that re-running an interrupted sweep (even with cells added or
+    reordered) skips the episodes that were already completed.
+
+    E.g. of how to use SweepRunner:
+    > cells = [SweepCell(pair_fn, {"layout_name": layout_name}, num_games=20) for layout_name in layout_names]
+    > results = SweepRunner(cells, num_workers=8).run()
+    """
+
+    def __init__(self, cells, num_workers=None, seed=0, mlam_params=NO_COUNTERS_PARAMS, prefetch=2, results_dir=None,
+                 checkpoint_every=10):
+        self.cells = cells
+        self.num_workers = multiprocessing.cpu_count() if num_workers is None else num_workers
+        self.seed = seed
+        self.mlam_params = mlam_params
+        self.prefetch = prefetch
+        self.results_dir = results_dir
+        self.checkpoint_every = checkpoint_every
+        self.num_resumed = 0
+        self.num_steals = 0
+        # Layouts each worker has loaded, as recorded by the scheduler
+        self.worker_layouts = [set() for _ in range(max(self.num_workers, 1))]
+
+    def run(self):
+        """
+        Returns a list with, for each cell, a dict with the "ep_returns", "ep_shaped_returns" and "ep_lengths"
+        arrays of its episodes (in game order), and a RolloutSummary of them under "summary"
+        """
+        tasks = self._get_tasks()
+        task_keys = {}
+        episode_infos = {}
+        if self.results_dir is not None:
+            task_keys = self._get_task_keys(tasks)
+            os.makedirs(self.results_dir, exist_ok=True)
+            completed = self._load_checkpoints()
+            episode_infos = {task[:2]: completed[task_keys[task[:2]]] for task in tasks if task_keys[task[:2]] in completed}
+            self.num_resumed = len(episode_infos)
+            tasks = [task for task in tasks if task[:2] not in episode_infos]
+
+        self._checkpoint_buffer = {}
+        try:
+            if self.num_workers <= 1:
+                worker = _SweepWorker(self.cells, self.mlam_params)
+                for task in tasks:
+                    self._add_episode(episode_infos, task_keys, task[:2], worker.run_task(*task))
+            else:
+                self._run_parallel(tasks, episode_infos, task_keys)
+        finally:
+            self._save_checkpoint()
+        return [self._cell_results(cell_idx, episode_infos) for cell_idx in range(len(self.cells))]
+
+    def _get_tasks(self):
+        """(cell_idx, game_idx, game_seed) for all episodes of the sweep"""
+        return [(cell_idx, game_idx, self.seed + game_idx)
+                for cell_idx, cell in enumerate(self.cells) for game_idx in range(cell.num_games)]
+
+    def _get_layout_mdp(self, layout_key):
+        if not hasattr(self, "_layout_mdps"):
+            self._layout_mdps = {}
+        if layout_key not in self._layout_mdps:
+            self._layout_mdps[layout_key] = OvercookedGridworld.from_layout_name(**json.loads(layout_key))
+        return self._layout_mdps[layout_key]
+
+    def _task_key(self, cell_idx, game_idx, game_seed):
+        cell = self.cells[cell_idx]
+        content = {"name": cell.name, "layout": self._get_layout_mdp(cell.layout_key).fingerprint,
+                   "horizon": cell.horizon, "seed": game_seed}
+        return hashlib.sha1(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+    def _get_task_keys(self, tasks):
+        """Checkpoint key of each (cell_idx, game_idx), raising a ValueError if episodes of different cells clash"""
+        task_keys, cells_by_key = {}, {}
+        for task in tasks:
+            task_key = self._task_key(*task)
+            cell_idx = cells_by_key.setdefault(task_key, task[0])
+            if cell_idx != task[0]:
+                raise ValueError("Cells {} and {} (both named {!r}) have the same layout and horizon, so they must have "
+                                 "different names to be checkpointed".format(cell_idx, task[0], self.cells[cell_idx].name))
+            task_keys[task[:2]] = task_key
+        return task_keys
+
+    def _add_episode(self, episode_infos, task_keys, cell_and_game_idx, episode_info):
+        episode_infos[cell_and_game_idx] = episode_info
+        if self.results_dir is not None:
+            self._checkpoint_buffer[task_keys[cell_and_game_idx]] = episode_info
+            if len(self._checkpoint_buffer) >= self.checkpoint_every:
+                self._save_checkpoint()
+
+    def _save_checkpoint(self):
+        """Writes the buffered episodes to a new shard file, atomically so that partial shards are never loaded"""
+        if self.results_dir is None or not self._checkpoint_buffer:
+            return
+        shard_name = "shard_{}_{}_{}.pickle".format(int(time.time() * 1e6), os.getpid(), len(self._checkpoint_buffer))
+        tmp_path = os.path.join(self.results_dir, "_" + shard_name)
+        save_pickle(self._checkpoint_buffer, tmp_path)
+        os.replace(tmp_path, os.path.join(self.results_dir, shard_name))
+        self._checkpoint_buffer = {}
+
+    def _load_checkpoints(self):
+        completed = {}
+        for shard_path in sorted(glob.glob(os.path.join(self.results_dir, "shard_*.pickle"))):
+            completed.update(load_pickle(shard_path))
+        return completed
+
+    def _estimated_layout_costs(self):
+        """Rough relative cost of the tasks on each layout: timesteps to simulate, scaled by the layout size"""
+        costs = {}
+        for cell in self.cells:
+            mdp = self._get_layout_mdp(cell.layout_key)
+            costs[cell.layout_key] = costs.get(cell.layout_key, 0) + cell.num_games * cell.horizon * mdp.width * mdp.height
+        return costs
+
+    def _initial_queues(self, tasks):
+        """Assigns whole layouts to workers, most expensive first, each to the least loaded worker"""
+        tasks_by_layout = {}
+        for task in tasks:
+            tasks_by_layout.setdefault(self.cells[task[0]].layout_key, []).append(task)
+        costs = self._estimated_layout_costs()
+        queues = [deque() for _ in range(self.num_workers)]
+        loads = np.zeros(self.num_workers)
+        for layout_key in sorted(tasks_by_layout, key=costs.get, reverse=True):
+            worker_idx = int(np.argmin(loads))
+            queues[worker_idx].extend(tasks_by_layout[layout_key])
+            loads[worker_idx] += costs[layout_key]
+        return queues
+
+    def _next_task(self, worker_idx, queues):
+        if queues[worker_idx]:
+            task = queues[worker_idx].popleft()
+        else:
+            task = self._steal_task(worker_idx, queues)
+            if task is None:
+                return None
+            self.num_steals += 1
+        self.worker_layouts[worker_idx].add(self.cells[task[0]].layout_key)
+        return task
+
+    def _steal_task(self, worker_idx, queues):
+        loaded_layouts = self.worker_layouts[worker_idx]
+        for queue in queues:
+            for i in range(len(queue) - 1, -1, -1):
+                if self.cells[queue[i][0]].layout_key in loaded_layouts:
+                    task = queue[i]
+                    del queue[i]
+                    return task
+        victim = max(queues, key=len)
+        return victim.pop() if victim else None
+
+    def _run_parallel(self, tasks, episode_infos, task_keys):
+        queues = self._initial_queues(tasks)
+        ctx = multiprocessing.get_context("fork")
+        conns, processes = [], []
+        for _ in range(self.num_workers):
+            parent_conn, worker_conn = ctx.Pipe()
+            process = ctx.Process(target=_sweep_worker, args=(worker_conn, self.cells, self.mlam_params), daemon=True)
+            process.start()
+            worker_conn.close()
+            conns.append(parent_conn)
+            processes.append(process)
+
+        in_flight = [0] * self.num_workers
+        completed = False
+        try:
+            for worker_idx, conn in enumerate(conns):
+                for _ in range(self.prefetch):
+                    self._send_next_task(worker_idx, conn, queues, in_flight)
+            while any(in_flight):
+                for conn in wait([conn for worker_idx, conn in enumerate(conns) if in_flight[worker_idx]]):
+                    worker_idx = conns.index(conn)
+                    try:
+                        success, result = conn.recv()
+                    except (EOFError, OSError):
+                        success, result = False, "The worker process died"
+                    if not success:
+                        raise RuntimeError("Sweep worker failed:\n{}".format(result))
+                    cell_idx, game_idx, episode_info = result
+                    self._add_episode(episode_infos, task_keys, (cell_idx, game_idx), episode_info)
+                    in_flight[worker_idx] -= 1
+                    self._send_next_task(worker_idx, conn, queues, in_flight)
+            completed = True
+        finally:
+            for conn in conns:
+                try:
+                    conn.send(None)
+                except OSError:
+                    # The worker died, which must not hide the error being raised
+                    pass
+            for process in processes:
+                if not completed:
+                    # Workers may still be busy with tasks of the failed sweep
+                    process.terminate()
+                process.join()
+
+    def _send_next_task(self, worker_idx, conn, queues, in_flight):
+        task = self._next_task(worker_idx, queues)
+        if task is not None:
+            conn.send(task)
+            in_flight[worker_idx] += 1
+
+    def _cell_results(self, cell_idx, episode_infos):
+        cell = self.cells[cell_idx]
+        summary = RolloutSummary()
+        episodes = [episode_infos[(cell_idx, game_idx)] for game_idx in range(cell.num_games)]
+        for episode_info in episodes:
+            summary.add_episode_info(episode_info)
+        return {
+            "ep_returns": np.array([episode_info["ep_sparse_r"] for episode_info in episodes]),
+            "ep_shaped_returns": np.array([episode_info["ep_shaped_r"] for episode_info in episodes]),
+            "ep_lengths": np.array([episode_info["ep_length"] for episode_info in episodes]),
+            "summary": summary
+        }
+
+
+class _SweepWorker(object):
+    """Runs sweep episodes, keeping one env (with its planners) per layout and one agent pair per cell"""
+
+    def __init__(self, cells, mlam_params):
+        self.cells = cells
+        self.mlam_params = mlam_params
+        self.envs = {}
+        self.agent_pairs = {}
+
+    def run_task(self, cell_idx, game_idx, game_seed):
+        cell = self.cells[cell_idx]
+        if cell.layout_key not in self.envs:
+            mdp = OvercookedGridworld.from_layout_name(**cell.mdp_params)
+            self.envs[cell.layout_key] = OvercookedEnv.from_mdp(mdp, mlam_params=self.mlam_params, info_level=0)
+        env = self.envs[cell.layout_key]
+        env.horizon = cell.horizon
+        env.start_state_fn = cell.start_state_fn
+        if cell_idx not in self.agent_pairs:
+            self.agent_pairs[cell_idx] = cell.agent_pair_fn(env)
+        trajectory, time_taken, _, _ = env._run_seeded_rollout(self.agent_pairs[cell_idx], game_seed, {})
+        return trajectory[time_taken - 1][4]["episode"]
+
+
+def _sweep_worker(conn, cells, mlam_params):
+    worker = _SweepWorker(cells, mlam_params)
+    while True:
+        task = conn.recv()
+        if task is None:
+            conn.close()
+            return
+        try:
+            conn.send((True, task[:2] + (worker.run_task(*task),)))
+        except Exception:
+            conn.send((False, traceback.format_exc()))
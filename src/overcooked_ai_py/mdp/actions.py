@@ -79,7 +79,9 @@ class Action(object):
 
     @staticmethod
     def sample(action_probs):
-        return np.random.choice(Action.ALL_ACTIONS, p=action_probs)
+        # Sampling an index, as ALL_ACTIONS mixes tuples and strings and can't be turned into a 1D numpy array
+        action_idx = np.random.choice(Action.NUM_ACTIONS, p=action_probs)
+        return Action.INDEX_TO_ACTION[action_idx]
     
     @staticmethod
     def argmax(action_probs):
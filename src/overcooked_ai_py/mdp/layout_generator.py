@@ -1,9 +1,10 @@
 import numpy as np
 
-import random, copy
+import random, copy, multiprocessing, traceback
 from overcooked_ai_py.utils import rnd_int_uniform, rnd_uniform
 from overcooked_ai_py.mdp.actions import Action, Direction
 from overcooked_ai_py.mdp.overcooked_mdp import OvercookedGridworld, Recipe
+from overcooked_ai_py.planning.planners import MediumLevelActionManager, NO_COUNTERS_PARAMS
 
 EMPTY = ' '
 COUNTER = 'X'
@@ -320,6 +321,89 @@ class LayoutGenerator(object):
         return pos0, pos1
 
 
+class MdpPrefetcher(object):
+    """
+    An mdp generator function that generates upcoming mdps (and optionally their planners) ahead of time in
+    background worker processes, so that resetting a variable-mdp environment only has to dequeue a ready mdp.
+
+    Workers are forked, so the wrapped mdp_fn doesn't need to be picklable, but the mdps (and planners) it
+    produces are sent back through a queue. As mdps are generated before they are requested, the outside
+    information given when calling the prefetcher is ignored: mdp_fn is always called with `outside_info`.
+    With more than one worker, the order in which mdps are produced is not deterministic.
+
+    E.g. of how to use MdpPrefetcher:
+    > mdp_fn = LayoutGenerator.mdp_gen_fn_from_dict(mdp_params, outer_shape=(5, 4))
+    > with MdpPrefetcher(mdp_fn, num_workers=2, compute_planners=True) as prefetcher:
+    >     env = OvercookedEnv(prefetcher, horizon=400)
+    """
+
+    def __init__(self, mdp_fn, queue_size=8, num_workers=1, compute_planners=False, mlam_params=None,
+                 outside_info={}, seed=None):
+        """
+        mdp_fn (callable):          takes outside information and returns an OvercookedGridworld
+        queue_size (int):           maximum number of generated mdps waiting to be used
+        compute_planners (bool):    whether to also compute a MediumLevelActionManager for each mdp
+        mlam_params (dict):         params of the planners, defaults to NO_COUNTERS_PARAMS
+        seed (int):                 if given, worker i is seeded with seed + i, otherwise with fresh entropy
+        """
+        self.compute_planners = compute_planners
+        self.mlam_params = NO_COUNTERS_PARAMS if mlam_params is None else mlam_params
+        self._last_mdp_and_mlam = None
+
+        ctx = multiprocessing.get_context("fork")
+        self._queue = ctx.Queue(maxsize=queue_size)
+        self._processes = []
+        for worker_idx in range(num_workers):
+            worker_seed = None if seed is None else seed + worker_idx
+            process = ctx.Process(target=_mdp_prefetch_worker, daemon=True,
+                                  args=(self._queue, mdp_fn, outside_info, compute_planners, self.mlam_params, worker_seed))
+            process.start()
+            self._processes.append(process)
+        self.closed = False
+
+    def __call__(self, outside_info={}):
+        assert not self.closed, "The prefetcher has been closed"
+        success, result = self._queue.get()
+        if not success:
+            raise RuntimeError("Mdp prefetch worker failed:\n{}".format(result))
+        self._last_mdp_and_mlam = result
+        return result[0]
+
+    def get_mlam(self, mdp):
+        """The prefetched planners of the mdp, if it is the last one returned and they were computed, otherwise None"""
+        if self._last_mdp_and_mlam is not None and self._last_mdp_and_mlam[0] is mdp:
+            return self._last_mdp_and_mlam[1]
+        return None
+
+    def close(self):
+        if self.closed:
+            return
+        for process in self._processes:
+            process.terminate()
+            process.join()
+        self._queue.close()
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _mdp_prefetch_worker(queue, mdp_fn, outside_info, compute_planners, mlam_params, seed):
+    # Forked workers share the parent's random state, which would make them all generate the same mdps
+    np.random.seed(seed)
+    random.seed(seed)
+    try:
+        while True:
+            mdp = mdp_fn(outside_info)
+            mlam = MediumLevelActionManager(mdp, mlam_params) if compute_planners else None
+            queue.put((True, (mdp, mlam)))
+    except Exception:
+        queue.put((False, traceback.format_exc()))
+
+
 class Grid(object):
 
     def __init__(self, shape):
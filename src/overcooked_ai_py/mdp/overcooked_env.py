@@ -1,10 +1,12 @@
 import gym, tqdm
-import time
+import time, itertools, multiprocessing
 import numpy as np
-from overcooked_ai_py.utils import mean_and_std_err, append_dictionaries
+from overcooked_ai_py.utils import append_dictionaries
 from overcooked_ai_py.mdp.actions import Action
 from overcooked_ai_py.mdp.overcooked_mdp import OvercookedGridworld, EVENT_TYPES
-from overcooked_ai_py.mdp.overcooked_trajectory import TIMESTEP_TRAJ_KEYS, EPISODE_TRAJ_KEYS, DEFAULT_TRAJ_KEYS
+from overcooked_ai_py.mdp.layout_generator import MdpPrefetcher
+from overcooked_ai_py.mdp.overcooked_trajectory import DEFAULT_TRAJ_KEYS, RolloutSummary, ActionTrajectory, \
+    DeltaEncodedStates
 from overcooked_ai_py.planning.planners import MediumLevelActionManager, MotionPlanner, NO_COUNTERS_PARAMS
 
 DEFAULT_ENV_PARAMS = {
@@ -13,6 +15,12 @@ DEFAULT_ENV_PARAMS = {
 
 MAX_HORIZON = 1e10
 
+# Contents of the info dict returned by OvercookedEnv.step (the "episode" entry is always added when done):
+#   "full":         agent_infos, sparse_r_by_agent, shaped_r_by_agent, phi_s and phi_s_prime
+#   "rewards-only": sparse_r_by_agent and shaped_r_by_agent
+#   "none":         nothing, and the same (empty) dict is returned at every non-final step
+INFO_DICT_LEVELS = ["none", "rewards-only", "full"]
+
 
 class OvercookedEnv(object):
     """
@@ -31,7 +39,7 @@ class OvercookedEnv(object):
     #########################
 
     def __init__(self, mdp_generator_fn, start_state_fn=None, horizon=MAX_HORIZON, mlam_params=NO_COUNTERS_PARAMS,
-                 info_level=0, num_mdp=1, initial_info={}):
+                 info_level=0, num_mdp=1, initial_info={}, info_dict_level="full"):
         """
         mdp_generator_fn (callable):    A no-argument function that returns a OvercookedGridworld instance
         start_state_fn (callable):      Function that returns start state for the MDP, called at each environment reset
@@ -40,6 +48,7 @@ class OvercookedEnv(object):
         info_level (int):               Change amount of logging
         num_mdp (int):                  the number of mdp if we are using a list of mdps
         initial_info (dict):            the initial outside information feed into the generator function
+        info_dict_level (str):          contents of the info dicts returned by `step`, see INFO_DICT_LEVELS
 
         TODO: Potentially make changes based on this discussion
         https://github.com/HumanCompatibleAI/overcooked_ai/pull/22#discussion_r416786847
@@ -53,9 +62,16 @@ class OvercookedEnv(object):
         self.horizon = horizon
         self._mlam = None
         self._mp = None
+        self.mdp = None
+        self.game_stats = None
+        self._start_state_template = None
         self.mlam_params = mlam_params
         self.start_state_fn = start_state_fn
         self.info_level = info_level
+        assert info_dict_level in INFO_DICT_LEVELS, "Unrecognized info dict level {}".format(info_dict_level)
+        self.info_dict_level = info_dict_level
+        # Returned by every non-final step with info_dict_level "none": must not be modified
+        self._shared_info = {}
         self.reset(outside_info=initial_info)
         if self.horizon >= MAX_HORIZON and self.info_level > 0:
             print("Environment has (near-)infinite horizon and no terminal states. \
@@ -83,7 +99,8 @@ class OvercookedEnv(object):
         return self._mp
 
     @staticmethod
-    def from_mdp(mdp, start_state_fn=None, horizon=MAX_HORIZON, mlam_params=NO_COUNTERS_PARAMS, info_level=1):
+    def from_mdp(mdp, start_state_fn=None, horizon=MAX_HORIZON, mlam_params=NO_COUNTERS_PARAMS, info_level=1,
+                 info_dict_level="full"):
         """
         Create an OvercookedEnv directly from a OvercookedGridworld mdp
         rather than a mdp generating function.
@@ -96,7 +113,8 @@ class OvercookedEnv(object):
             horizon=horizon,
             mlam_params=mlam_params,
             info_level=info_level,
-            num_mdp=1
+            num_mdp=1,
+            info_dict_level=info_dict_level
         )
 
     #####################
@@ -124,7 +142,8 @@ class OvercookedEnv(object):
             start_state_fn=self.start_state_fn,
             horizon=self.horizon,
             info_level=self.info_level,
-            num_mdp=self.num_mdp
+            num_mdp=self.num_mdp,
+            info_dict_level=self.info_dict_level
         )
 
     #############################
@@ -193,25 +212,117 @@ class OvercookedEnv(object):
             ep_sparse_r: the environment sparse reward, given only at soup delivery
             ep_shaped_r: the component of the reward that is due to reward shaped (excluding sparse rewards)
             ep_length: length of rollout
+        The rest of the info depends on self.info_dict_level (see INFO_DICT_LEVELS).
         """
 
         assert not self.is_done()
-        if joint_agent_action_info is None: joint_agent_action_info = [{} for _ in range(self.mdp.num_players)]
-        next_state, mdp_infos = self.mdp.get_state_transition(self.state, joint_action, display_phi, self.mp)
+        mdp_infos = self._apply_transition(joint_action, display_phi)
 
-        # Update game_stats
-        self._update_game_stats(mdp_infos)
-
-        # Update state and done
-        self.state = next_state
         done = self.is_done()
-        env_info = self._prepare_info_dict(joint_agent_action_info, mdp_infos)
-
+        if self.info_dict_level == "full":
+            if joint_agent_action_info is None: joint_agent_action_info = [{} for _ in range(self.mdp.num_players)]
+            env_info = self._prepare_info_dict(joint_agent_action_info, mdp_infos)
+        elif self.info_dict_level == "rewards-only":
+            env_info = {"sparse_r_by_agent": mdp_infos["sparse_reward_by_agent"],
+                        "shaped_r_by_agent": mdp_infos["shaped_reward_by_agent"]}
+        else:
+            env_info = {} if done else self._shared_info
 
         if done: self._add_episode_info(env_info)
 
         timestep_sparse_reward = sum(mdp_infos["sparse_reward_by_agent"])
-        return (next_state, timestep_sparse_reward, done, env_info)
+        return (self.state, timestep_sparse_reward, done, env_info)
+
+    def step_n(self, joint_actions_sequence, joint_agent_action_info=None, display_phi=False):
+        """Performs a sequence of joint actions in a single call, stopping early if the episode ends.
+
+        Game stats are updated for every step, but the per-step info dict is not built. The returned
+        info has the same keys as the one returned by `step`, with rewards summed over all executed steps,
+        plus:
+            num_steps: number of steps that were actually executed
+            event_counts: for each event type, the number of times it occurred for each agent
+        phi_s and phi_s_prime (if display_phi) refer to the states before the first and after the last step.
+        """
+        assert not self.is_done()
+        num_players = self.mdp.num_players
+        if joint_agent_action_info is None: joint_agent_action_info = [{} for _ in range(num_players)]
+        phi_s = self.mdp.potential_function(self.state, self.mp) if display_phi else None
+
+        sparse_r_by_agent = np.zeros(num_players)
+        shaped_r_by_agent = np.zeros(num_players)
+        event_counts = np.zeros((len(EVENT_TYPES), num_players), dtype=int)
+        num_steps = 0
+        done = False
+        for joint_action in joint_actions_sequence:
+            mdp_infos = self._apply_transition(joint_action)
+            sparse_r_by_agent += mdp_infos["sparse_reward_by_agent"]
+            shaped_r_by_agent += mdp_infos["shaped_reward_by_agent"]
+            for event_idx, event_type in enumerate(EVENT_TYPES):
+                event_counts[event_idx] += mdp_infos["event_infos"][event_type]
+            num_steps += 1
+            done = self.is_done()
+            if done: break
+
+        env_info = {
+            "agent_infos": [joint_agent_action_info[agent_idx] for agent_idx in range(num_players)],
+            "sparse_r_by_agent": list(sparse_r_by_agent),
+            "shaped_r_by_agent": list(shaped_r_by_agent),
+            "phi_s": phi_s,
+            "phi_s_prime": self.mdp.potential_function(self.state, self.mp) if display_phi else None,
+            "num_steps": num_steps,
+            "event_counts": {event_type: list(event_counts[event_idx]) for event_idx, event_type in enumerate(EVENT_TYPES)}
+        }
+        if done: self._add_episode_info(env_info)
+
+        return (self.state, sum(sparse_r_by_agent), done, env_info)
+
+    def step_repeat(self, joint_action, num_steps, joint_agent_action_info=None, display_phi=False):
+        """Repeats the same joint action for `num_steps` steps (action-repeat). See `step_n` for the returned info"""
+        return self.step_n(itertools.repeat(joint_action, num_steps), joint_agent_action_info, display_phi)
+
+    def fast_forward(self, max_ticks=None, stop_on_soup_ready=True):
+        """Advances the env as if all agents played STAY, without stepping one tick at a time.
+
+        Stops at the first of: the horizon, `max_ticks` timesteps (if given), or a cooking soup becoming
+        ready (if stop_on_soup_ready). As STAY timesteps yield no rewards or events, the game stats are
+        left unchanged. The return value has the same format as `step_n`.
+        """
+        assert not self.is_done()
+        num_ticks = int(self.horizon - self.state.timestep)
+        if max_ticks is not None:
+            num_ticks = min(num_ticks, max_ticks)
+        if stop_on_soup_ready:
+            ticks_until_soup_ready = self.mdp.ticks_until_next_soup_ready(self.state)
+            if ticks_until_soup_ready is not None:
+                num_ticks = min(num_ticks, ticks_until_soup_ready)
+
+        self.state = self.mdp.fast_forward_state(self.state, num_ticks)
+        done = self.is_done()
+        num_players = self.mdp.num_players
+        env_info = {
+            "agent_infos": [{} for _ in range(num_players)],
+            "sparse_r_by_agent": [0] * num_players,
+            "shaped_r_by_agent": [0] * num_players,
+            "phi_s": None,
+            "phi_s_prime": None,
+            "num_steps": num_ticks,
+            "event_counts": {event_type: [0] * num_players for event_type in EVENT_TYPES}
+        }
+        if done: self._add_episode_info(env_info)
+
+        return (self.state, 0, done, env_info)
+
+    def _apply_transition(self, joint_action, display_phi=False):
+        """Transitions the current state with joint_action and updates the game stats, returning the mdp infos"""
+        mp = self.mp if display_phi else None
+        next_state, mdp_infos = self.mdp.get_state_transition(self.state, joint_action, display_phi, mp)
+
+        # Update game_stats
+        self._update_game_stats(mdp_infos)
+
+        # Update state
+        self.state = next_state
+        return mdp_infos
 
     def lossless_state_encoding_mdp(self, state):
         """
@@ -238,21 +349,91 @@ class OvercookedEnv(object):
         """
         start_state_kwargs = start_state_kwargs or {}
         if regen_mdp:
-            self.mdp = self.mdp_generator_fn(outside_info)
-            self._mlam = None
-            self._mp = None
+            new_mdp = self.mdp_generator_fn(outside_info)
+            # Planners are expensive to build, so keep them when the generator returns the same mdp, or one with
+            # the same dynamics (i.e. the same fingerprint), in which case they are pointed at the new mdp
+            if new_mdp is not self.mdp:
+                if self._mlam is None and self._mp is None or new_mdp.fingerprint != self.mdp.fingerprint:
+                    self._mlam = None
+                    self._mp = None
+                    if isinstance(self.mdp_generator_fn, MdpPrefetcher):
+                        assert self.mdp_generator_fn.mlam_params == self.mlam_params, \
+                            "The MdpPrefetcher must compute the planners with the env's mlam_params"
+                        self._mlam = self.mdp_generator_fn.get_mlam(new_mdp)
+                else:
+                    self._rebind_planners(new_mdp)
+            self.mdp = new_mdp
         if self.start_state_fn is None:
-            self.state = self.mdp.get_standard_start_state(reset_info=reset_info)
+            if reset_info:
+                self.state = self.mdp.get_standard_start_state(reset_info=reset_info)
+            else:
+                self.state = self._get_start_state_template().deepcopy()
             # self.state = self.mdp.get_constrained_random_start_states(reset_info=reset_info)
         else:
             self.state = self.start_state_fn(**start_state_kwargs)
+        self._reset_game_stats()
+
+    def _get_start_state_template(self):
+        """The standard start state of the current mdp, cached as long as the mdp object doesn't change"""
+        if self._start_state_template is None or self._start_state_template[0] is not self.mdp:
+            self._start_state_template = (self.mdp, self.mdp.get_standard_start_state(reset_info={}))
+        return self._start_state_template[1]
+
+    def _rebind_planners(self, mdp):
+        """Points the planners at `mdp`, which must have the same dynamics as the mdp they were computed on"""
+        planners = [] if self._mlam is None else \
+            [self._mlam, self._mlam.joint_motion_planner, self._mlam.motion_planner]
+        if self._mp is not None:
+            planners.append(self._mp)
+        for planner in planners:
+            planner.mdp = mdp
+
+    def _reset_game_stats(self):
+        """
+        Clears the game stats in place, reusing the preallocated dict (which is only rebuilt when the number of
+        players changes). References to self.game_stats are then emptied too: the stats of an episode are kept
+        by the copy returned in its episode info (see `_add_episode_info`)
+        """
+        num_players = self.mdp.num_players
+        if self.game_stats is None or len(self.game_stats["cumulative_sparse_rewards_by_agent"]) != num_players:
+            events_dict = {k: [[] for _ in range(num_players)] for k in EVENT_TYPES}
+            rewards_dict = {
+                "cumulative_sparse_rewards_by_agent": np.zeros(num_players),
+                "cumulative_shaped_rewards_by_agent": np.zeros(num_players)
+            }
+            self.game_stats = {**events_dict, **rewards_dict}
+            return
+        for event_type in EVENT_TYPES:
+            for event_timesteps in self.game_stats[event_type]:
+                event_timesteps.clear()
+        self.game_stats["cumulative_sparse_rewards_by_agent"][:] = 0
+        self.game_stats["cumulative_shaped_rewards_by_agent"][:] = 0
+
+    def snapshot(self):
+        """
+        Returns an opaque token capturing the current state (and so timestep) and game stats, that can be passed
+        to `restore` to go back to this point of the episode, e.g. for tree search. The mdp and planners are not copied.
 
-        events_dict = {k: [[] for _ in range(self.mdp.num_players)] for k in EVENT_TYPES}
-        rewards_dict = {
-            "cumulative_sparse_rewards_by_agent": np.zeros(self.mdp.num_players),
-            "cumulative_shaped_rewards_by_agent": np.zeros(self.mdp.num_players)
-        }
-        self.game_stats = {**events_dict, **rewards_dict}
+        The state is stored by reference, as transitions never modify states in place: avoid mutating
+        self.state directly while holding a snapshot of it.
+        """
+        # Event timesteps flattened in EVENT_TYPES order, then by agent
+        events = tuple(map(tuple, itertools.chain.from_iterable(map(self.game_stats.__getitem__, EVENT_TYPES))))
+        return (self.mdp, self.state, events,
+                self.game_stats["cumulative_sparse_rewards_by_agent"].copy(),
+                self.game_stats["cumulative_shaped_rewards_by_agent"].copy())
+
+    def restore(self, token):
+        """Restores the state and game stats captured by `snapshot`. The env must not have changed mdp since."""
+        mdp, state, events, cumulative_sparse_rewards, cumulative_shaped_rewards = token
+        assert mdp is self.mdp, "Cannot restore a snapshot taken on a different mdp"
+        self.state = state
+        # Stats are restored in place, like they are cleared by reset
+        for event_timesteps, snapshot_timesteps in zip(
+                itertools.chain.from_iterable(map(self.game_stats.__getitem__, EVENT_TYPES)), events):
+            event_timesteps[:] = snapshot_timesteps
+        self.game_stats["cumulative_sparse_rewards_by_agent"][:] = cumulative_sparse_rewards
+        self.game_stats["cumulative_shaped_rewards_by_agent"][:] = cumulative_shaped_rewards
 
     def is_done(self):
         """Whether the episode is over."""
@@ -286,12 +467,17 @@ class OvercookedEnv(object):
         return env_info
 
     def _add_episode_info(self, env_info):
+        # The episode info gets its own copy of the stats, as self.game_stats is cleared in place by reset
+        game_stats = {event_type: [list(event_timesteps) for event_timesteps in self.game_stats[event_type]]
+                      for event_type in EVENT_TYPES}
+        game_stats["cumulative_sparse_rewards_by_agent"] = self.game_stats["cumulative_sparse_rewards_by_agent"].copy()
+        game_stats["cumulative_shaped_rewards_by_agent"] = self.game_stats["cumulative_shaped_rewards_by_agent"].copy()
         env_info["episode"] = {
-            "ep_game_stats": self.game_stats,
-            "ep_sparse_r": sum(self.game_stats["cumulative_sparse_rewards_by_agent"]),
-            "ep_shaped_r": sum(self.game_stats["cumulative_shaped_rewards_by_agent"]),
-            "ep_sparse_r_by_agent": self.game_stats["cumulative_sparse_rewards_by_agent"],
-            "ep_shaped_r_by_agent": self.game_stats["cumulative_shaped_rewards_by_agent"],
+            "ep_game_stats": game_stats,
+            "ep_sparse_r": sum(game_stats["cumulative_sparse_rewards_by_agent"]),
+            "ep_shaped_r": sum(game_stats["cumulative_shaped_rewards_by_agent"]),
+            "ep_sparse_r_by_agent": game_stats["cumulative_sparse_rewards_by_agent"],
+            "ep_shaped_r_by_agent": game_stats["cumulative_shaped_rewards_by_agent"],
             "ep_length": self.state.timestep
         }
         return env_info
@@ -321,8 +507,10 @@ class OvercookedEnv(object):
         self.state = start_state
         done = False
         if display: print("Starting state\n{}".format(self))
+        # Game stats and info dicts are not needed, as the env is reset at the end
         for joint_action in joint_action_plan:
-            self.step(joint_action)
+            assert not self.is_done()
+            self.state, _ = self.mdp.get_state_transition(self.state, joint_action)
             done = self.is_done()
             if display: print(self)
             if done: break
@@ -336,6 +524,7 @@ class OvercookedEnv(object):
         Trajectory returned will a list of state-action pairs (s_t, joint_a_t, r_t, done_t, info_t).
         """
         assert self.state.timestep == 0, "Did not reset environment before running agents"
+        assert not display or self.info_dict_level == "full", "Displaying rollouts requires full info dicts"
         trajectory = []
         done = False
         # default is to not print to file
@@ -372,7 +561,8 @@ class OvercookedEnv(object):
         return np.array(trajectory, dtype=object), self.state.timestep, total_sparse, total_shaped
 
     def get_rollouts(self, agent_pair, num_games, display=False, dir=None, final_state=False, display_phi=False,
-                     display_until=np.inf, metadata_fn=None, metadata_info_fn=None, info=True):
+                     display_until=np.inf, metadata_fn=None, metadata_info_fn=None, info=True, num_workers=1, seed=None,
+                     lockstep_games=1, compact_states=False):
         """
         Simulate `num_games` number rollouts with the current agent_pair and returns processed
         trajectories.
@@ -383,20 +573,41 @@ class OvercookedEnv(object):
         metadata_fn returns some metadata information computed at the end of each trajectory based on
         some of the trajectory data.
 
+        num_workers > 1 shards the games across a pool of forked processes, each of which inherits the env
+        (with its mdp and already loaded planners) and the agent pair. Games are then always seeded (game i
+        with seed + i, and seed drawn from np.random if not given) so that results do not depend on the
+        number of workers. If a seed is given, games are also seeded when running sequentially.
+
+        lockstep_games > 1 advances that many games at a time in lockstep, querying each agent once per
+        timestep for all the games' states through AgentGroup.joint_actions (e.g. so that NN policies do one
+        forward pass per timestep). Agents should then not keep trajectory-specific history. If a seed is given,
+        the reset of game i is seeded with seed + i as in the other modes, so that games start from the same
+        states. However, the random draws of stochastic agents are then interleaved across the games of a batch,
+        so their trajectories differ from the other modes' (and depend on lockstep_games).
+
+        compact_states=True (or "actions") stores each episode's states as an ActionTrajectory (start state, joint
+        action indices and periodic checkpoints, replaying the dynamics on access) rather than as an array of states,
+        and compact_states="deltas" as DeltaEncodedStates (periodic keyframes with state deltas in between, which
+        doesn't need the mdp to access states).
+
         NOTE: this is the standard trajectories format used throughout the codebase
         """
         trajectories = {k: [] for k in DEFAULT_TRAJ_KEYS}
         metadata_fn = (lambda x: {}) if metadata_fn is None else metadata_fn
         metadata_info_fn = (lambda x: "") if metadata_info_fn is None else metadata_info_fn
-        range_iterator = tqdm.trange(num_games, desc="", leave=True) if info else range(num_games)
-        for i in range_iterator:
-            agent_pair.set_mdp(self.mdp)
-
-            rollout_info = self.run_agents(agent_pair, display=display, dir=dir, include_final_state=final_state,
-                                           display_phi=display_phi, display_until=display_until)
+        summary = RolloutSummary()
+        rollouts = self._get_rollouts_iterator(agent_pair, num_games, display, dir, final_state, display_phi,
+                                               display_until, num_workers, seed, lockstep_games)
+        range_iterator = tqdm.tqdm(rollouts, total=num_games, desc="", leave=True) if info else rollouts
+        for rollout_info in range_iterator:
             trajectory, time_taken, tot_rews_sparse, _tot_rews_shaped = rollout_info
             obs, actions, rews, dones, infos = trajectory.T[0], trajectory.T[1], trajectory.T[2], trajectory.T[3], \
             trajectory.T[4]
+            if compact_states == "deltas":
+                obs = DeltaEncodedStates(obs)
+            elif compact_states:
+                # The last joint action either leads out of the stored states, or is the final state's (None, None)
+                obs = ActionTrajectory(self.mdp, obs[0], actions[:-1], states=obs)
             trajectories["ep_states"].append(obs)
             trajectories["ep_actions"].append(actions)
             trajectories["ep_rewards"].append(rews)
@@ -408,22 +619,21 @@ class OvercookedEnv(object):
             trajectories["env_params"].append(self.env_params)
             trajectories["metadatas"].append(metadata_fn(rollout_info))
 
-            # we do not need to regenerate MDP if we are trying to generate a series of rollouts using the same MDP
-            # Basically, the FALSE here means that we are using the same layout and starting positions
-            # (if regen_mdp == True, resetting will call mdp_gen_fn to generate another layout & starting position)
-            self.reset(regen_mdp=False)
-            agent_pair.reset()
-
             if info:
-                mu, se = mean_and_std_err(trajectories["ep_returns"])
-                description = "Avg rew: {:.2f} (std: {:.2f}, se: {:.2f}); avg len: {:.2f}; ".format(
-                    mu, np.std(trajectories["ep_returns"]), se, np.mean(trajectories["ep_lengths"]))
-                description += metadata_info_fn(trajectories["metadatas"])
+                summary.add_episode_info(infos[time_taken - 1]["episode"])
+                description = summary.description() + metadata_info_fn(trajectories["metadatas"])
                 range_iterator.set_description(description)
                 range_iterator.refresh()
 
         # Converting to numpy arrays
+        ep_states = trajectories.pop("ep_states")
         trajectories = {k: np.array(v) for k, v in trajectories.items()}
+        if compact_states:
+            # np.array would expand the (sequence-like) compact states into arrays of states
+            trajectories["ep_states"] = np.empty(len(ep_states), dtype=object)
+            trajectories["ep_states"][:] = ep_states
+        else:
+            trajectories["ep_states"] = np.array(ep_states)
 
         # Merging all metadata dictionaries, assumes same keys throughout all
         trajectories["metadatas"] = append_dictionaries(trajectories["metadatas"])
@@ -433,6 +643,277 @@ class OvercookedEnv(object):
         AgentEvaluator.check_trajectories(trajectories, verbose=info)
         return trajectories
 
+    def get_rollout_summary(self, agent_pair, num_games, info=True, num_workers=1, seed=None, lockstep_games=1):
+        """
+        Same as get_rollouts, but only returns a RolloutSummary of the episodes (returns, lengths, event counts)
+        rather than keeping all trajectories in memory.
+        """
+        summary = RolloutSummary()
+        rollouts = self._get_rollouts_iterator(agent_pair, num_games, num_workers=num_workers, seed=seed,
+                                               lockstep_games=lockstep_games)
+        range_iterator = tqdm.tqdm(rollouts, total=num_games, desc="", leave=True) if info else rollouts
+        for trajectory, time_taken, _, _ in range_iterator:
+            summary.add_episode_info(trajectory[time_taken - 1][4]["episode"])
+            if info:
+                range_iterator.set_description(summary.description())
+                range_iterator.refresh()
+        return summary
+
+    def get_rollout_arrays(self, agent_pair, num_games, seed=None, info=True, checkpoint_interval=50):
+        """
+        Same as get_rollouts, but returns trajectories as contiguous arrays (e.g. to be directly used for
+        training) that are written in place while the games are played, rather than per-timestep objects:
+            ep_states:          (num_games,) object array of ActionTrajectory, each with the ep_length + 1 states
+                                of the episode (including the final state), stored in compact form
+            ep_actions:         (num_games, horizon, num_players) int8 joint action indices
+            ep_rewards:         (num_games, horizon) float32 sparse rewards
+            ep_dones:           (num_games, horizon) bool
+            ep_returns, ep_lengths: (num_games,) arrays
+            ep_episode_infos:   the "episode" info of each game (as returned by `step` when done)
+            mdp_params, env_params: as in get_rollouts
+        Past the end of an episode, actions are -1, rewards 0 and dones True. Per-timestep infos are not kept,
+        so the env's info_dict_level can be set to "none".
+
+        seed: if given, game i is run after seeding np.random with seed + i
+        """
+        assert self.horizon < MAX_HORIZON, "Rollout arrays require a finite horizon"
+        horizon, num_players = int(self.horizon), self.mdp.num_players
+        trajectories = {
+            "ep_states": np.empty(num_games, dtype=object),
+            "ep_actions": np.full((num_games, horizon, num_players), -1, dtype=np.int8),
+            "ep_rewards": np.zeros((num_games, horizon), dtype=np.float32),
+            "ep_dones": np.ones((num_games, horizon), dtype=np.bool_),
+            "ep_returns": np.zeros(num_games),
+            "ep_lengths": np.zeros(num_games, dtype=int),
+            "ep_episode_infos": [],
+            "mdp_params": [],
+            "env_params": []
+        }
+        summary = RolloutSummary()
+        range_iterator = tqdm.trange(num_games, desc="", leave=True) if info else range(num_games)
+        for i in range_iterator:
+            if seed is not None:
+                np.random.seed(seed + i)
+                self.reset(regen_mdp=False)
+                agent_pair.reset()
+            agent_pair.set_mdp(self.mdp)
+            action_trajectory, episode_info = self._run_agents_into_arrays(
+                agent_pair, trajectories["ep_actions"][i], trajectories["ep_rewards"][i], trajectories["ep_dones"][i],
+                checkpoint_interval)
+            trajectories["ep_states"][i] = action_trajectory
+            trajectories["ep_returns"][i] = episode_info["ep_sparse_r"]
+            trajectories["ep_lengths"][i] = episode_info["ep_length"]
+            trajectories["ep_episode_infos"].append(episode_info)
+            trajectories["mdp_params"].append(self.mdp.mdp_params)
+            trajectories["env_params"].append(self.env_params)
+            if info:
+                summary.add_episode_info(episode_info)
+                range_iterator.set_description(summary.description())
+                range_iterator.refresh()
+
+            self.reset(regen_mdp=False)
+            agent_pair.reset()
+        return trajectories
+
+    def _run_agents_into_arrays(self, agent_pair, actions, rewards, dones, checkpoint_interval):
+        """
+        Plays an episode, writing the joint action indices, rewards and dones of each timestep into the given
+        (horizon-sized) arrays. Returns the states as an ActionTrajectory, and the episode info
+        """
+        assert self.state.timestep == 0, "Did not reset environment before running agents"
+        action_trajectory = ActionTrajectory(self.mdp, self.state, checkpoint_interval=checkpoint_interval)
+        done = False
+        t = 0
+        while not done:
+            joint_action_and_infos = agent_pair.joint_action(self.state)
+            a_t, a_info_t = zip(*joint_action_and_infos)
+            s_tp1, r_t, done, info = self.step(a_t, a_info_t)
+            action_trajectory.append(a_t, s_tp1)
+            actions[t] = action_trajectory.joint_actions[t]
+            rewards[t] = r_t
+            dones[t] = done
+            t += 1
+        return action_trajectory, info["episode"]
+
+    def _get_rollouts_iterator(self, agent_pair, num_games, display=False, dir=None, final_state=False,
+                               display_phi=False, display_until=np.inf, num_workers=1, seed=None, lockstep_games=1):
+        """Iterator over the run_agents output of each game, see get_rollouts for the arguments"""
+        run_kwargs = {"display": display, "dir": dir, "include_final_state": final_state,
+                      "display_phi": display_phi, "display_until": display_until}
+        if lockstep_games > 1:
+            assert num_workers == 1, "Lockstep rollouts are not supported with multiple workers"
+            assert not display and not display_phi, "Displaying rollouts is not supported with lockstep games"
+            return self._get_lockstep_rollouts(agent_pair, num_games, lockstep_games, seed, final_state)
+        elif num_workers > 1:
+            assert not display, "Displaying rollouts is not supported with multiple workers"
+            if seed is None:
+                seed = np.random.randint(2 ** 31 - num_games)
+            return self._get_parallel_rollouts(agent_pair, num_games, num_workers, seed, run_kwargs)
+        else:
+            return self._get_sequential_rollouts(agent_pair, num_games, seed, run_kwargs)
+
+    def _get_sequential_rollouts(self, agent_pair, num_games, seed, run_kwargs):
+        """Yields the run_agents output of each game, leaving the env reset once the caller is done with it"""
+        for i in range(num_games):
+            if seed is not None:
+                rollout_info = self._run_seeded_rollout(agent_pair, seed + i, run_kwargs)
+            else:
+                agent_pair.set_mdp(self.mdp)
+                rollout_info = self.run_agents(agent_pair, **run_kwargs)
+            yield rollout_info
+
+            # we do not need to regenerate MDP if we are trying to generate a series of rollouts using the same MDP
+            # Basically, the FALSE here means that we are using the same layout and starting positions
+            # (if regen_mdp == True, resetting will call mdp_gen_fn to generate another layout & starting position)
+            self.reset(regen_mdp=False)
+            agent_pair.reset()
+
+    def _get_parallel_rollouts(self, agent_pair, num_games, num_workers, seed, run_kwargs):
+        """Yields the run_agents output of each game in order, as computed by a pool of forked workers"""
+        global _ROLLOUT_WORKER_ARGS
+        # Set before forking, so that the env and agents (which might not be picklable) are inherited by the workers
+        _ROLLOUT_WORKER_ARGS = (self, agent_pair, run_kwargs)
+        try:
+            with multiprocessing.get_context("fork").Pool(num_workers) as pool:
+                for rollout_info in pool.imap(_rollout_worker, range(seed, seed + num_games)):
+                    yield rollout_info
+        finally:
+            _ROLLOUT_WORKER_ARGS = None
+
+    def _get_lockstep_rollouts(self, agent_group, num_games, lockstep_games, seed, include_final_state):
+        """Yields run_agents-like outputs for each game, running batches of `lockstep_games` games in lockstep"""
+        envs = [OvercookedEnv.from_mdp(self.mdp, start_state_fn=self.start_state_fn, horizon=self.horizon,
+                                       mlam_params=self.mlam_params, info_level=0,
+                                       info_dict_level=self.info_dict_level)
+                for _ in range(min(lockstep_games, num_games))]
+        for batch_start in range(0, num_games, lockstep_games):
+            batch_envs = envs[:num_games - batch_start]
+            for i, env in enumerate(batch_envs):
+                # Seeded per game as in the other modes, so that game i starts from the same state
+                if seed is not None:
+                    np.random.seed(seed + batch_start + i)
+                env.reset(regen_mdp=False)
+            agent_group.reset()
+            agent_group.set_mdp(self.mdp)
+
+            trajectories = [[] for _ in batch_envs]
+            active_games = list(range(len(batch_envs)))
+            while active_games:
+                states = [batch_envs[i].state for i in active_games]
+                joint_actions_and_infos = agent_group.joint_actions(states)
+                still_active = []
+                for i, s_t, joint_action_and_infos in zip(active_games, states, joint_actions_and_infos):
+                    a_t, a_info_t = zip(*joint_action_and_infos)
+                    assert all(a in Action.ALL_ACTIONS for a in a_t)
+                    assert all(type(a_info) is dict for a_info in a_info_t)
+                    s_tp1, r_t, done, info = batch_envs[i].step(a_t, a_info_t)
+                    trajectories[i].append((s_t, a_t, r_t, done, info))
+                    if not done:
+                        still_active.append(i)
+                active_games = still_active
+
+            for env, trajectory in zip(batch_envs, trajectories):
+                if include_final_state:
+                    trajectory.append((env.state, (None, None), 0, True, None))
+                total_sparse = sum(env.game_stats["cumulative_sparse_rewards_by_agent"])
+                total_shaped = sum(env.game_stats["cumulative_shaped_rewards_by_agent"])
+                yield np.array(trajectory, dtype=object), env.state.timestep, total_sparse, total_shaped
+
+    def _run_seeded_rollout(self, agent_pair, game_seed, run_kwargs):
+        np.random.seed(game_seed)
+        self.reset(regen_mdp=False)
+        agent_pair.reset()
+        agent_pair.set_mdp(self.mdp)
+        return self.run_agents(agent_pair, **run_kwargs)
+
+    def rollout_branches(self, start_state, branches, num_steps, include_states=False):
+        """
+        Rolls out K alternative continuations ("branches") of `start_state` for up to `num_steps` steps each,
+        e.g. for counterfactual analysis of states taken from recorded trajectories. start_state can be at any
+        timestep, and the env's own state and game stats are left untouched.
+
+        branches (list): each branch is either a sequence of joint actions, or an AgentGroup choosing the joint
+            actions (which is set to the env's mdp and reset first). Branches are stepped in lockstep, and each one
+            stops early when reaching the env horizon or the end of its joint action sequence. At each step, the
+            branches played by the same AgentGroup are batched into one AgentGroup.joint_actions call, so an
+            AgentGroup can be shared by many branches if its agents don't keep trajectory-specific history.
+
+        Returns a dict of arrays indexed by branch:
+            sparse_r_by_agent:  (K, num_players) sparse rewards accumulated by each agent
+            shaped_r_by_agent:  (K, num_players) shaped rewards accumulated by each agent
+            lengths:            (K,) number of steps taken
+            joint_actions:      (K, num_steps, num_players) action indices, padded with -1
+            final_states:       (K,) object array of the last state reached
+            states:             (K, num_steps + 1) object array of visited states padded with None,
+                                only if include_states
+        """
+        num_branches, num_players = len(branches), self.mdp.num_players
+        num_steps = int(min(num_steps, max(self.horizon - start_state.timestep, 0)))
+        action_iterators = []
+        agent_groups = {}
+        for branch in branches:
+            if hasattr(branch, "joint_actions"):
+                if id(branch) not in agent_groups:
+                    branch.set_mdp(self.mdp)
+                    branch.reset()
+                    agent_groups[id(branch)] = branch
+                action_iterators.append(None)
+            else:
+                action_iterators.append(iter(branch))
+
+        sparse_r_by_agent = np.zeros((num_branches, num_players))
+        shaped_r_by_agent = np.zeros((num_branches, num_players))
+        lengths = np.zeros(num_branches, dtype=int)
+        joint_actions = np.full((num_branches, num_steps, num_players), -1, dtype=int)
+        curr_states = [start_state] * num_branches
+        if include_states:
+            states = np.full((num_branches, num_steps + 1), None, dtype=object)
+            states[:, 0] = curr_states
+
+        active_branches = list(range(num_branches))
+        for t in range(num_steps):
+            # The states of all active branches of each AgentGroup are queried at once
+            branches_by_group = {}
+            for k in active_branches:
+                if action_iterators[k] is None:
+                    branches_by_group.setdefault(id(branches[k]), []).append(k)
+            agent_joint_actions = {}
+            for group_id, group_branches in branches_by_group.items():
+                joint_actions_and_infos = agent_groups[group_id].joint_actions([curr_states[k] for k in group_branches])
+                for k, joint_action_and_infos in zip(group_branches, joint_actions_and_infos):
+                    agent_joint_actions[k] = tuple(a for a, _ in joint_action_and_infos)
+
+            still_active = []
+            for k in active_branches:
+                if action_iterators[k] is None:
+                    joint_action = agent_joint_actions[k]
+                else:
+                    joint_action = next(action_iterators[k], None)
+                    if joint_action is None:
+                        continue
+                curr_states[k], mdp_infos = self.mdp.get_state_transition(curr_states[k], joint_action)
+                sparse_r_by_agent[k] += mdp_infos["sparse_reward_by_agent"]
+                shaped_r_by_agent[k] += mdp_infos["shaped_reward_by_agent"]
+                joint_actions[k, t] = [Action.ACTION_TO_INDEX[a] for a in joint_action]
+                lengths[k] += 1
+                if include_states:
+                    states[k, t + 1] = curr_states[k]
+                still_active.append(k)
+            active_branches = still_active
+
+        final_states = np.empty(num_branches, dtype=object)
+        final_states[:] = curr_states
+        results = {
+            "sparse_r_by_agent": sparse_r_by_agent,
+            "shaped_r_by_agent": shaped_r_by_agent,
+            "lengths": lengths,
+            "joint_actions": joint_actions,
+            "final_states": final_states
+        }
+        if include_states:
+            results["states"] = states
+        return results
+
     ####################
     # TRAJECTORY UTILS #
     ####################
@@ -505,6 +986,119 @@ class OvercookedEnv(object):
         return stuck_matrix
 
 
+# Env, agent pair and run_agents kwargs inherited by forked get_rollouts workers
+_ROLLOUT_WORKER_ARGS = None
+
+def _rollout_worker(game_seed):
+    env, agent_pair, run_kwargs = _ROLLOUT_WORKER_ARGS
+    return env._run_seeded_rollout(agent_pair, game_seed, run_kwargs)
+
+
+class OvercookedVecEnv(object):
+    """
+    Steps N OvercookedEnvs (possibly of different layouts) in lockstep within a single process,
+    automatically resetting the ones whose episode ended. As observations are stacked, all layouts must give
+    observations of the same shape (e.g. for lossless encodings, layouts of the same size).
+
+    Observations are written into a preallocated (N, num_players, *obs_shape) array, which is reused (and so
+    overwritten) at every step: copy it if it needs to be kept around. Observations are computed either:
+        - with featurize_fn(mdp, state), which returns the tuple of per-player observations (as for the
+          gym wrapper below), for each env separately
+        - or with batch_featurize_fn(mdp, states), which returns the (len(states), num_players, *obs_shape)
+          observations for states that share the same mdp, called once per group of envs with the same mdp
+          (e.g. `lambda mdp, states: mdp.lossless_state_encodings(states)`)
+    If neither is given, no observations are computed, and the current states are accessible through `states`.
+
+    E.g. of how to use OvercookedVecEnv:
+    > vec_env = OvercookedVecEnv([OvercookedEnv.from_mdp(mdp, horizon=400) for mdp in mdps], featurize_fn)
+    > obs = vec_env.reset()
+    > obs, rewards, dones, infos = vec_env.step(actions)  # actions of shape (N, num_players), in index format
+    """
+
+    def __init__(self, envs, featurize_fn=None, batch_featurize_fn=None, obs_dtype=np.float32):
+        assert len(envs) > 0, "OvercookedVecEnv requires at least one env"
+        assert featurize_fn is None or batch_featurize_fn is None, "Only one featurization function can be given"
+        self.envs = envs
+        self.num_envs = len(envs)
+        self.num_players = envs[0].mdp.num_players
+        assert all(env.mdp.num_players == self.num_players for env in envs), "All envs must have the same number of players"
+        self.featurize_fn = featurize_fn
+        self.batch_featurize_fn = batch_featurize_fn
+        self.obs_dtype = obs_dtype
+        self.obs = None
+        self.rewards = np.zeros(self.num_envs)
+        self.dones = np.zeros(self.num_envs, dtype=bool)
+        if featurize_fn is not None or batch_featurize_fn is not None:
+            # Fail early rather than with a broadcasting error mid-step
+            self._update_obs()
+
+    @property
+    def states(self):
+        return [env.state for env in self.envs]
+
+    @property
+    def mdp_groups(self):
+        """List of lists of indices of envs sharing the same mdp object"""
+        groups = {}
+        for env_idx, env in enumerate(self.envs):
+            groups.setdefault(id(env.mdp), []).append(env_idx)
+        return list(groups.values())
+
+    def reset(self, regen_mdp=True):
+        for env in self.envs:
+            env.reset(regen_mdp=regen_mdp)
+        self.dones[:] = False
+        self._update_obs()
+        return self.obs
+
+    def step(self, actions):
+        """
+        actions: (N, num_players) array-like of action indices
+
+        Returns (obs, rewards, dones, infos), where rewards are the sparse rewards summed across agents.
+        The env info of an env whose episode ended contains its final state under "terminal_state",
+        while its observation is the one of the start state of the next episode.
+        """
+        actions = np.asarray(actions)
+        assert actions.shape == (self.num_envs, self.num_players), \
+            "Expected actions of shape {}, got {}".format((self.num_envs, self.num_players), actions.shape)
+        infos = []
+        for env_idx, (env, env_actions) in enumerate(zip(self.envs, actions)):
+            joint_action = tuple(Action.INDEX_TO_ACTION[a] for a in env_actions)
+            next_state, reward, done, env_info = env.step(joint_action)
+            self.rewards[env_idx] = reward
+            self.dones[env_idx] = done
+            if done:
+                env_info["terminal_state"] = next_state
+                env.reset()
+            infos.append(env_info)
+        self._update_obs()
+        return self.obs, self.rewards, self.dones, infos
+
+    def _update_obs(self):
+        if self.featurize_fn is not None:
+            for env_idx, env in enumerate(self.envs):
+                players_obs = self.featurize_fn(env.mdp, env.state)
+                self._check_obs_shape(env_idx, np.shape(players_obs[0]))
+                self.obs[env_idx] = players_obs
+        elif self.batch_featurize_fn is not None:
+            for group in self.mdp_groups:
+                mdp = self.envs[group[0]].mdp
+                group_obs = self.batch_featurize_fn(mdp, [self.envs[env_idx].state for env_idx in group])
+                self._check_obs_shape(group[0], np.shape(group_obs)[2:])
+                self.obs[group] = group_obs
+
+    def _check_obs_shape(self, env_idx, obs_shape):
+        """Allocates the observations buffer with the first observation shape, which all others must match"""
+        obs_shape = tuple(obs_shape)
+        if self.obs is None:
+            self.obs = np.zeros((self.num_envs, self.num_players) + obs_shape, dtype=self.obs_dtype)
+        elif self.obs.shape[2:] != obs_shape:
+            raise ValueError("Observations of env {} (layout {}) have shape {}, while other envs' have shape {}: "
+                             "all envs must have observations of the same shape".format(
+                                 env_idx, self.envs[env_idx].mdp.layout_name, obs_shape, self.obs.shape[2:]))
+
+
 class Overcooked(gym.Env):
     """
     Wrapper for the Env class above that is SOMEWHAT compatible with the standard gym API.
@@ -579,6 +1173,9 @@ class Overcooked(gym.Env):
         else:
             both_agents_ob = (ob_p1, ob_p0)
 
+        # The shared info dict returned with info_dict_level "none" must not be modified
+        if env_info is self.base_env._shared_info:
+            env_info = {}
         env_info["policy_agent_idx"] = self.agent_idx
 
         if "episode" in env_info.keys():
@@ -613,3 +1210,99 @@ class Overcooked(gym.Env):
 
     def render(self, mode="human", close=False):
         pass
+
+
+class OvercookedMultiAgent(gym.Env):
+    """
+    Gym-style wrapper for OvercookedEnv with any number of agents, each controlled by a separate policy slot.
+
+    As in the Overcooked wrapper above, the mapping from policy slots to players is randomized at each reset
+    (if randomize_agent_order). It is kept as an index array: policy slot i controls player agent_order[i].
+
+    Observations of all players are written into a single preallocated (num_agents, *obs_shape) buffer in player
+    order, and the per-agent observations returned (ordered by policy slot) are views into it. They are
+    therefore overwritten at the next step or reset: copy them if they need to be kept around.
+    Observations are computed either with featurize_fn(mdp, state), which returns a tuple of per-player
+    observations, or with featurize_into_fn(mdp, state, out), which writes them into `out` directly (in which
+    case obs_shape must be given). If neither is given, observations are the lossless state encodings, written
+    by mdp.lossless_state_encodings without allocating new arrays (directly into the buffer if obs_dtype is
+    np.uint8, and through a preallocated uint8 buffer otherwise).
+    """
+    env_name = "OvercookedMultiAgent-v0"
+
+    def __init__(self, base_env, featurize_fn=None, featurize_into_fn=None, obs_shape=None, randomize_agent_order=True,
+                 obs_dtype=np.float32):
+        assert featurize_fn is None or featurize_into_fn is None, \
+            "Only one of featurize_fn and featurize_into_fn can be given"
+        self.base_env = base_env
+        self.featurize_fn = featurize_fn
+        self.featurize_into_fn = featurize_into_fn
+        self.randomize_agent_order = randomize_agent_order
+        self.num_agents = base_env.mdp.num_players
+        self.agent_order = np.arange(self.num_agents)
+
+        if featurize_fn is None and featurize_into_fn is None:
+            self.featurize_into_fn = self._lossless_featurize_into
+            obs_shape = tuple(base_env.mdp.get_lossless_state_encoding_shape())
+            self._encoding_buffer = np.zeros((1, self.num_agents) + obs_shape, dtype=np.uint8)
+        if obs_shape is None:
+            assert featurize_fn is not None, "obs_shape must be given when using featurize_into_fn"
+            obs_shape = np.shape(featurize_fn(base_env.mdp, base_env.state)[0])
+        self.obs_buffer = np.zeros((self.num_agents,) + tuple(obs_shape), dtype=obs_dtype)
+        # Integer observations can't have infinite bounds
+        max_obs = np.iinfo(obs_dtype).max if np.issubdtype(obs_dtype, np.integer) else float("inf")
+        high = np.ones(obs_shape) * max_obs
+        low = np.zeros(obs_shape)
+        self.observation_space = gym.spaces.Box(low, high, dtype=obs_dtype)
+        self.action_space = gym.spaces.Discrete(len(Action.ALL_ACTIONS))
+        self._joint_action_idxs = np.zeros(self.num_agents, dtype=int)
+        self.reset()
+
+    def step(self, actions):
+        """
+        actions: the action index of each policy slot
+
+        returns:
+            observation: dict with the per-agent observations ordered by policy slot ("agent_obs"),
+                the current state and the agent order
+            reward: the sparse reward, shared by all agents
+        """
+        assert len(actions) == self.num_agents and all(self.action_space.contains(a) for a in actions), \
+            "%r (%s) invalid" % (actions, type(actions))
+        self._joint_action_idxs[self.agent_order] = actions
+        joint_action = tuple(Action.INDEX_TO_ACTION[a] for a in self._joint_action_idxs)
+        next_state, reward, done, env_info = self.base_env.step(joint_action)
+        if env_info is self.base_env._shared_info:
+            env_info = {}
+        env_info["agent_order"] = self.agent_order
+        if "episode" in env_info.keys():
+            env_info["episode"]["agent_order"] = self.agent_order
+        return self._get_obs(), reward, done, env_info
+
+    def reset(self):
+        self.base_env.reset()
+        self.mdp = self.base_env.mdp
+        if self.randomize_agent_order:
+            self.agent_order = np.random.permutation(self.num_agents)
+        return self._get_obs()
+
+    def _get_obs(self):
+        state = self.base_env.state
+        if self.featurize_fn is not None:
+            self.obs_buffer[:] = self.featurize_fn(self.mdp, state)
+        else:
+            self.featurize_into_fn(self.mdp, state, self.obs_buffer)
+        return {"agent_obs": tuple(self.obs_buffer[player_idx] for player_idx in self.agent_order),
+                "overcooked_state": state,
+                "agent_order": self.agent_order}
+
+    def _lossless_featurize_into(self, mdp, state, out):
+        """Default featurize_into_fn, writing the lossless state encodings of all players into `out`"""
+        if out.dtype == np.uint8:
+            mdp.lossless_state_encodings([state], horizon=self.base_env.horizon, out=out[np.newaxis])
+        else:
+            mdp.lossless_state_encodings([state], horizon=self.base_env.horizon, out=self._encoding_buffer)
+            out[:] = self._encoding_buffer[0]
+
+    def render(self, mode="human", close=False):
+        pass
@@ -0,0 +1,183 @@
+import multiprocessing, sys, traceback
+import numpy as np
+from overcooked_ai_py.mdp.overcooked_env import OvercookedVecEnv
+
+
+class OvercookedEnvPool(object):
+    """
+    Runs N OvercookedEnvs split across worker processes, each of which steps its envs in lockstep
+    with an OvercookedVecEnv (auto-resetting finished episodes).
+
+    Observations, rewards, dones and actions live in shared memory arrays, which workers read and write
+    directly: only small control messages go through pipes, rather than pickled states and observations.
+    Workers are forked, so envs and featurization functions don't need to be picklable.
+
+    The arrays returned by `reset` and `step` are the shared buffers themselves, which are overwritten
+    at every step: copy them if they need to be kept around.
+
+    E.g. of how to use OvercookedEnvPool:
+    > with OvercookedEnvPool(envs, featurize_fn, num_workers=4) as pool:
+    >     obs = pool.reset()
+    >     obs, rewards, dones, episodes = pool.step(actions)  # actions of shape (N, num_players), in index format
+    """
+
+    def __init__(self, envs, featurize_fn=None, batch_featurize_fn=None, num_workers=None, obs_dtype=np.float32):
+        """
+        envs (list(OvercookedEnv)):     the N envs to run, which must all have the same number of players
+        featurize_fn, batch_featurize_fn: see OvercookedVecEnv. One of them must be given, and all envs must
+                                        produce observations of the same shape
+        num_workers (int):              number of worker processes, defaults to the number of cpus (at most N)
+        """
+        if sys.version_info < (3, 8):
+            raise RuntimeError("OvercookedEnvPool requires Python 3.8+ (for multiprocessing.shared_memory)")
+        assert featurize_fn is not None or batch_featurize_fn is not None, "A featurization function is required"
+        self.num_envs = len(envs)
+        self.num_players = envs[0].mdp.num_players
+        num_workers = multiprocessing.cpu_count() if num_workers is None else num_workers
+        self.num_workers = max(1, min(num_workers, self.num_envs))
+
+        env = envs[0]
+        if featurize_fn is not None:
+            obs_shape = np.shape(featurize_fn(env.mdp, env.state)[0])
+        else:
+            obs_shape = np.shape(batch_featurize_fn(env.mdp, [env.state]))[2:]
+
+        self._shms = []
+        self.obs = self._shared_array((self.num_envs, self.num_players) + tuple(obs_shape), obs_dtype)
+        self.rewards = self._shared_array((self.num_envs,), np.float64)
+        self.dones = self._shared_array((self.num_envs,), np.bool_)
+        self.actions = self._shared_array((self.num_envs, self.num_players), np.int64)
+
+        self._conns, self._processes = [], []
+        ctx = multiprocessing.get_context("fork")
+        bounds = np.linspace(0, self.num_envs, self.num_workers + 1).astype(int)
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            parent_conn, worker_conn = ctx.Pipe()
+            vec_env = OvercookedVecEnv(envs[start:end], featurize_fn, batch_featurize_fn, obs_dtype)
+            process = ctx.Process(target=_env_pool_worker, daemon=True,
+                                  args=(worker_conn, vec_env, start, end, self.obs, self.rewards, self.dones, self.actions))
+            process.start()
+            worker_conn.close()
+            self._conns.append(parent_conn)
+            self._processes.append(process)
+        self.closed = False
+        self._waiting = False
+
+    def _shared_array(self, shape, dtype):
+        # Only available from Python 3.8, so imported here rather than when loading the module
+        from multiprocessing import shared_memory
+        nbytes = max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize)
+        shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        self._shms.append(shm)
+        return np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+    def reset(self):
+        self._send_all("reset")
+        self._recv_all()
+        return self.obs
+
+    def step_async(self, actions):
+        """Starts stepping all envs with the (N, num_players) action indices, without waiting for the workers"""
+        self.actions[:] = actions
+        self._send_all("step")
+        self._waiting = True
+
+    def step_wait(self):
+        """
+        Waits for the step started by `step_async`, and returns (obs, rewards, dones, episodes), where episodes
+        is a list of (env_idx, ep_sparse_r, ep_shaped_r, ep_length) tuples for the episodes that just ended
+        """
+        episodes = [episode for worker_episodes in self._recv_all() for episode in worker_episodes]
+        return self.obs, self.rewards, self.dones, episodes
+
+    def step(self, actions):
+        self.step_async(actions)
+        return self.step_wait()
+
+    def close(self, timeout=5):
+        """
+        Shuts down the workers, waiting at most `timeout` seconds for each before terminating it, so that
+        closing doesn't hang on workers that died or are stuck
+        """
+        if self.closed:
+            return
+        if self._waiting:
+            # Discard the replies to the pending step, without waiting on workers that won't send one
+            for conn in self._conns:
+                try:
+                    if conn.poll(timeout):
+                        conn.recv()
+                except (EOFError, OSError):
+                    pass
+            self._waiting = False
+        for conn in self._conns:
+            try:
+                conn.send("close")
+            except OSError:
+                pass
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        for conn in self._conns:
+            conn.close()
+        # Drop the numpy views before releasing the shared memory they point to
+        self.obs = self.rewards = self.dones = self.actions = None
+        for shm in self._shms:
+            try:
+                shm.close()
+            except BufferError:
+                # Arrays returned to the caller are still alive, the memory is released along with them
+                pass
+            shm.unlink()
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _send_all(self, command):
+        for conn in self._conns:
+            conn.send(command)
+
+    def _recv_all(self):
+        """Receives the replies of all workers, even if some of them failed, so that no reply is left unread"""
+        results, errors = [], []
+        try:
+            for conn in self._conns:
+                try:
+                    success, result = conn.recv()
+                except (EOFError, OSError):
+                    success, result = False, "The worker process died"
+                if not success:
+                    errors.append(result)
+                results.append(result)
+        finally:
+            self._waiting = False
+        if errors:
+            raise RuntimeError("Env pool worker failed:\n{}".format(errors[0]))
+        return results
+
+
+def _env_pool_worker(conn, vec_env, start, end, obs, rewards, dones, actions):
+    # Make the vec env write directly into this worker's slice of the shared buffers
+    vec_env.obs, vec_env.rewards, vec_env.dones = obs[start:end], rewards[start:end], dones[start:end]
+    while True:
+        command = conn.recv()
+        try:
+            if command == "step":
+                _, _, _, infos = vec_env.step(actions[start:end])
+                episodes = [(start + i, info["episode"]["ep_sparse_r"], info["episode"]["ep_shaped_r"],
+                             info["episode"]["ep_length"]) for i, info in enumerate(infos) if "episode" in info]
+                conn.send((True, episodes))
+            elif command == "reset":
+                vec_env.reset()
+                conn.send((True, None))
+            elif command == "close":
+                conn.close()
+                return
+        except Exception:
+            conn.send((False, traceback.format_exc()))
@@ -1,4 +1,4 @@
-import itertools, copy, warnings
+import itertools, copy, warnings, hashlib, json
 import numpy as np
 from functools import reduce
 from collections import defaultdict, Counter
@@ -271,7 +271,15 @@ class Recipe:
 class ObjectState(object):
     """
     State of an object in OvercookedGridworld.
+
+    NOTE: uses __slots__ and a compact pickle representation (see __reduce__), as
+    trajectories can hold very large numbers of these objects
     """
+    __slots__ = ("name", "_position")
+
+    # Integer codes used for the compact pickle representation of object names
+    NAME_TO_CODE = {'onion': 0, 'tomato': 1, 'dish': 2, 'soup': 3}
+    CODE_TO_NAME = {code: name for name, code in NAME_TO_CODE.items()}
 
     def __init__(self, name, position, **kwargs):
         """
@@ -295,6 +303,15 @@ class ObjectState(object):
     def deepcopy(self):
         return ObjectState(self.name, self.position)
 
+    def __reduce__(self):
+        x, y = self._position
+        return (_object_state_from_compact, (ObjectState.NAME_TO_CODE.get(self.name, self.name), x, y))
+
+    def __setstate__(self, state):
+        # Only used when loading pickles created before the compact representation was introduced
+        for k, v in state.items():
+            setattr(self, k, v)
+
     def __eq__(self, other):
         return isinstance(other, ObjectState) and \
             self.name == other.name and \
@@ -320,6 +337,7 @@ class ObjectState(object):
 
 
 class SoupState(ObjectState):
+    __slots__ = ("_ingredients", "_cooking_tick", "_recipe", "_cook_time")
 
     def __init__(self, position, ingredients=[], cooking_tick=-1, cook_time=None, **kwargs):
         """
@@ -340,6 +358,7 @@ class SoupState(ObjectState):
 
     def __eq__(self, other):
         return isinstance(other, SoupState) and self.name == other.name and self.position == other.position and self._cooking_tick == other._cooking_tick and \
+            len(self._ingredients) == len(other._ingredients) and \
             all([this_i == other_i for this_i, other_i in zip(self._ingredients, other._ingredients)])
 
     def __hash__(self):
@@ -458,16 +477,23 @@ class SoupState(ObjectState):
             raise ValueError("Must add at least one ingredient to soup before you can begin cooking")
         self._cooking_tick = 0
 
-    def cook(self):
+    def cook(self, num_ticks=1):
+        """Advances the cook tick by `num_ticks`, stopping once the soup is ready"""
         if self.is_idle:
             raise ValueError("Must begin cooking before advancing cook tick")
         if self.is_ready:
             raise ValueError("Cannot cook a soup that is already done")
-        self._cooking_tick += 1
+        self._cooking_tick += min(num_ticks, self.cook_time_remaining)
 
     def deepcopy(self):
         return SoupState(self.position, [ingredient.deepcopy() for ingredient in self._ingredients], self._cooking_tick)
 
+    def __reduce__(self):
+        # Ingredients always share the soup's position, so only their name codes are stored
+        x, y = self._position
+        ingredient_codes = tuple(ObjectState.NAME_TO_CODE[ingredient.name] for ingredient in self._ingredients)
+        return (_soup_state_from_compact, (x, y, self._cooking_tick, self._cook_time, ingredient_codes))
+
     def to_dict(self):
         info_dict = super(SoupState, self).to_dict()
         ingrdients_dict = [ingredient.to_dict() for ingredient in self._ingredients]
@@ -531,6 +557,8 @@ class PlayerState(object):
     held_object: ObjectState representing the object held by the player, or
                  None if there is no such object.
     """
+    __slots__ = ("position", "orientation", "held_object")
+
     def __init__(self, position, orientation, held_object=None):
         self.position = tuple(position)
         self.orientation = tuple(orientation)
@@ -573,6 +601,15 @@ class PlayerState(object):
         new_obj = None if self.held_object is None else self.held_object.deepcopy()
         return PlayerState(self.position, self.orientation, new_obj)
 
+    def __reduce__(self):
+        x, y = self.position
+        return (_player_state_from_compact, (x, y, Direction.DIRECTION_TO_INDEX[self.orientation], self.held_object))
+
+    def __setstate__(self, state):
+        # Only used when loading pickles created before the compact representation was introduced
+        for k, v in state.items():
+            setattr(self, k, v)
+
     def __eq__(self, other):
         return isinstance(other, PlayerState) and \
             self.position == other.position and \
@@ -602,6 +639,21 @@ class PlayerState(object):
         return PlayerState(**player_dict)
 
 
+def _object_state_from_compact(name_code, x, y):
+    name = ObjectState.CODE_TO_NAME.get(name_code, name_code)
+    return ObjectState(name, (x, y))
+
+
+def _soup_state_from_compact(x, y, cooking_tick, cook_time, ingredient_codes):
+    position = (x, y)
+    ingredients = [ObjectState(ObjectState.CODE_TO_NAME[code], position) for code in ingredient_codes]
+    return SoupState(position, ingredients, cooking_tick, cook_time)
+
+
+def _player_state_from_compact(x, y, orientation_idx, held_object):
+    return PlayerState((x, y), Direction.INDEX_TO_DIRECTION[orientation_idx], held_object)
+
+
 class OvercookedState(object):
     """A state in OvercookedGridworld."""
     def __init__(self, players, objects, bonus_orders=[], all_orders=[], timestep=0, **kwargs):
@@ -735,12 +787,26 @@ class OvercookedState(object):
 
         return cls.from_players_pos_and_or(dummy_pos_and_or, bonus_orders, all_orders)
 
+    @classmethod
+    def _from_validated(cls, players, objects, bonus_orders, all_orders, timestep):
+        """
+        Builds a state from parts taken from existing states, skipping the (costly) order conversions and
+        checks of __init__. Recipes are immutable and cached, so order lists can share them.
+        """
+        state = cls.__new__(cls)
+        state.players = tuple(players)
+        state.objects = objects
+        state._bonus_orders = list(bonus_orders)
+        state._all_orders = list(all_orders)
+        state.timestep = timestep
+        return state
+
     def deepcopy(self):
-        return OvercookedState(
+        return OvercookedState._from_validated(
             players=[player.deepcopy() for player in self.players],
             objects={pos:obj.deepcopy() for pos, obj in self.objects.items()},
-            bonus_orders=[order.to_dict() for order in self.bonus_orders],
-            all_orders=[order.to_dict() for order in self.all_orders],
+            bonus_orders=self._bonus_orders,
+            all_orders=self._all_orders,
             timestep=self.timestep)
 
     def time_independent_equal(self, other):
@@ -792,6 +858,43 @@ class OvercookedState(object):
         state_dict["objects"] = { ob.position : ob for ob in object_list }
         return OvercookedState(**state_dict)
 
+    def diff(self, prev):
+        """
+        Returns a compact delta such that `prev.apply(delta) == self`, of the form
+            (timestep, changed_players, removed_object_positions, changed_objects, orders)
+        where changed_players is a tuple of (player_idx, PlayerState) pairs, changed_objects a tuple of
+        ObjectStates (placed at their own position), and orders is None if bonus and all orders are unchanged,
+        or a (bonus_orders, all_orders) pair of Recipe tuples otherwise.
+
+        The delta references (and does not copy) this state's player and object states.
+        """
+        assert len(self.players) == len(prev.players), "Can only diff states with the same number of players"
+        changed_players = tuple((idx, player) for idx, (player, prev_player) in enumerate(zip(self.players, prev.players))
+                                if player != prev_player)
+        prev_objects = prev.objects
+        removed_object_positions = tuple(pos for pos in prev_objects if pos not in self.objects)
+        changed_objects = tuple(obj for pos, obj in self.objects.items() if obj != prev_objects.get(pos))
+        if self._bonus_orders == prev._bonus_orders and self._all_orders == prev._all_orders:
+            orders = None
+        else:
+            orders = (tuple(self._bonus_orders), tuple(self._all_orders))
+        return (self.timestep, changed_players, removed_object_positions, changed_objects, orders)
+
+    def apply(self, delta):
+        """
+        Returns the state obtained by applying a delta computed by `diff` to this state. Player and object
+        states are copied, so that the returned state can be modified without affecting this state or the delta.
+        """
+        timestep, changed_players, removed_object_positions, changed_objects, orders = delta
+        changed_players = dict(changed_players)
+        players = [changed_players.get(idx, player).deepcopy() for idx, player in enumerate(self.players)]
+        objects = {pos: obj.deepcopy() for pos, obj in self.objects.items() if pos not in removed_object_positions}
+        for obj in changed_objects:
+            objects[obj.position] = obj.deepcopy()
+
+        bonus_orders, all_orders = (self._bonus_orders, self._all_orders) if orders is None else orders
+        return OvercookedState._from_validated(players, objects, bonus_orders, all_orders, timestep)
+
 
 BASE_REW_SHAPING_PARAMS = {
     "PLACEMENT_IN_POT_REW": 3,
@@ -839,6 +942,88 @@ EVENT_TYPES = [
     'useless_tomato_potting'
 ]
 
+# Layers of the lossless state encoding, in order. Player-specific layers (ordered with the primary agent's
+# layers before the other agents') come first, followed by the layers shared by all players
+LOSSLESS_PLAYER_FEATURES = ["ego_agent_loc", "teammates_loc"] + \
+    ["ego_agent_orientation_{}".format(Direction.DIRECTION_TO_INDEX[d]) for d in Direction.ALL_DIRECTIONS] + \
+    ["teammates_orientation_{}".format(Direction.DIRECTION_TO_INDEX[d]) for d in Direction.ALL_DIRECTIONS]
+LOSSLESS_BASE_MAP_FEATURES = ["pot_loc", "counter_loc", "onion_disp_loc", "tomato_disp_loc", "dish_disp_loc", "serve_loc"]
+LOSSLESS_VARIABLE_MAP_FEATURES = ["onions_in_pot", "tomatoes_in_pot", "onions_in_soup", "tomatoes_in_soup",
+                                  "soup_cook_time_remaining", "soup_done", "dishes", "onions", "tomatoes"]
+LOSSLESS_ENCODING_LAYERS = LOSSLESS_PLAYER_FEATURES + LOSSLESS_BASE_MAP_FEATURES + LOSSLESS_VARIABLE_MAP_FEATURES + \
+    ["urgency", "goal"]
+LOSSLESS_LAYER_IDX = {layer_id: i for i, layer_id in enumerate(LOSSLESS_ENCODING_LAYERS)}
+LOSSLESS_BASE_MAP_SLICE = slice(LOSSLESS_LAYER_IDX[LOSSLESS_BASE_MAP_FEATURES[0]],
+                                LOSSLESS_LAYER_IDX[LOSSLESS_BASE_MAP_FEATURES[-1]] + 1)
+LOSSLESS_OBJECT_LAYERS = {"dish": LOSSLESS_LAYER_IDX["dishes"], "onion": LOSSLESS_LAYER_IDX["onions"],
+                          "tomato": LOSSLESS_LAYER_IDX["tomatoes"]}
+
+# Packed format of lossless encodings (see pack_lossless_encodings): the binary layers bit-packed into bytes,
+# followed by the layers that hold small integers as uint8
+LOSSLESS_COUNT_FEATURES = ["onions_in_pot", "tomatoes_in_pot", "onions_in_soup", "tomatoes_in_soup",
+                           "soup_cook_time_remaining"]
+LOSSLESS_COUNT_LAYERS = np.array([LOSSLESS_LAYER_IDX[layer_id] for layer_id in LOSSLESS_COUNT_FEATURES])
+LOSSLESS_BINARY_LAYERS = np.array([i for i in range(len(LOSSLESS_ENCODING_LAYERS)) if i not in LOSSLESS_COUNT_LAYERS])
+LOSSLESS_PACKED_BINARY_BYTES = (len(LOSSLESS_BINARY_LAYERS) + 7) // 8
+LOSSLESS_PACKED_NUM_CHANNELS = LOSSLESS_PACKED_BINARY_BYTES + len(LOSSLESS_COUNT_LAYERS)
+# Value of the bit of each binary layer within the packed bytes (most significant bit first, as with np.packbits),
+# so that packing is a matrix product
+_LOSSLESS_PACK_WEIGHTS = np.zeros((len(LOSSLESS_ENCODING_LAYERS), LOSSLESS_PACKED_BINARY_BYTES), dtype=np.float32)
+for _k, _layer in enumerate(LOSSLESS_BINARY_LAYERS):
+    _LOSSLESS_PACK_WEIGHTS[_layer, _k // 8] = 2 ** (7 - _k % 8)
+del _k, _layer
+# Order in which to take the unpacked binary layers followed by the count layers to get the encoding layers
+_LOSSLESS_UNPACK_ORDER = np.argsort(np.concatenate([LOSSLESS_BINARY_LAYERS, LOSSLESS_COUNT_LAYERS]))
+
+
+def pack_lossless_encodings(encodings, out=None):
+    """
+    Packs lossless encodings (of shape (..., width, height, num_layers), e.g. as returned by
+    lossless_state_encodings) into a (..., width, height, LOSSLESS_PACKED_NUM_CHANNELS) uint8 array, e.g. to
+    store them in replay buffers: the binary (0/1) layers are bit-packed along the channel axis, and the
+    ingredient counts and cook time remaining are kept as uint8. This takes 8 bytes per cell rather than 27 (as
+    uint8) or 216 (as the int64 lossless_state_encoding output). Raises a ValueError if a binary layer isn't 0/1,
+    or a count doesn't fit in uint8.
+    """
+    encodings = np.asarray(encodings)
+    assert encodings.shape[-1] == len(LOSSLESS_ENCODING_LAYERS), "Not a lossless encoding: {}".format(encodings.shape)
+    shape = encodings.shape[:-1] + (LOSSLESS_PACKED_NUM_CHANNELS,)
+    if out is None:
+        out = np.empty(shape, dtype=np.uint8)
+    else:
+        assert out.shape == shape and out.dtype == np.uint8, "Expected a {} uint8 array".format(shape)
+    counts = encodings[..., LOSSLESS_COUNT_LAYERS]
+    if encodings.dtype != np.uint8 and counts.size and (counts.min() < 0 or counts.max() > 255):
+        raise ValueError("Encoding counts don't fit in uint8")
+    binaries = encodings[..., LOSSLESS_BINARY_LAYERS]
+    if binaries.size and (binaries.min() < 0 or binaries.max() > 1):
+        raise ValueError("Binary encoding layers must be 0 or 1")
+
+    packed_bits = np.dot(encodings.reshape(-1, encodings.shape[-1]), _LOSSLESS_PACK_WEIGHTS)
+    out[..., :LOSSLESS_PACKED_BINARY_BYTES] = packed_bits.reshape(shape[:-1] + (LOSSLESS_PACKED_BINARY_BYTES,))
+    out[..., LOSSLESS_PACKED_BINARY_BYTES:] = counts
+    return out
+
+
+def unpack_lossless_encodings(packed, out=None, dtype=np.uint8):
+    """Inverse of pack_lossless_encodings, writing into `out` if given (and otherwise a new array of the given dtype)"""
+    packed = np.asarray(packed)
+    assert packed.dtype == np.uint8 and packed.shape[-1] == LOSSLESS_PACKED_NUM_CHANNELS, \
+        "Not a packed lossless encoding: {} {}".format(packed.dtype, packed.shape)
+    shape = packed.shape[:-1] + (len(LOSSLESS_ENCODING_LAYERS),)
+    if out is not None:
+        assert out.shape == shape, "Expected a {} array".format(shape)
+
+    flat_packed = packed.reshape(-1, LOSSLESS_PACKED_NUM_CHANNELS)
+    bits = np.unpackbits(flat_packed[:, :LOSSLESS_PACKED_BINARY_BYTES], axis=1, count=len(LOSSLESS_BINARY_LAYERS))
+    unpacked = np.concatenate([bits, flat_packed[:, LOSSLESS_PACKED_BINARY_BYTES:]], axis=1)
+    encodings = np.take(unpacked, _LOSSLESS_UNPACK_ORDER, axis=1).reshape(shape)
+    if out is None:
+        return encodings.astype(dtype, copy=False)
+    out[...] = encodings
+    return out
+
+
 POTENTIAL_CONSTANTS = {
     'default' : {
         'max_delivery_steps' : 10,
@@ -895,6 +1080,7 @@ class OvercookedGridworld(object):
         self._opt_recipe_discount_cache = {}
         self._opt_recipe_cache = {}
         self._prev_potential_params = {}
+        self._lossless_static_layers = None
 
 
     @staticmethod
@@ -1000,6 +1186,12 @@ class OvercookedGridworld(object):
             "start_all_orders" : self.start_all_orders
         }
 
+    @property
+    def fingerprint(self):
+        """Hash of the parameters determining the mdp's dynamics, e.g. to check that a trajectory is replayed on the right mdp"""
+        params = dict(self.mdp_params, order_bonus=self.order_bonus)
+        return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
 
     ##############
     # GAME LOGIC #
@@ -1558,6 +1750,27 @@ class OvercookedGridworld(object):
             if obj.name == 'soup' and obj.is_cooking:
                 obj.cook()
 
+    def ticks_until_next_soup_ready(self, state):
+        """Number of timesteps until the first of the currently cooking soups is ready, or None if none is cooking"""
+        cook_times_remaining = [obj.cook_time_remaining for obj in state.objects.values()
+                                if obj.name == 'soup' and obj.is_cooking]
+        return min(cook_times_remaining) if cook_times_remaining else None
+
+    def fast_forward_state(self, state, num_ticks):
+        """
+        Returns the state reached after `num_ticks` timesteps in which all players STAY.
+
+        Equivalent to `num_ticks` calls to get_state_transition with all-STAY joint actions (which never
+        yield rewards or events), but only advances the timestep and the cooking soups once.
+        """
+        assert num_ticks >= 0
+        new_state = state.deepcopy()
+        new_state.timestep += num_ticks
+        for obj in new_state.objects.values():
+            if obj.name == 'soup' and obj.is_cooking:
+                obj.cook(num_ticks)
+        return new_state
+
 
     def get_new_positions(self, old_positions, new_positions):
         def calculate_collision_groups(positions):
@@ -2161,168 +2374,177 @@ class OvercookedGridworld(object):
             "Using the `lossless_state_encoding_shape` property is deprecated. Please use `get_lossless_state_encoding_shape` method instead",
             DeprecationWarning
         )
-        return np.array(list(self.shape) + [26])
+        return self.get_lossless_state_encoding_shape()
 
     def get_lossless_state_encoding_shape(self):
-        return np.array(list(self.shape) + [26])
+        return np.array(list(self.shape) + [len(LOSSLESS_ENCODING_LAYERS)])
 
 
     def lossless_state_encoding(self, overcooked_state, goal_objects=None, horizon=400, p_idx=None, debug=False):
-        """Featurizes a OvercookedState object into a stack of boolean masks that are easily readable by a CNN"""
+        """
+        Featurizes a OvercookedState object into a stack of boolean masks that are easily readable by a CNN
 
+        The static map layers are computed once per mdp, and the object, urgency and goal layers once per state
+        (as they are shared by all players), so that only the position and orientation layers are player-specific.
+        """
         assert type(debug) is bool
-        base_map_features = ["pot_loc", "counter_loc", "onion_disp_loc", "tomato_disp_loc",
-                             "dish_disp_loc", "serve_loc"]
-        variable_map_features = ["onions_in_pot", "tomatoes_in_pot", "onions_in_soup", "tomatoes_in_soup",
-                                 "soup_cook_time_remaining", "soup_done", "dishes", "onions", "tomatoes"]
-        urgency_features = ["urgency"]
-        goal_features = ["goal"]
-        all_objects = overcooked_state.all_objects_list
-
-        def make_layer(position, value):
-            layer = np.zeros(self.shape)
-            layer[position] = value
-            return layer
+        state_mask_stack = np.zeros(self.shape + (len(LOSSLESS_ENCODING_LAYERS),), dtype=int)
+        # MAP LAYERS
+        state_mask_stack[:, :, LOSSLESS_BASE_MAP_SLICE] = self._get_lossless_static_layers()
+        if horizon - overcooked_state.timestep < 40:
+            state_mask_stack[:, :, LOSSLESS_LAYER_IDX["urgency"]] = 1
+        for x, y, layer, value in self._lossless_state_layer_entries(overcooked_state, goal_objects):
+            state_mask_stack[x, y, layer] = value
 
         def process_for_player(primary_agent_idx):
-            ordered_player_features = []
-
-            # Ensure that primary_agent_idx layers are ordered before other_agent_idx layers
-            ordered_player_features.append("ego_agent_loc")
-            ordered_player_features.append("teammates_loc")
-            ordered_player_features.extend([
-                f"ego_agent_orientation_{Direction.DIRECTION_TO_INDEX[d]}"
-                for d in Direction.ALL_DIRECTIONS
-            ])
-            ordered_player_features.extend([
-                f"teammates_orientation_{Direction.DIRECTION_TO_INDEX[d]}"
-                for d in Direction.ALL_DIRECTIONS
-            ])
-
-            LAYERS = ordered_player_features + base_map_features + variable_map_features + urgency_features + goal_features
-            state_mask_dict = {k: np.zeros(self.shape) for k in LAYERS}
-
-            # MAP LAYERS
-            if horizon - overcooked_state.timestep < 40:
-                state_mask_dict["urgency"] = np.ones(self.shape)
-
-            for loc in self.get_counter_locations():
-                state_mask_dict["counter_loc"][loc] = 1
-
-            if goal_objects == "counters":
-                for loc in self.get_empty_counter_locations(overcooked_state):
-                    state_mask_dict["goal"][loc] = 1
-
-            for loc in self.get_pot_locations():
-                state_mask_dict["pot_loc"][loc] = 1
-
-            if goal_objects == "empty_pot":
-                pot_states = self.get_pot_states(overcooked_state)
-                for loc in pot_states['empty'] + pot_states['1_items'] + pot_states['2_items']:
-                    state_mask_dict["goal"][loc] = 1
-
-            if goal_objects == "full_pot":
-                pot_states = self.get_pot_states(overcooked_state)
-                for loc in pot_states['cooking'] + pot_states['ready']:
-                    state_mask_dict["goal"][loc] = 1
-
-            for loc in self.get_onion_dispenser_locations():
-                state_mask_dict["onion_disp_loc"][loc] = 1
-                if goal_objects == "onion_dispenser":
-                    state_mask_dict["goal"][loc] = 1
-
-            for loc in self.get_tomato_dispenser_locations():
-                state_mask_dict["tomato_disp_loc"][loc] = 1
-                if goal_objects == "tomato_dispenser":
-                    state_mask_dict["goal"][loc] = 1
-
-            for loc in self.get_dish_dispenser_locations():
-                state_mask_dict["dish_disp_loc"][loc] = 1
-                if goal_objects == "dish_dispenser":
-                    state_mask_dict["goal"][loc] = 1
-
-            for loc in self.get_serving_locations():
-                state_mask_dict["serve_loc"][loc] = 1
-                if goal_objects == "serving_station":
-                    state_mask_dict["goal"][loc] = 1
-
-            # PLAYER LAYERS
+            # PLAYER LAYERS, on top of the shared layers
+            player_state_mask_stack = state_mask_stack.copy()
             for i, player in enumerate(overcooked_state.players):
                 player_orientation_idx = Direction.DIRECTION_TO_INDEX[player.orientation]
                 if i == primary_agent_idx:
-                    state_mask_dict["ego_agent_loc"][player.position] = 1
-                    state_mask_dict[f"ego_agent_orientation_{player_orientation_idx}"][player.position] = 1
+                    player_state_mask_stack[player.position + (LOSSLESS_LAYER_IDX["ego_agent_loc"],)] = 1
+                    player_state_mask_stack[player.position + (LOSSLESS_LAYER_IDX[f"ego_agent_orientation_{player_orientation_idx}"],)] = 1
                 else:
-                    state_mask_dict["teammates_loc"][player.position] = 1
-                    state_mask_dict[f"teammates_orientation_{player_orientation_idx}"][player.position] = 1
-
-            # OBJECT & STATE LAYERS
-            for obj in all_objects:
-                if obj.name == "soup":
-                    # removed the next line because onion doesn't have to be in all the soups?
-                    # if Recipe.ONION in obj.ingredients:
-                    # get the ingredients into a {object: number} dictionary
-                    ingredients_dict = Counter(obj.ingredients)
-                    # assert "onion" in ingredients_dict.keys()
-                    if obj.position in self.get_pot_locations():
-                        if obj.is_idle:
-                            # onions_in_pot and tomatoes_in_pot are used when the soup is idling, and ingredients could still be added
-                            state_mask_dict["onions_in_pot"] += make_layer(obj.position, ingredients_dict["onion"])
-                            state_mask_dict["tomatoes_in_pot"] += make_layer(obj.position, ingredients_dict["tomato"])
-                        else:
-                            state_mask_dict["onions_in_soup"] += make_layer(obj.position, ingredients_dict["onion"])
-                            state_mask_dict["tomatoes_in_soup"] += make_layer(obj.position, ingredients_dict["tomato"])
-                            state_mask_dict["soup_cook_time_remaining"] += make_layer(obj.position, obj.cook_time - obj._cooking_tick)
-                            if obj.is_ready:
-                                state_mask_dict["soup_done"] += make_layer(obj.position, 1)
-                    else:
-                        # If player soup is not in a pot, treat it like a soup that is cooked with remaining time 0
-                        state_mask_dict["onions_in_soup"] += make_layer(obj.position, ingredients_dict["onion"])
-                        state_mask_dict["tomatoes_in_soup"] += make_layer(obj.position, ingredients_dict["tomato"])
-                        state_mask_dict["soup_done"] += make_layer(obj.position, 1)
-                        if goal_objects == "soup":
-                            state_mask_dict["goal"][obj.position] = 1
-
-
-                elif obj.name == "dish":
-                    state_mask_dict["dishes"] += make_layer(obj.position, 1)
-                    if goal_objects == "dish":
-                        state_mask_dict["goal"][obj.position] = 1
-                elif obj.name == "onion":
-                    state_mask_dict["onions"] += make_layer(obj.position, 1)
-                    if goal_objects == "onion":
-                        state_mask_dict["goal"][obj.position] = 1
-                elif obj.name == "tomato":
-                    state_mask_dict["tomatoes"] += make_layer(obj.position, 1)
-                    if goal_objects == "tomato":
-                        state_mask_dict["goal"][obj.position] = 1
-                else:
-                    raise ValueError("Unrecognized object")
+                    player_state_mask_stack[player.position + (LOSSLESS_LAYER_IDX["teammates_loc"],)] = 1
+                    player_state_mask_stack[player.position + (LOSSLESS_LAYER_IDX[f"teammates_orientation_{player_orientation_idx}"],)] = 1
 
             if debug:
                 print("terrain----")
                 print(np.array(self.terrain_mtx))
-                print(len(LAYERS))
-                print(len(state_mask_dict))
-                for k, v in state_mask_dict.items():
-                    print(k)
-                    print(np.transpose(v, (1, 0)))
-
-            # Stack of all the state masks, order decided by order of LAYERS
-            state_mask_stack = np.array([state_mask_dict[layer_id] for layer_id in LAYERS])
-            state_mask_stack = np.transpose(state_mask_stack, (1, 2, 0))
-            assert state_mask_stack.shape[:2] == self.shape
-            assert state_mask_stack.shape[2] == len(LAYERS)
+                print(len(LOSSLESS_ENCODING_LAYERS))
+                for k, layer_id in enumerate(LOSSLESS_ENCODING_LAYERS):
+                    print(layer_id)
+                    print(np.transpose(player_state_mask_stack[:, :, k], (1, 0)))
+
             # NOTE: currently not including time left or order_list in featurization
-            return np.array(state_mask_stack).astype(int)
+            return player_state_mask_stack
 
-        # NOTE: Currently not very efficient, a decent amount of computation repeated here
         if p_idx is not None:
             return process_for_player(p_idx)
         num_players = len(overcooked_state.players)
         final_obs_for_players = tuple(process_for_player(i) for i in range(num_players))
         return final_obs_for_players
 
+    def lossless_state_encodings(self, states, goal_objects=None, horizon=400, out=None):
+        """
+        Batched lossless_state_encoding: encodes the states for all players into a
+        (num_states, num_players, width, height, num_layers) uint8 array, written into `out` if given (e.g. a
+        preallocated buffer, which is then returned). out[b, i] is the same as lossless_state_encoding(states[b])[i].
+        Raises a ValueError if a count (e.g. a soup's remaining cook time) doesn't fit in uint8.
+        """
+        num_players = self.num_players
+        shape = (len(states), num_players) + self.shape + (len(LOSSLESS_ENCODING_LAYERS),)
+        if out is None:
+            out = np.zeros(shape, dtype=np.uint8)
+        else:
+            assert out.shape == shape and out.dtype == np.uint8, "Expected a {} uint8 array".format(shape)
+            out[:] = 0
+        if not len(states):
+            return out
+
+        # Shared layers are written for the first player, and copied over to the others
+        out[:, 0, :, :, LOSSLESS_BASE_MAP_SLICE] = self._get_lossless_static_layers()
+        urgent = np.array([horizon - state.timestep < 40 for state in states])
+        out[urgent, 0, :, :, LOSSLESS_LAYER_IDX["urgency"]] = 1
+        entries = [(b,) + entry for b, state in enumerate(states)
+                   for entry in self._lossless_state_layer_entries(state, goal_objects)]
+        if entries:
+            # Much faster than building the array from the list of tuples
+            entries = np.fromiter(itertools.chain.from_iterable(entries), dtype=np.int64, count=5 * len(entries))
+            b_idxs, xs, ys, layers, values = entries.reshape(-1, 5).T
+            if values.min() < 0 or values.max() > 255:
+                raise ValueError("Encoding counts don't fit in uint8")
+            out[b_idxs, 0, xs, ys, layers] = values
+        out[:, 1:] = out[:, :1]
+
+        # Player layers, scattered for all states at once
+        positions = np.array([[player.position for player in state.players] for state in states])
+        orientations = np.array([[Direction.DIRECTION_TO_INDEX[player.orientation] for player in state.players]
+                                 for state in states])
+        # Each of the (state, primary player, player) combinations sets one location and one orientation layer
+        b_idxs, primary_idxs, player_idxs = np.meshgrid(np.arange(len(states)), np.arange(num_players),
+                                                        np.arange(num_players), indexing="ij")
+        is_primary = primary_idxs == player_idxs
+        xs, ys = positions[b_idxs, player_idxs, 0], positions[b_idxs, player_idxs, 1]
+        loc_layers = np.where(is_primary, LOSSLESS_LAYER_IDX["ego_agent_loc"], LOSSLESS_LAYER_IDX["teammates_loc"])
+        orientation_layers = orientations[b_idxs, player_idxs] + np.where(
+            is_primary, LOSSLESS_LAYER_IDX["ego_agent_orientation_0"], LOSSLESS_LAYER_IDX["teammates_orientation_0"])
+        out[b_idxs, primary_idxs, xs, ys, loc_layers] = 1
+        out[b_idxs, primary_idxs, xs, ys, orientation_layers] = 1
+        return out
+
+    def _lossless_state_layer_entries(self, overcooked_state, goal_objects):
+        """
+        The non-zero (x, y, layer, value) entries of the object and goal layers of the lossless encoding of the
+        state, which are shared by all players. Each entry is for a different location and layer.
+        """
+        goal_layer = LOSSLESS_LAYER_IDX["goal"]
+        goal_locations = []
+        if goal_objects == "counters":
+            goal_locations = self.get_empty_counter_locations(overcooked_state)
+        elif goal_objects == "empty_pot":
+            pot_states = self.get_pot_states(overcooked_state)
+            goal_locations = pot_states['empty'] + pot_states['1_items'] + pot_states['2_items']
+        elif goal_objects == "full_pot":
+            pot_states = self.get_pot_states(overcooked_state)
+            goal_locations = pot_states['cooking'] + pot_states['ready']
+        elif goal_objects == "onion_dispenser":
+            goal_locations = self.get_onion_dispenser_locations()
+        elif goal_objects == "tomato_dispenser":
+            goal_locations = self.get_tomato_dispenser_locations()
+        elif goal_objects == "dish_dispenser":
+            goal_locations = self.get_dish_dispenser_locations()
+        elif goal_objects == "serving_station":
+            goal_locations = self.get_serving_locations()
+        entries = [(x, y, goal_layer, 1) for x, y in goal_locations]
+
+        # OBJECT & STATE LAYERS
+        pot_locations = self.terrain_pos_dict['P']
+        held_objects = [player.held_object for player in overcooked_state.players if player.held_object is not None]
+        for obj in itertools.chain(overcooked_state.objects.values(), held_objects):
+            x, y = obj.position
+            if obj.name == "soup":
+                ingredients = obj.ingredients
+                num_onions, num_tomatoes = ingredients.count(Recipe.ONION), ingredients.count(Recipe.TOMATO)
+                if obj.position in pot_locations:
+                    if obj.is_idle:
+                        # onions_in_pot and tomatoes_in_pot are used when the soup is idling, and ingredients could still be added
+                        entries.append((x, y, LOSSLESS_LAYER_IDX["onions_in_pot"], num_onions))
+                        entries.append((x, y, LOSSLESS_LAYER_IDX["tomatoes_in_pot"], num_tomatoes))
+                    else:
+                        entries.append((x, y, LOSSLESS_LAYER_IDX["onions_in_soup"], num_onions))
+                        entries.append((x, y, LOSSLESS_LAYER_IDX["tomatoes_in_soup"], num_tomatoes))
+                        entries.append((x, y, LOSSLESS_LAYER_IDX["soup_cook_time_remaining"], obj.cook_time - obj._cooking_tick))
+                        if obj.is_ready:
+                            entries.append((x, y, LOSSLESS_LAYER_IDX["soup_done"], 1))
+                else:
+                    # If player soup is not in a pot, treat it like a soup that is cooked with remaining time 0
+                    entries.append((x, y, LOSSLESS_LAYER_IDX["onions_in_soup"], num_onions))
+                    entries.append((x, y, LOSSLESS_LAYER_IDX["tomatoes_in_soup"], num_tomatoes))
+                    entries.append((x, y, LOSSLESS_LAYER_IDX["soup_done"], 1))
+                    if goal_objects == "soup":
+                        entries.append((x, y, goal_layer, 1))
+            elif obj.name in LOSSLESS_OBJECT_LAYERS:
+                entries.append((x, y, LOSSLESS_OBJECT_LAYERS[obj.name], 1))
+                if goal_objects == obj.name:
+                    entries.append((x, y, goal_layer, 1))
+            else:
+                raise ValueError("Unrecognized object")
+        return entries
+
+    def _get_lossless_static_layers(self):
+        """The (width, height, 6) layers of pot, counter, dispenser and serving locations of the lossless encoding"""
+        if self._lossless_static_layers is None:
+            static_layer_locations = [self.get_pot_locations(), self.get_counter_locations(),
+                                      self.get_onion_dispenser_locations(), self.get_tomato_dispenser_locations(),
+                                      self.get_dish_dispenser_locations(), self.get_serving_locations()]
+            static_layers = np.zeros(self.shape + (len(static_layer_locations),), dtype=int)
+            for i, locations in enumerate(static_layer_locations):
+                for loc in locations:
+                    static_layers[loc + (i,)] = 1
+            self._lossless_static_layers = static_layers
+        return self._lossless_static_layers
+
     @property
     def featurize_state_shape(self):
         warnings.warn(
@@ -1,4 +1,7 @@
 import numpy as np
+from overcooked_ai_py.utils import StreamingStats
+from overcooked_ai_py.mdp.actions import Action
+from overcooked_ai_py.mdp.overcooked_mdp import EVENT_TYPES
 
 """
 NOTE: Currently under construction...
@@ -62,4 +65,287 @@ def append_trajectories(traj_one, traj_two):
             else:
                 appended_traj[k] = np.concatenate([traj_one_value, traj_two_value], axis=0)
 
-    return appended_traj
\ No newline at end of file
+    return appended_traj
+
+
+class RolloutSummary(object):
+    """
+    Streaming summary of rollout episodes (returns, lengths and event counts), updated in O(1) per episode,
+    so that statistics can be tracked without keeping every trajectory around.
+    """
+
+    def __init__(self):
+        self.returns = StreamingStats()
+        self.shaped_returns = StreamingStats()
+        self.lengths = StreamingStats()
+        # Total number of occurrences of each event type across episodes, by agent
+        self.event_counts = {}
+
+    @property
+    def num_episodes(self):
+        return self.returns.count
+
+    def add_episode(self, ep_return, ep_length, ep_shaped_return=0, ep_game_stats=None):
+        self.returns.update(ep_return)
+        self.shaped_returns.update(ep_shaped_return)
+        self.lengths.update(ep_length)
+        if ep_game_stats is not None:
+            for event_type in EVENT_TYPES:
+                counts = np.array([len(event_timesteps) for event_timesteps in ep_game_stats[event_type]])
+                if event_type in self.event_counts:
+                    self.event_counts[event_type] += counts
+                else:
+                    self.event_counts[event_type] = counts
+
+    def add_episode_info(self, episode_info):
+        """Adds an episode from the "episode" entry of the env info returned by OvercookedEnv at the end of an episode"""
+        self.add_episode(episode_info["ep_sparse_r"], episode_info["ep_length"], episode_info["ep_shaped_r"],
+                         episode_info["ep_game_stats"])
+
+    def description(self):
+        """Short description of the returns and lengths so far, as displayed during rollouts"""
+        return "Avg rew: {:.2f} (std: {:.2f}, se: {:.2f}); avg len: {:.2f}; ".format(
+            self.returns.mean, self.returns.std, self.returns.std_err, self.lengths.mean)
+
+    def to_dict(self):
+        return {
+            "num_episodes": self.num_episodes,
+            "mean_return": self.returns.mean,
+            "std_return": self.returns.std,
+            "std_err_return": self.returns.std_err,
+            "mean_shaped_return": self.shaped_returns.mean,
+            "std_shaped_return": self.shaped_returns.std,
+            "mean_length": self.lengths.mean,
+            "event_counts": {event_type: list(counts) for event_type, counts in self.event_counts.items()}
+        }
+
+
+def relabel_shaped_rewards(trajectories, rew_shaping_params, event_types=()):
+    """
+    Recomputes the per-timestep shaped rewards of stored trajectories (as returned by get_rollouts or
+    get_rollout_arrays) under new reward shaping params, from the event timesteps logged in each episode's
+    game stats rather than by re-simulating the episodes. As in OvercookedGridworld.resolve_interacts:
+        - PLACEMENT_IN_POT_REW is given for each potting event
+        - DISH_PICKUP_REWARD for each useful dish pickup (which can only be from a dispenser, as pickups are
+          not useful while there are dishes on counters)
+        - SOUP_PICKUP_REWARD for each soup pickup from a pot, i.e. while holding a dish (as opposed to pickups
+          from counters, with empty hands)
+
+    Returns a dict with:
+        ep_shaped_rewards_by_agent: (num_games, horizon, num_players) float32 shaped rewards
+        ep_shaped_returns:          (num_games,) sum of the shaped rewards of each episode, across agents
+        ep_event_flags:             (num_games, horizon, num_players, len(event_types)) bool, whether each of the
+                                    given event types occurred at each timestep
+    where the horizon is the longest episode length.
+    """
+    episode_infos = _get_episode_infos(trajectories)
+    num_games = len(episode_infos)
+    horizon = int(max(trajectories["ep_lengths"])) if num_games else 0
+    num_players = len(episode_infos[0]["ep_shaped_r_by_agent"]) if num_games else 0
+    shaped_rewards = np.zeros((num_games, horizon, num_players), dtype=np.float32)
+    event_flags = np.zeros((num_games, horizon, num_players, len(event_types)), dtype=np.bool_)
+
+    for i, episode_info in enumerate(episode_infos):
+        game_stats = episode_info["ep_game_stats"]
+        # Events are logged with the timestep of the state the joint action was taken in
+        start_state = trajectories["ep_states"][i][0] if "ep_states" in trajectories else None
+        start_timestep = start_state.timestep if start_state is not None else 0
+
+        for player_idx in range(num_players):
+            timesteps = lambda event_type: np.asarray(game_stats[event_type][player_idx], dtype=int) - start_timestep
+            rewards = shaped_rewards[i, :, player_idx]
+
+            # A player does at most one potting (and one pickup) per timestep, so indices are unique
+            rewards[timesteps("potting_onion")] += rew_shaping_params["PLACEMENT_IN_POT_REW"]
+            rewards[timesteps("potting_tomato")] += rew_shaping_params["PLACEMENT_IN_POT_REW"]
+            rewards[timesteps("useful_dish_pickup")] += rew_shaping_params["DISH_PICKUP_REWARD"]
+
+            soup_pickups = timesteps("soup_pickup")
+            if len(soup_pickups):
+                # Dishes are only gained by picking them up, and lost by dropping them or picking up soup in them
+                dish_gains = timesteps("dish_pickup")
+                if start_state is not None and start_state.players[player_idx].has_object() and \
+                        start_state.players[player_idx].get_object().name == "dish":
+                    dish_gains = np.concatenate([np.array([-1]), dish_gains])
+                dish_losses = np.sort(np.concatenate([timesteps("dish_drop"), soup_pickups]))
+                holding_dish = _last_timestep_before(dish_gains, soup_pickups) > \
+                               _last_timestep_before(dish_losses, soup_pickups)
+                rewards[soup_pickups[holding_dish]] += rew_shaping_params["SOUP_PICKUP_REWARD"]
+
+            for event_idx, event_type in enumerate(event_types):
+                event_flags[i, timesteps(event_type), player_idx, event_idx] = True
+
+    return {
+        "ep_shaped_rewards_by_agent": shaped_rewards,
+        "ep_shaped_returns": shaped_rewards.sum(axis=(1, 2)),
+        "ep_event_flags": event_flags
+    }
+
+
+def _get_episode_infos(trajectories):
+    """The "episode" info of each game of the trajectories, as returned by `step` when done"""
+    if "ep_episode_infos" in trajectories:
+        return trajectories["ep_episode_infos"]
+    return [ep_infos[ep_length - 1]["episode"]
+            for ep_infos, ep_length in zip(trajectories["ep_infos"], trajectories["ep_lengths"])]
+
+
+def _last_timestep_before(sorted_timesteps, query_timesteps):
+    """For each query, the last of the sorted timesteps strictly before it (-2 if there are none)"""
+    if not len(sorted_timesteps):
+        return np.full(len(query_timesteps), -2)
+    idxs = np.searchsorted(sorted_timesteps, query_timesteps) - 1
+    return np.where(idxs >= 0, sorted_timesteps[idxs], -2)
+
+
+class DeltaEncodedStates(object):
+    """
+    Memory-compact sequence of consecutive OvercookedStates (e.g. the states of one episode), stored as
+    periodic keyframes with state deltas in between (see OvercookedState.diff).
+
+    Supports len, iteration and random access: accessing a state replays at most `keyframe_interval - 1`
+    deltas from the closest preceding keyframe. Accessed states are new copies, which can be modified without
+    affecting the stored ones, but appended states must not be modified afterwards (deltas reference them).
+    """
+
+    def __init__(self, states=(), keyframe_interval=50):
+        assert keyframe_interval >= 1
+        self.keyframe_interval = keyframe_interval
+        # Entry i is a full state if i is a multiple of keyframe_interval, and the delta from state i - 1 otherwise
+        self._entries = []
+        self._last_state = None
+        for state in states:
+            self.append(state)
+
+    def append(self, state):
+        if len(self._entries) % self.keyframe_interval == 0:
+            self._entries.append(state)
+        else:
+            self._entries.append(state.diff(self._last_state))
+        self._last_state = state
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("State index out of range")
+        keyframe_idx = idx - idx % self.keyframe_interval
+        if keyframe_idx == idx:
+            return self._entries[idx].deepcopy()
+        state = self._entries[keyframe_idx]
+        for delta in self._entries[keyframe_idx + 1:idx + 1]:
+            state = state.apply(delta)
+        return state
+
+    def __iter__(self):
+        state = None
+        for idx, entry in enumerate(self._entries):
+            state = entry.deepcopy() if idx % self.keyframe_interval == 0 else state.apply(entry)
+            yield state
+
+    def __getstate__(self):
+        # The last state is only needed to append, and can be rebuilt on load
+        return {"keyframe_interval": self.keyframe_interval, "_entries": self._entries}
+
+    def __setstate__(self, d):
+        self.__dict__.update(d)
+        self._last_state = self[-1] if self._entries else None
+
+
+class ActionTrajectory(object):
+    """
+    Memory-compact sequence of the consecutive OvercookedStates of an episode, stored as the start state, the
+    (int8) joint action indices taken, and checkpoint states every `checkpoint_interval` states. As dynamics are
+    deterministic, any state is rebuilt on access by replaying at most `checkpoint_interval - 1` joint actions
+    from the closest preceding checkpoint, with the mdp the trajectory was recorded on.
+
+    The mdp is not pickled, only its fingerprint: after loading, `bind_mdp` must be called (e.g. with the mdp
+    rebuilt from the trajectory's "mdp_params") before states can be accessed.
+    """
+
+    def __init__(self, mdp, start_state, joint_actions=(), checkpoint_interval=50, states=None):
+        """
+        joint_actions:  the joint actions taken from the start state, each of which adds a state to the trajectory
+        states:         optionally, the already known states of the trajectory (starting with start_state), which
+                        are used as checkpoints rather than replaying the actions
+        """
+        assert checkpoint_interval >= 1
+        self.checkpoint_interval = checkpoint_interval
+        self.mdp = mdp
+        self.mdp_fingerprint = mdp.fingerprint
+        self.num_players = len(start_state.players)
+        self._joint_actions = np.empty((max(16, len(joint_actions)), self.num_players), dtype=np.int8)
+        self._num_actions = 0
+        self._checkpoints = [start_state]
+        self._last_state = start_state
+        for idx, joint_action in enumerate(joint_actions):
+            self.append(joint_action, None if states is None else states[idx + 1])
+
+    @property
+    def joint_actions(self):
+        """(num_states - 1, num_players) array of the indices of the joint actions taken"""
+        return self._joint_actions[:self._num_actions]
+
+    def bind_mdp(self, mdp):
+        assert mdp.fingerprint == self.mdp_fingerprint, "The trajectory was recorded on a different mdp"
+        self.mdp = mdp
+
+    def append(self, joint_action, next_state=None):
+        """Adds the state reached by taking joint_action from the last state (computed if not given)"""
+        if next_state is None:
+            last_state = self[-1] if self._last_state is None else self._last_state
+            next_state = self._transition(last_state, joint_action)
+        if self._num_actions == len(self._joint_actions):
+            grown = np.empty((max(16, 2 * self._num_actions), self.num_players), dtype=np.int8)
+            grown[:self._num_actions] = self.joint_actions
+            self._joint_actions = grown
+        self._joint_actions[self._num_actions] = [Action.ACTION_TO_INDEX[a] for a in joint_action]
+        self._num_actions += 1
+        if self._num_actions % self.checkpoint_interval == 0:
+            self._checkpoints.append(next_state)
+        self._last_state = next_state
+
+    def _transition(self, state, joint_action):
+        assert self.mdp is not None, "An mdp must be bound to the trajectory to replay it"
+        return self.mdp.get_state_transition(state, joint_action)[0]
+
+    def _replay(self, state, start_idx, end_idx):
+        for joint_action_idxs in self._joint_actions[start_idx:end_idx]:
+            state = self._transition(state, [Action.INDEX_TO_ACTION[a] for a in joint_action_idxs])
+        return state
+
+    def __len__(self):
+        return self._num_actions + 1
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("State index out of range")
+        if idx == self._num_actions and self._last_state is not None:
+            return self._last_state
+        checkpoint_idx = idx // self.checkpoint_interval
+        return self._replay(self._checkpoints[checkpoint_idx], checkpoint_idx * self.checkpoint_interval, idx)
+
+    def __iter__(self):
+        state = self._checkpoints[0]
+        yield state
+        for idx in range(self._num_actions):
+            state = self._replay(state, idx, idx + 1)
+            yield state
+
+    def __getstate__(self):
+        # The mdp is rebound after loading, and the last state is rebuilt lazily from it
+        d = dict(self.__dict__, mdp=None, _last_state=None)
+        d["_joint_actions"] = self.joint_actions.copy()
+        return d
+
+    def __setstate__(self, d):
+        self.__dict__.update(d)
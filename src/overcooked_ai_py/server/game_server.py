@@ -0,0 +1,282 @@
+import argparse, asyncio, itertools, json, time, traceback
+from collections import deque
+import numpy as np
+from overcooked_ai_py.mdp.actions import Action
+from overcooked_ai_py.mdp.overcooked_mdp import OvercookedGridworld
+from overcooked_ai_py.mdp.overcooked_env import OvercookedEnv
+from overcooked_ai_py.agents.agent import Agent, RandomAgent
+
+"""
+Local game server running many concurrent OvercookedEnv sessions in a single process.
+
+Clients connect over TCP and exchange newline-delimited JSON messages. Each client plays one player of its
+own game, and the other players are controlled by a server-side agent. All sessions advance together on
+a fixed-rate tick, at which the agent is queried once (per layout) for all the server-controlled players.
+
+Client -> server messages:
+    {"type": "join", "layout_name": "cramped_room", "horizon": 400, "player_idx": 0}   (all fields but type optional)
+    {"type": "action", "action": <action index>}    sets the action played at the next tick (STAY if none is sent)
+    {"type": "leave"}
+
+Server -> client messages:
+    {"type": "joined", "session_id": ..., "player_idx": ..., "state": <state dict>}
+    {"type": "state", "state": <state dict>, "reward": ..., "score": ..., "done": ..., "tick_ms": ...}
+        sent at every tick, where tick_ms is the time the server took to process that tick
+    {"type": "error", "message": ...}
+        e.g. for an invalid join (which can then be retried) or action. If a session fails while being stepped
+        (or the agent fails to act in it), it is ended with an error message, without affecting the other sessions.
+
+Clients must keep up with the states sent at every tick: the connection of a client whose unsent data exceeds
+max_write_buffer_size bytes is dropped, rather than buffering states for it without limit.
+"""
+
+DEFAULT_TICK_RATE = 10
+MAX_RECORDED_TICKS = 100000
+MAX_WRITE_BUFFER_SIZE = 2 ** 20
+
+
+class GameSession(object):
+    """A single game, with one client-controlled player"""
+
+    def __init__(self, session_id, env, client_player_idx, writer):
+        self.session_id = session_id
+        self.env = env
+        self.client_player_idx = client_player_idx
+        self.writer = writer
+        self.pending_action = Action.STAY
+        self.score = 0
+        self.done = False
+
+    @property
+    def agent_player_idxs(self):
+        return [i for i in range(self.env.mdp.num_players) if i != self.client_player_idx]
+
+
+class GameServer(object):
+    """
+    agent (Agent):      controls all non-client players, across all sessions. If it implements Agent.actions,
+                        it is called once per tick and per layout with all the states to act in
+    tick_rate (float):  number of ticks (env steps) per second
+    max_write_buffer_size (int): number of bytes not yet sent to a client above which its session is dropped
+    """
+
+    def __init__(self, agent=None, tick_rate=DEFAULT_TICK_RATE, host="127.0.0.1", port=0, max_sessions=None,
+                 max_write_buffer_size=MAX_WRITE_BUFFER_SIZE):
+        self.agent = RandomAgent(all_actions=True) if agent is None else agent
+        self.tick_period = 1 / tick_rate
+        self.host = host
+        self.port = port
+        self.max_sessions = max_sessions
+        self.max_write_buffer_size = max_write_buffer_size
+        self.sessions = {}
+        self.tick_latencies = deque(maxlen=MAX_RECORDED_TICKS)
+        self._session_ids = itertools.count()
+        self._mdps = {}
+        self._server = None
+        self._tick_task = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._tick_task = asyncio.ensure_future(self._tick_loop())
+
+    async def stop(self):
+        self._tick_task.cancel()
+        self._server.close()
+        await self._server.wait_closed()
+        for session in list(self.sessions.values()):
+            session.writer.close()
+        self.sessions = {}
+
+    async def serve_forever(self):
+        await self.start()
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.stop()
+
+    ##################
+    # CLIENT HANDLING #
+    ##################
+
+    async def _handle_client(self, reader, writer):
+        session = None
+        try:
+            async for line in reader:
+                message = json.loads(line)
+                if message["type"] == "join" and session is None:
+                    if self.max_sessions is not None and len(self.sessions) >= self.max_sessions:
+                        self._send(writer, {"type": "error", "message": "Server is full"})
+                        break
+                    try:
+                        session = self._create_session(message, writer)
+                    except ValueError as e:
+                        self._send(writer, {"type": "error", "message": "Invalid join: {}".format(e)})
+                    else:
+                        self._send(writer, {"type": "joined", "session_id": session.session_id,
+                                            "player_idx": session.client_player_idx,
+                                            "state": session.env.state.to_dict()})
+                elif message["type"] == "action" and session is not None:
+                    action_idx = message.get("action")
+                    if _is_int(action_idx) and 0 <= action_idx < Action.NUM_ACTIONS:
+                        session.pending_action = Action.INDEX_TO_ACTION[action_idx]
+                    else:
+                        self._send(writer, {"type": "error", "message": "Invalid action: {}".format(action_idx)})
+                elif message["type"] == "leave":
+                    break
+                else:
+                    self._send(writer, {"type": "error", "message": "Unexpected message: {}".format(message)})
+                await writer.drain()
+        except (ConnectionError, json.JSONDecodeError, KeyError, IndexError):
+            pass
+        finally:
+            if session is not None:
+                self.sessions.pop(session.session_id, None)
+            writer.close()
+
+    def _create_session(self, message, writer):
+        """Creates the session requested by a join message, raising a ValueError if the message is invalid"""
+        layout_name = message.get("layout_name", "cramped_room")
+        horizon = message.get("horizon", 400)
+        player_idx = message.get("player_idx", 0)
+        if not isinstance(layout_name, str):
+            raise ValueError("layout_name must be a string")
+        if not _is_int(horizon) or horizon <= 0:
+            raise ValueError("horizon must be a positive integer")
+        if layout_name not in self._mdps:
+            try:
+                self._mdps[layout_name] = OvercookedGridworld.from_layout_name(layout_name)
+            except Exception:
+                raise ValueError("unknown layout {}".format(layout_name))
+        mdp = self._mdps[layout_name]
+        if not _is_int(player_idx) or not 0 <= player_idx < mdp.num_players:
+            raise ValueError("player_idx must be an integer between 0 and {}".format(mdp.num_players - 1))
+
+        env = OvercookedEnv.from_mdp(mdp, horizon=horizon, info_level=0)
+        session = GameSession(next(self._session_ids), env, player_idx, writer)
+        self.sessions[session.session_id] = session
+        return session
+
+    @staticmethod
+    def _send(writer, message):
+        writer.write((json.dumps(message) + "\n").encode())
+
+    ##################
+    # TICK SCHEDULING #
+    ##################
+
+    async def _tick_loop(self):
+        loop = asyncio.get_event_loop()
+        next_tick = loop.time()
+        while True:
+            next_tick += self.tick_period
+            try:
+                self.tick()
+            except Exception:
+                # Keep ticking the other sessions
+                traceback.print_exc()
+            # If ticks run late, skip ahead rather than trying to catch up
+            next_tick = max(next_tick, loop.time())
+            await asyncio.sleep(next_tick - loop.time())
+
+    def tick(self):
+        """Steps all active sessions once, with batched agent inference, and sends the new states to clients"""
+        start = time.perf_counter()
+        sessions = [session for session in self.sessions.values() if not session.done]
+        agent_actions = self._get_agent_actions(sessions)
+        updates = []
+        for session in sessions:
+            if session.done:
+                # Ended because the agent failed to act in it
+                continue
+            try:
+                joint_action = [None] * session.env.mdp.num_players
+                joint_action[session.client_player_idx] = session.pending_action
+                for player_idx in session.agent_player_idxs:
+                    joint_action[player_idx] = agent_actions[(session.session_id, player_idx)]
+                session.pending_action = Action.STAY
+
+                state, reward, done, _ = session.env.step(tuple(joint_action))
+                session.score += reward
+                session.done = done
+                updates.append((session, {"type": "state", "state": state.to_dict(), "reward": reward,
+                                          "score": session.score, "done": done}))
+            except Exception as e:
+                # A failing session is ended on its own, so that it doesn't stop the shared tick
+                self._end_session(session, "Session failed: {!r}".format(e))
+
+        tick_latency = time.perf_counter() - start
+        self.tick_latencies.append(tick_latency)
+        for session, message in updates:
+            if session.writer.transport.get_write_buffer_size() > self.max_write_buffer_size:
+                # The client doesn't keep up with the states sent to it
+                self._drop_session(session)
+                continue
+            message["tick_ms"] = tick_latency * 1000
+            self._send(session.writer, message)
+
+    def _end_session(self, session, error_message):
+        self.sessions.pop(session.session_id, None)
+        session.done = True
+        self._send(session.writer, {"type": "error", "message": error_message})
+        session.writer.close()
+
+    def _drop_session(self, session):
+        """Ends the session without sending anything more, discarding the data not yet sent to the client"""
+        self.sessions.pop(session.session_id, None)
+        session.done = True
+        session.writer.transport.abort()
+
+    def _get_agent_actions(self, sessions):
+        """Returns the agent's action for each (session_id, player_idx), querying it once per layout"""
+        queries_by_mdp = {}
+        for session in sessions:
+            for player_idx in session.agent_player_idxs:
+                queries_by_mdp.setdefault(id(session.env.mdp), []).append((session, player_idx))
+
+        agent_actions = {}
+        for queries in queries_by_mdp.values():
+            try:
+                self.agent.set_mdp(queries[0][0].env.mdp)
+                states = [session.env.state for session, _ in queries]
+                player_idxs = [player_idx for _, player_idx in queries]
+                if type(self.agent).actions is Agent.actions:
+                    actions_and_infos = []
+                    for state, player_idx in zip(states, player_idxs):
+                        self.agent.set_agent_index(player_idx)
+                        actions_and_infos.append(self.agent.action(state))
+                else:
+                    actions_and_infos = self.agent.actions(states, player_idxs)
+            except Exception as e:
+                # Only the sessions of the layout the agent failed on are ended
+                for session, _ in queries:
+                    if not session.done:
+                        self._end_session(session, "Agent failed: {!r}".format(e))
+                continue
+            for (session, player_idx), (action, _) in zip(queries, actions_and_infos):
+                agent_actions[(session.session_id, player_idx)] = action
+        return agent_actions
+
+    def tick_latency_percentiles(self, percentiles=(50, 90, 99)):
+        """Percentiles of the tick processing time, in milliseconds"""
+        if not self.tick_latencies:
+            return {}
+        values = np.percentile(np.array(self.tick_latencies) * 1000, percentiles)
+        return dict(zip(percentiles, values))
+
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local multi-session Overcooked game server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--tick-rate", type=float, default=DEFAULT_TICK_RATE)
+    parser.add_argument("--max-sessions", type=int, default=None)
+    args = parser.parse_args()
+
+    server = GameServer(tick_rate=args.tick_rate, host=args.host, port=args.port, max_sessions=args.max_sessions)
+    print("Serving on {}:{}".format(args.host, args.port))
+    asyncio.run(server.serve_forever())
@@ -0,0 +1,76 @@
+import argparse, asyncio, json, time
+import numpy as np
+from overcooked_ai_py.mdp.actions import Action
+
+"""
+Stress test for the local game server: runs many concurrent clients that play random actions, and reports
+percentiles of the server-side tick latency and of the client-observed time between consecutive states.
+"""
+
+
+async def _run_client(host, port, layout_name, duration, tick_ms, inter_arrival_ms):
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write((json.dumps({"type": "join", "layout_name": layout_name}) + "\n").encode())
+    await writer.drain()
+    end_time = time.perf_counter() + duration
+    last_arrival = None
+    try:
+        while time.perf_counter() < end_time:
+            try:
+                line = await asyncio.wait_for(reader.readline(), end_time - time.perf_counter())
+            except asyncio.TimeoutError:
+                break
+            if not line:
+                break
+            message = json.loads(line)
+            if message["type"] == "error":
+                raise RuntimeError(message["message"])
+            if message["type"] != "state":
+                continue
+            now = time.perf_counter()
+            if last_arrival is not None:
+                inter_arrival_ms.append((now - last_arrival) * 1000)
+            last_arrival = now
+            tick_ms.append(message["tick_ms"])
+            if message["done"]:
+                break
+            action = np.random.randint(Action.NUM_ACTIONS)
+            writer.write((json.dumps({"type": "action", "action": int(action)}) + "\n").encode())
+            await writer.drain()
+        writer.write((json.dumps({"type": "leave"}) + "\n").encode())
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def run_stress_test(host, port, num_clients, duration, layout_name="cramped_room", percentiles=(50, 90, 99)):
+    """
+    Connects num_clients concurrent clients to the server for `duration` seconds, and returns a dict with
+    the number of states received, and the given percentiles (in ms) of the server tick latency and of the
+    client-observed inter-arrival time of states
+    """
+    tick_ms, inter_arrival_ms = [], []
+    await asyncio.gather(*[_run_client(host, port, layout_name, duration, tick_ms, inter_arrival_ms)
+                           for _ in range(num_clients)])
+    return {
+        "num_states": len(tick_ms),
+        "tick_ms": dict(zip(percentiles, np.percentile(tick_ms, percentiles))) if tick_ms else {},
+        "inter_arrival_ms": dict(zip(percentiles, np.percentile(inter_arrival_ms, percentiles))) if inter_arrival_ms else {}
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stress test a local Overcooked game server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--num-clients", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--layout-name", default="cramped_room")
+    args = parser.parse_args()
+
+    results = asyncio.run(run_stress_test(args.host, args.port, args.num_clients, args.duration, args.layout_name))
+    print("Received {} states".format(results["num_states"]))
+    for name in ["tick_ms", "inter_arrival_ms"]:
+        print("{}: {}".format(name, ", ".join("p{} {:.2f}".format(p, v) for p, v in results[name].items())))
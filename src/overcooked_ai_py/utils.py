@@ -95,6 +95,38 @@ def mean_and_std_err(lst):
     mu = np.mean(lst)
     return mu, std_err(lst)
 
+class StreamingStats(object):
+    """
+    Running mean and (population) variance of a stream of values, updated in O(1) per value
+    with Welford's algorithm. Values can also be numpy arrays, for elementwise statistics.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def update(self, x):
+        self.count += 1
+        delta = x - self.mean
+        self.mean = self.mean + delta / self.count
+        self._m2 = self._m2 + delta * (x - self.mean)
+
+    @property
+    def var(self):
+        return self._m2 / self.count if self.count else nan
+
+    @property
+    def std(self):
+        return np.sqrt(self.var)
+
+    @property
+    def std_err(self):
+        return self.std / np.sqrt(self.count) if self.count else nan
+
+    def mean_and_std_err(self):
+        return self.mean, self.std_err
+
 # Other utils
 
 def dict_mean_and_std_err(d):
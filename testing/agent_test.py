@@ -1,12 +1,13 @@
-import unittest
+import unittest, time, os, shutil, tempfile
 import numpy as np
 
-from overcooked_ai_py.agents.agent import AgentPair, FixedPlanAgent, GreedyHumanModel, RandomAgent, SampleAgent
+from overcooked_ai_py.agents.agent import AgentPair, FixedPlanAgent, GreedyHumanModel, RandomAgent, SampleAgent, ThreadedAgent
 from overcooked_ai_py.mdp.actions import Direction, Action
 from overcooked_ai_py.mdp.overcooked_mdp import OvercookedGridworld, OvercookedState, PlayerState, ObjectState
 from overcooked_ai_py.mdp.overcooked_env import OvercookedEnv
 from overcooked_ai_py.planning.planners import MediumLevelActionManager, NO_COUNTERS_PARAMS
 from overcooked_ai_py.agents.benchmarking import AgentEvaluator
+from overcooked_ai_py.agents.sweeps import SweepCell, SweepRunner
 
 np.random.seed(42)
 
@@ -86,6 +87,39 @@ class TestBasicAgents(unittest.TestCase):
         expected_probs = np.array([0.18333333, 0.18333333, 0.18333333, 0.18333333, 0.18333333, 0.08333333])
         self.assertTrue(np.allclose(probs, expected_probs))
 
+    def test_threaded_agent(self):
+        class SlowPlanAgent(FixedPlanAgent):
+            def action(self, state):
+                time.sleep(self.delay)
+                return super().action(state)
+
+        slow_agent = SlowPlanAgent([e, w, e])
+        slow_agent.delay = 0.01
+        agent = ThreadedAgent(slow_agent, timeout=1, fallback="last")
+        # Initialized like any other agent
+        self.assertIsNone(agent.mdp)
+        self.assertIsNone(agent.agent_index)
+        agent.set_agent_index(0)
+        self.assertEqual(agent.action(None), (e, {}))
+
+        # The action is computed in the background while the caller does something else
+        agent.request_action(None)
+        time.sleep(0.05)
+        self.assertEqual(agent.get_action(timeout=0), (w, {}))
+
+        # Missed deadlines play the fallback action, and the late result is discarded
+        slow_agent.delay = 0.2
+        agent.timeout = 0.05
+        self.assertEqual(agent.action(None), (w, {"fallback": True}))
+        agent.reset()
+        self.assertEqual(slow_agent.i, 0)
+        self.assertEqual(agent.action(None), (Action.STAY, {"fallback": True}))
+        self.assertEqual(agent.get_action(timeout=1), (e, {}))
+        self.assertEqual(agent.num_fallbacks, 2)
+        self.assertEqual(len(agent.agent_latencies), 4)
+        self.assertGreaterEqual(max(agent.agent_latencies), 0.2)
+        agent.close()
+
 class TestAgentEvaluatorStatic(unittest.TestCase):
 
     layout_name_lst = ["asymmetric_advantages", "asymmetric_advantages_tomato", "bonus_order_test", "bottleneck",
@@ -260,5 +294,90 @@ class TestAgentEvaluatorStatic(unittest.TestCase):
             self.assertAlmostEqual(gt[k], v/self.num_reset, 2, "more than 2 places off for " + k)
 
 
+class TestSweepRunner(unittest.TestCase):
+
+    def test_sweep(self):
+        random_pair_fn = lambda env: AgentPair(RandomAgent(all_actions=True), RandomAgent(all_actions=True))
+        greedy_pair_fn = lambda env: AgentPair(GreedyHumanModel(env.mlam), GreedyHumanModel(env.mlam))
+        cells = [
+            SweepCell(greedy_pair_fn, {"layout_name": "cramped_room"}, num_games=3, horizon=50),
+            SweepCell(random_pair_fn, {"layout_name": "cramped_room"}, num_games=4, horizon=20),
+            SweepCell(random_pair_fn, {"layout_name": "corridor"}, num_games=5, horizon=30, name="corridor_random")
+        ]
+        sequential_results = SweepRunner(cells, num_workers=1, seed=3).run()
+        runner = SweepRunner(cells, num_workers=2, seed=3)
+        results = runner.run()
+
+        self.assertEqual(len(results), len(cells))
+        for cell, cell_results, cell_sequential_results in zip(cells, results, sequential_results):
+            self.assertEqual(list(cell_results["ep_lengths"]), [cell.horizon] * cell.num_games)
+            self.assertEqual(cell_results["summary"].num_episodes, cell.num_games)
+            # Results don't depend on how episodes were scheduled
+            for key in ["ep_returns", "ep_shaped_returns", "ep_lengths"]:
+                self.assertTrue(np.array_equal(cell_results[key], cell_sequential_results[key]))
+
+        # Each worker starts with whole layouts, and only steals what is left at the end
+        self.assertEqual(set.union(*runner.worker_layouts), {cell.layout_key for cell in cells})
+        self.assertLessEqual(runner.num_steals, sum(cell.num_games for cell in cells))
+
+    def test_sweep_resume(self):
+        results_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, results_dir)
+        random_pair_fn = lambda env: AgentPair(RandomAgent(all_actions=True), RandomAgent(all_actions=True))
+        cells = [
+            SweepCell(random_pair_fn, {"layout_name": "cramped_room"}, num_games=4, horizon=20),
+            SweepCell(random_pair_fn, {"layout_name": "corridor"}, num_games=3, horizon=20)
+        ]
+        expected_results = SweepRunner(cells, num_workers=1, seed=1).run()
+
+        # A sweep interrupted after the first cell is resumed with the second one, and more games on the first
+        SweepRunner(cells[:1], num_workers=1, seed=1, results_dir=results_dir, checkpoint_every=3).run()
+        self.assertEqual(len(os.listdir(results_dir)), 2)
+        cells.append(SweepCell(random_pair_fn, {"layout_name": "cramped_room"}, num_games=2, horizon=20, name="other"))
+        runner = SweepRunner(cells, num_workers=2, seed=1, results_dir=results_dir)
+        results = runner.run()
+        self.assertEqual(runner.num_resumed, 4)
+        for cell_results, cell_expected_results in zip(results, expected_results):
+            for key in ["ep_returns", "ep_shaped_returns", "ep_lengths"]:
+                self.assertTrue(np.array_equal(cell_results[key], cell_expected_results[key]))
+
+        # Everything is completed, so nothing is run again
+        never_called = lambda env: self.fail("Completed episodes should not be run again")
+        cells = [SweepCell(never_called, cell.mdp_params, cell.num_games, cell.horizon, name=cell.name) for cell in cells]
+        runner = SweepRunner(cells, num_workers=1, seed=1, results_dir=results_dir)
+        resumed_results = runner.run()
+        self.assertEqual(runner.num_resumed, 9)
+        for cell_results, cell_resumed_results in zip(results, resumed_results):
+            self.assertTrue(np.array_equal(cell_results["ep_returns"], cell_resumed_results["ep_returns"]))
+
+    def test_sweep_worker_failure(self):
+        random_pair_fn = lambda env: AgentPair(RandomAgent(all_actions=True), RandomAgent(all_actions=True))
+        def failing_pair_fn(env):
+            raise ValueError("Failing agent pair")
+        def dying_pair_fn(env):
+            os._exit(1)
+
+        for bad_pair_fn, error_regex in [(failing_pair_fn, "Failing agent pair"), (dying_pair_fn, "died")]:
+            cells = [SweepCell(random_pair_fn, {"layout_name": "cramped_room"}, num_games=20, horizon=400),
+                     SweepCell(bad_pair_fn, {"layout_name": "corridor"}, num_games=1, horizon=10)]
+            # The worker's error is raised, without waiting for the other worker to finish its tasks
+            start = time.time()
+            with self.assertRaisesRegex(RuntimeError, error_regex):
+                SweepRunner(cells, num_workers=2, seed=1).run()
+            self.assertLess(time.time() - start, 10)
+
+    def test_sweep_unnamed_cells(self):
+        random_pair_fn = lambda env: AgentPair(RandomAgent(all_actions=True), RandomAgent(all_actions=True))
+        cells = [SweepCell(random_pair_fn, {"layout_name": "cramped_room"}, num_games=2, horizon=10) for _ in range(2)]
+        # Unnamed cells on the same layout and horizon are fine, unless their episodes are checkpointed
+        results = SweepRunner(cells, num_workers=1, seed=1).run()
+        self.assertEqual([len(cell_results["ep_returns"]) for cell_results in results], [2, 2])
+
+        results_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, results_dir)
+        with self.assertRaisesRegex(ValueError, "Cells 0 and 1"):
+            SweepRunner(cells, num_workers=1, seed=1, results_dir=results_dir).run()
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,52 @@
+import unittest, sys
+import numpy as np
+from overcooked_ai_py.mdp.actions import Action
+from overcooked_ai_py.mdp.overcooked_mdp import OvercookedGridworld
+from overcooked_ai_py.mdp.overcooked_env import OvercookedEnv, OvercookedVecEnv
+from overcooked_ai_py.mdp.overcooked_env_pool import OvercookedEnvPool
+
+
+@unittest.skipIf(sys.version_info < (3, 8), "OvercookedEnvPool requires multiprocessing.shared_memory (Python 3.8+)")
+class TestOvercookedEnvPool(unittest.TestCase):
+
+    def setUp(self):
+        self.base_mdp = OvercookedGridworld.from_layout_name("cramped_room")
+
+    def test_env_pool(self):
+        np.random.seed(5)
+        make_envs = lambda: [OvercookedEnv.from_mdp(self.base_mdp, horizon=6, info_level=0) for _ in range(5)]
+        featurize_fn = lambda mdp, state: mdp.lossless_state_encoding(state)
+        vec_env = OvercookedVecEnv(make_envs(), featurize_fn=featurize_fn)
+        with OvercookedEnvPool(make_envs(), featurize_fn=featurize_fn, num_workers=2) as pool:
+            self.assertTrue(np.array_equal(pool.reset(), vec_env.reset()))
+            num_episodes = 0
+            for _ in range(8):
+                actions = np.random.randint(Action.NUM_ACTIONS, size=(5, 2))
+                obs, rewards, dones, episodes = pool.step(actions)
+                vec_obs, vec_rewards, vec_dones, vec_infos = vec_env.step(actions)
+                self.assertTrue(np.array_equal(obs, vec_obs))
+                self.assertTrue(np.array_equal(rewards, vec_rewards))
+                self.assertTrue(np.array_equal(dones, vec_dones))
+                self.assertEqual([episode[0] for episode in episodes], list(np.nonzero(vec_dones)[0]))
+                self.assertTrue(all(episode[3] == 6 for episode in episodes))
+                num_episodes += len(episodes)
+            self.assertEqual(num_episodes, 5)
+
+    def test_env_pool_worker_failure(self):
+        envs = [OvercookedEnv.from_mdp(self.base_mdp, horizon=6, info_level=0) for _ in range(4)]
+        featurize_fn = lambda mdp, state: mdp.lossless_state_encoding(state)
+        pool = OvercookedEnvPool(envs, featurize_fn=featurize_fn, num_workers=2)
+        pool.reset()
+        # An invalid action index makes the first worker fail, while the second one steps normally
+        actions = np.zeros((4, 2), dtype=np.int64)
+        actions[0] = Action.NUM_ACTIONS
+        with self.assertRaises(RuntimeError):
+            pool.step(actions)
+        # The other worker's reply was read, so the pool can still be closed
+        pool.close()
+        self.assertTrue(pool.closed)
+        self.assertFalse(any(process.is_alive() for process in pool._processes))
+
+
+if __name__ == '__main__':
+    unittest.main()
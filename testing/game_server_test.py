@@ -0,0 +1,118 @@
+import unittest, asyncio, json
+from overcooked_ai_py.agents.agent import RandomAgent
+from overcooked_ai_py.server.game_server import GameServer
+from overcooked_ai_py.server.stress_client import run_stress_test
+
+
+class TestGameServer(unittest.TestCase):
+
+    def test_stress_test(self):
+        async def run():
+            server = GameServer(tick_rate=50)
+            await server.start()
+            try:
+                results = await run_stress_test(server.host, server.port, num_clients=5, duration=1)
+            finally:
+                await server.stop()
+            return server, results
+
+        server, results = asyncio.run(run())
+        # Each client receives one state per tick
+        self.assertGreater(results["num_states"], 5 * 20)
+        self.assertEqual(set(results["tick_ms"].keys()), {50, 90, 99})
+        self.assertLessEqual(results["tick_ms"][50], results["tick_ms"][99])
+        # States arrive at roughly the tick rate
+        self.assertLess(results["inter_arrival_ms"][50], 100)
+        self.assertGreater(len(server.tick_latencies), 20)
+        self.assertEqual(server.sessions, {})
+
+    def test_invalid_messages(self):
+        async def send(writer, message):
+            writer.write((json.dumps(message) + "\n").encode())
+            await writer.drain()
+
+        async def receive(reader, message_type):
+            while True:
+                message = json.loads(await reader.readline())
+                if message["type"] == message_type:
+                    return message
+
+        async def run():
+            server = GameServer(tick_rate=50)
+            await server.start()
+            try:
+                reader, writer = await asyncio.open_connection(server.host, server.port)
+                other_reader, other_writer = await asyncio.open_connection(server.host, server.port)
+                # Invalid joins are answered with an error, and can be retried
+                for join in [{"player_idx": 2}, {"player_idx": "0"}, {"horizon": -1}, {"layout_name": "not_a_layout"}]:
+                    await send(writer, dict(join, type="join"))
+                    self.assertIn("Invalid join", (await receive(reader, "error"))["message"])
+                await send(writer, {"type": "join", "player_idx": 1})
+                joined = await receive(reader, "joined")
+                await send(writer, {"type": "action", "action": -1})
+                self.assertIn("Invalid action", (await receive(reader, "error"))["message"])
+                await send(other_writer, {"type": "join"})
+                await receive(other_reader, "joined")
+
+                # A session failing while being stepped is ended, while the others keep going
+                def failing_step(*args, **kwargs):
+                    raise RuntimeError("step failed")
+                server.sessions[joined["session_id"]].env.step = failing_step
+                self.assertIn("Session failed", (await receive(reader, "error"))["message"])
+                self.assertNotIn(joined["session_id"], server.sessions)
+                for _ in range(3):
+                    self.assertFalse((await receive(other_reader, "state"))["done"])
+                writer.close()
+                other_writer.close()
+            finally:
+                await server.stop()
+
+        asyncio.run(run())
+
+    def test_failing_agent_and_slow_clients(self):
+        class FailingAgent(RandomAgent):
+            def action(self, state):
+                if self.mdp.layout_name == "cramped_room":
+                    raise RuntimeError("agent failed")
+                return super().action(state)
+
+        async def join(server, layout_name):
+            reader, writer = await asyncio.open_connection(server.host, server.port)
+            writer.write((json.dumps({"type": "join", "layout_name": layout_name}) + "\n").encode())
+            await writer.drain()
+            return reader, writer, json.loads(await reader.readline())
+
+        async def receive(reader, message_type):
+            while True:
+                message = json.loads(await reader.readline())
+                if message["type"] == message_type:
+                    return message
+
+        async def run():
+            server = GameServer(agent=FailingAgent(all_actions=True), tick_rate=50)
+            await server.start()
+            try:
+                # Only the sessions of the layout the agent fails on are ended
+                reader, writer, _ = await join(server, "cramped_room")
+                other_reader, other_writer, other_joined = await join(server, "asymmetric_advantages")
+                self.assertIn("Agent failed", (await receive(reader, "error"))["message"])
+                for _ in range(3):
+                    await receive(other_reader, "state")
+                self.assertEqual(list(server.sessions), [other_joined["session_id"]])
+
+                # A client that doesn't keep up with the states sent to it is dropped
+                session = server.sessions[other_joined["session_id"]]
+                session.writer.transport.get_write_buffer_size = lambda: server.max_write_buffer_size + 1
+                while other_joined["session_id"] in server.sessions:
+                    await asyncio.sleep(0.01)
+                self.assertTrue(session.done)
+                writer.close()
+                other_writer.close()
+            finally:
+                await server.stop()
+
+        asyncio.run(run())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,16 +1,18 @@
 import unittest, os, shutil, glob
-import json, copy
+import json, copy, pickle
+from unittest import mock
 import numpy as np
 from math import factorial
 from overcooked_ai_py.mdp.actions import Action, Direction
-from overcooked_ai_py.mdp.overcooked_mdp import PlayerState, OvercookedGridworld, OvercookedState, ObjectState, SoupState, Recipe
-from overcooked_ai_py.mdp.overcooked_env import OvercookedEnv, DEFAULT_ENV_PARAMS
-from overcooked_ai_py.mdp.overcooked_trajectory import append_trajectories, DEFAULT_TRAJ_KEYS, TIMESTEP_TRAJ_KEYS, EPISODE_TRAJ_KEYS
-from overcooked_ai_py.mdp.layout_generator import LayoutGenerator, ONION_DISPENSER, TOMATO_DISPENSER, POT, DISH_DISPENSER, SERVING_LOC
-from overcooked_ai_py.agents.agent import AgentGroup, AgentPair, GreedyHumanModel, FixedPlanAgent, RandomAgent
+from overcooked_ai_py.mdp.overcooked_mdp import PlayerState, OvercookedGridworld, OvercookedState, ObjectState, SoupState, Recipe, EVENT_TYPES, \
+    pack_lossless_encodings, unpack_lossless_encodings, LOSSLESS_PACKED_NUM_CHANNELS, LOSSLESS_LAYER_IDX
+from overcooked_ai_py.mdp.overcooked_env import OvercookedEnv, OvercookedVecEnv, OvercookedMultiAgent, DEFAULT_ENV_PARAMS
+from overcooked_ai_py.mdp.overcooked_trajectory import append_trajectories, DEFAULT_TRAJ_KEYS, TIMESTEP_TRAJ_KEYS, EPISODE_TRAJ_KEYS, DeltaEncodedStates, ActionTrajectory, relabel_shaped_rewards
+from overcooked_ai_py.mdp.layout_generator import LayoutGenerator, MdpPrefetcher, ONION_DISPENSER, TOMATO_DISPENSER, POT, DISH_DISPENSER, SERVING_LOC
+from overcooked_ai_py.agents.agent import Agent, AgentGroup, AgentPair, GreedyHumanModel, FixedPlanAgent, RandomAgent, NNPolicy, AgentFromPolicy
 from overcooked_ai_py.agents.benchmarking import AgentEvaluator
 from overcooked_ai_py.planning.planners import MediumLevelActionManager, NO_COUNTERS_PARAMS, MotionPlanner
-from overcooked_ai_py.utils import save_pickle, load_pickle, iterate_over_json_files_in_dir, load_from_json, save_as_json
+from overcooked_ai_py.utils import save_pickle, load_pickle, iterate_over_json_files_in_dir, load_from_json, save_as_json, mean_and_std_err, StreamingStats
 from overcooked_ai_py.static import TESTING_DATA_DIR
 from utils import generate_serialized_trajectory
 
@@ -247,6 +249,21 @@ class TestSoupState(unittest.TestCase):
         # Cannot remove an ingredient from a soup that is empty
         self.assertRaises(ValueError, self.s1.pop_ingredient)
 
+    def test_compact_pickle(self):
+        players = [P((1, 0), n, self.s4.deepcopy()), P((2, 1), e, Obj('onion', (2, 1))), P((3, 1), w)]
+        for soup in [self.s1, self.s2, self.s3, self.s4]:
+            loaded = pickle.loads(pickle.dumps(soup))
+            self.assertEqual(soup, loaded)
+            self.assertEqual(soup.is_cooking, loaded.is_cooking)
+            self.assertEqual(soup.is_ready, loaded.is_ready)
+        for player in players:
+            self.assertEqual(player, pickle.loads(pickle.dumps(player)))
+
+        # Slotted objects do not carry a per-instance attribute dictionary
+        self.assertFalse(hasattr(self.s2, '__dict__'))
+        self.assertFalse(hasattr(players[0], '__dict__'))
+        self.assertRaises(AttributeError, setattr, players[0], 'unknown_attribute', None)
+
 
 
 class TestDirection(unittest.TestCase):
@@ -788,6 +805,80 @@ class TestFeaturizations(unittest.TestCase):
         obs = self.base_mdp.lossless_state_encoding(s)[0]
         self.assertTrue(np.array_equal(obs.shape, self.base_mdp.get_lossless_state_encoding_shape()), "{} vs {}".format(obs.shape, self.base_mdp.get_lossless_state_encoding_shape()))
 
+    def test_lossless_state_encoding_layers(self):
+        state = self.base_mdp.get_standard_start_state(None)
+        state.add_object(SoupState.get_soup((0, 0), num_onions=2, num_tomatoes=1, finished=True))
+        state.players[1].set_object(ObjectState("dish", state.players[1].position))
+        obs_0, obs_1 = self.base_mdp.lossless_state_encoding(state, goal_objects="soup")
+        self.assertTrue(np.array_equal(self.base_mdp.lossless_state_encoding(state, goal_objects="soup", p_idx=1), obs_1))
+
+        # Only the position and orientation layers depend on the player
+        self.assertTrue(np.array_equal(obs_0[:, :, 10:], obs_1[:, :, 10:]))
+        self.assertTrue(np.array_equal(obs_0[:, :, [1, 0, 6, 7, 8, 9, 2, 3, 4, 5]], obs_1[:, :, :10]))
+        self.assertEqual(obs_0[state.players[0].position][0], 1)
+        self.assertEqual(obs_0[(0, 0)][[18, 19, 21, 26]].tolist(), [2, 1, 1, 1])
+        self.assertEqual(obs_0[state.players[1].position][22], 1)
+
+        # Static layers are computed once per mdp
+        static_layers = self.base_mdp._get_lossless_static_layers()
+        self.assertIs(self.base_mdp._get_lossless_static_layers(), static_layers)
+        self.assertEqual(static_layers[:, :, 1].sum(), len(self.base_mdp.get_counter_locations()))
+        self.assertTrue(np.array_equal(obs_0[:, :, 10:16], static_layers))
+
+    def test_lossless_state_encodings(self):
+        trajs = self.env.get_rollouts(self.greedy_human_model_pair, num_games=2, info=False, seed=0)
+        states = [state for ep_states in trajs["ep_states"] for state in ep_states]
+        for goal_objects in [None, "soup", "empty_pot"]:
+            encodings = self.base_mdp.lossless_state_encodings(states, goal_objects=goal_objects)
+            expected_encodings = [self.base_mdp.lossless_state_encoding(state, goal_objects=goal_objects) for state in states]
+            self.assertEqual(encodings.dtype, np.uint8)
+            self.assertEqual(encodings.shape, (len(states), 2) + tuple(self.base_mdp.get_lossless_state_encoding_shape()))
+            self.assertTrue(np.array_equal(encodings, expected_encodings))
+
+        # Preallocated buffers are reused, and fully overwritten
+        out = np.full((3, 2) + tuple(self.base_mdp.get_lossless_state_encoding_shape()), 7, dtype=np.uint8)
+        self.assertIs(self.base_mdp.lossless_state_encodings(states[-3:], out=out), out)
+        self.assertTrue(np.array_equal(out, encodings[-3:]))
+        with self.assertRaises(AssertionError):
+            self.base_mdp.lossless_state_encodings(states[:2], out=out)
+
+        # Counts that don't fit in uint8 aren't silently wrapped around
+        state = states[0].deepcopy()
+        pot_location = self.base_mdp.get_pot_locations()[0]
+        onions = [ObjectState(Recipe.ONION, pot_location) for _ in range(3)]
+        state.add_object(SoupState(pot_location, onions, cooking_tick=0, cook_time=300))
+        with self.assertRaises(ValueError):
+            self.base_mdp.lossless_state_encodings([state])
+
+    def test_pack_lossless_encodings(self):
+        trajs = self.env.get_rollouts(self.greedy_human_model_pair, num_games=1, info=False, seed=0)
+        states = list(trajs["ep_states"][0])
+        encodings = self.base_mdp.lossless_state_encodings(states)
+        packed = pack_lossless_encodings(encodings)
+        self.assertEqual(packed.shape, encodings.shape[:-1] + (LOSSLESS_PACKED_NUM_CHANNELS,))
+        self.assertEqual(packed.dtype, np.uint8)
+        self.assertLess(packed.nbytes, encodings.nbytes / 3)
+        self.assertTrue(np.array_equal(unpack_lossless_encodings(packed), encodings))
+
+        # Single int encodings round-trip too, and preallocated buffers are filled in
+        obs = self.base_mdp.lossless_state_encoding(states[-1])[0]
+        packed_obs = np.zeros(obs.shape[:-1] + (LOSSLESS_PACKED_NUM_CHANNELS,), dtype=np.uint8)
+        self.assertIs(pack_lossless_encodings(obs, out=packed_obs), packed_obs)
+        unpacked_obs = unpack_lossless_encodings(packed_obs, dtype=int)
+        self.assertEqual(unpacked_obs.dtype, int)
+        self.assertTrue(np.array_equal(unpacked_obs, obs))
+        out = np.full(obs.shape, 9, dtype=np.float32)
+        self.assertTrue(np.array_equal(unpack_lossless_encodings(packed_obs, out=out), obs))
+
+        obs[0, 0, 20] = 256
+        with self.assertRaises(ValueError):
+            pack_lossless_encodings(obs)
+        # Binary layers with other values would spill over the other bits of their byte
+        obs[0, 0, 20] = 0
+        obs[0, 0, LOSSLESS_LAYER_IDX["soup_done"]] = 2
+        with self.assertRaises(ValueError):
+            pack_lossless_encodings(obs.astype(np.uint8))
+
     def test_state_featurization_shape(self):
         s = self.base_mdp.get_standard_start_state()
 
@@ -860,6 +951,211 @@ class TestOvercookedEnvironment(unittest.TestCase):
             joint_action = random_joint_action()
             self.env.step(joint_action)
 
+    def test_info_dict_levels(self):
+        action_plan = [random_joint_action() for _ in range(20)]
+        infos_by_level = {}
+        for info_dict_level in ["full", "rewards-only", "none"]:
+            env = OvercookedEnv.from_mdp(self.base_mdp, horizon=20, info_level=0, info_dict_level=info_dict_level)
+            infos_by_level[info_dict_level] = [env.step(joint_action)[3] for joint_action in action_plan]
+
+        full_infos, rewards_infos, no_infos = infos_by_level["full"], infos_by_level["rewards-only"], infos_by_level["none"]
+        self.assertEqual(set(full_infos[0].keys()), {"agent_infos", "sparse_r_by_agent", "shaped_r_by_agent", "phi_s", "phi_s_prime"})
+        for full_info, rewards_info in zip(full_infos, rewards_infos):
+            self.assertEqual(set(rewards_info.keys()) - {"episode"}, {"sparse_r_by_agent", "shaped_r_by_agent"})
+            self.assertEqual(rewards_info["shaped_r_by_agent"], full_info["shaped_r_by_agent"])
+        # Non-final steps share the same empty info, and the episode info is always returned
+        self.assertTrue(all(info is no_infos[0] and info == {} for info in no_infos[:-1]))
+        self.assertEqual(list(no_infos[-1].keys()), ["episode"])
+        self.assertEqual(str(no_infos[-1]["episode"]), str(full_infos[-1]["episode"]))
+
+        with self.assertRaises(AssertionError):
+            OvercookedEnv.from_mdp(self.base_mdp, info_dict_level="some")
+
+    def test_step_n(self):
+        np.random.seed(1)
+        action_plan = [random_joint_action() for _ in range(30)]
+        env_n = self.env.copy()
+        for joint_action in action_plan:
+            self.env.step(joint_action)
+        state, sparse_r, done, info = env_n.step_n(action_plan)
+
+        self.assertEqual(state, self.env.state)
+        self.assertFalse(done)
+        self.assertEqual(info["num_steps"], 30)
+        self.assertEqual(sparse_r, sum(self.env.game_stats["cumulative_sparse_rewards_by_agent"]))
+        self.assertEqual(info["shaped_r_by_agent"], list(self.env.game_stats["cumulative_shaped_rewards_by_agent"]))
+        for event_type in EVENT_TYPES:
+            self.assertEqual(env_n.game_stats[event_type], self.env.game_stats[event_type])
+            self.assertEqual(info["event_counts"][event_type], [len(l) for l in self.env.game_stats[event_type]])
+
+        # Stops at the horizon and adds the episode info
+        state, _, done, info = env_n.step_repeat((stay, stay), 1000)
+        self.assertTrue(done)
+        self.assertEqual(state.timestep, self.env.horizon)
+        self.assertEqual(info["num_steps"], self.env.horizon - 30)
+        self.assertIn("episode", info)
+
+    def test_fast_forward(self):
+        pot_loc = self.base_mdp.get_pot_locations()[0]
+        self.env.state.add_object(SoupState.get_soup(pot_loc, num_onions=3, cooking_tick=5))
+        env_stay = self.env.copy()
+        env_stay.state = self.env.state.deepcopy()
+
+        state, _, done, info = self.env.fast_forward()
+        ticks_until_ready = info["num_steps"]
+        self.assertEqual(ticks_until_ready, 15)
+        self.assertFalse(done)
+        self.assertTrue(state.get_object(pot_loc).is_ready)
+        env_stay.step_repeat((stay, stay), ticks_until_ready)
+        self.assertEqual(state, env_stay.state)
+
+        state, _, done, info = self.env.fast_forward(max_ticks=10)
+        self.assertEqual(info["num_steps"], 10)
+        self.assertEqual(state.timestep, ticks_until_ready + 10)
+
+        state, _, done, info = self.env.fast_forward()
+        self.assertTrue(done)
+        self.assertEqual(state.timestep, self.env.horizon)
+        self.assertIn("episode", info)
+
+    def test_rollout_branches(self):
+        np.random.seed(2)
+        self.env.step_n([random_joint_action() for _ in range(20)])
+        start_state, start_stats = self.env.state, copy.deepcopy(self.env.game_stats)
+        action_plans = [[random_joint_action() for _ in range(10)] for _ in range(3)]
+        branches = action_plans + [action_plans[0][:4], AgentPair(FixedPlanAgent([stay, w, w]), FixedPlanAgent([stay, e, e]))]
+        results = self.env.rollout_branches(start_state, branches, 10, include_states=True)
+
+        self.assertIs(self.env.state, start_state)
+        self.assertEqual(str(self.env.game_stats), str(start_stats))
+        self.assertEqual(list(results["lengths"]), [10, 10, 10, 4, 10])
+        self.assertEqual(results["joint_actions"].shape, (5, 10, 2))
+        self.assertTrue(np.all(results["joint_actions"][3, 4:] == -1))
+        self.assertEqual(results["final_states"][3], results["states"][0, 4])
+        for k, action_plan in enumerate(action_plans):
+            branch_env = self.env.copy()
+            branch_env.state = start_state
+            state, sparse_r, _, info = branch_env.step_n(action_plan)
+            self.assertEqual(results["final_states"][k], state)
+            self.assertEqual(results["sparse_r_by_agent"][k].sum(), sparse_r)
+            self.assertEqual(list(results["shaped_r_by_agent"][k]), info["shaped_r_by_agent"])
+
+        # Branches played by the same agent group are batched, with one joint_actions call per step
+        agent_pair = AgentPair(RandomAgent(all_actions=True), RandomAgent(all_actions=True))
+        agent_pair.joint_action = lambda state: self.fail("Branches should be batched")
+        with mock.patch.object(agent_pair, "joint_actions", wraps=agent_pair.joint_actions) as joint_actions:
+            results = self.env.rollout_branches(start_state, [agent_pair] * 4 + action_plans, 10)
+        self.assertEqual(joint_actions.call_count, 10)
+        self.assertEqual([len(call[0][0]) for call in joint_actions.call_args_list], [4] * 10)
+        self.assertEqual(list(results["lengths"]), [10] * 7)
+
+        # Branches are cut at the env horizon
+        late_state = start_state.deepcopy()
+        late_state.timestep = self.env.horizon - 3
+        results = self.env.rollout_branches(late_state, action_plans, 10)
+        self.assertEqual(list(results["lengths"]), [3, 3, 3])
+
+    def test_snapshot_restore(self):
+        np.random.seed(3)
+        self.env.step_n([random_joint_action() for _ in range(50)])
+        token = self.env.snapshot()
+        state, game_stats = self.env.state, copy.deepcopy(self.env.game_stats)
+
+        action_plan = [random_joint_action() for _ in range(100)]
+        _, _, _, info = self.env.step_n(action_plan)
+        final_state, final_game_stats = self.env.state, copy.deepcopy(self.env.game_stats)
+        self.env.step_repeat((stay, stay), 1000)
+
+        self.env.restore(token)
+        self.assertEqual(self.env.state, state)
+        self.assertEqual(str(self.env.game_stats), str(game_stats))
+
+        # Restoring can be done multiple times, and the episode continues as before
+        self.env.step_n(action_plan)
+        self.env.restore(token)
+        self.env.step_n(action_plan)
+        self.assertEqual(self.env.state, final_state)
+        self.assertEqual(str(self.env.game_stats), str(final_game_stats))
+
+    def test_fast_reset(self):
+        env = OvercookedEnv.from_mdp(self.base_mdp, horizon=10, info_level=0)
+        start_state = self.base_mdp.get_standard_start_state(reset_info={})
+        self.assertEqual(env.state, start_state)
+        mp = env.mp
+
+        # Planners are kept when the mdp is unchanged, and start states are fresh copies of the template
+        env.reset()
+        self.assertIs(env.mp, mp)
+        self.assertEqual(env.state, start_state)
+        self.assertIsNot(env.state.players[0], env._get_start_state_template().players[0])
+
+        # Stats are cleared in place (so references to env.game_stats are emptied too), while episode infos
+        # keep their own copy of the episode's stats
+        game_stats = env.game_stats
+        env.step((Action.INTERACT, Action.INTERACT))
+        env.reset()
+        self.assertIs(env.game_stats, game_stats)
+        self.assertEqual(env.game_stats["cumulative_sparse_rewards_by_agent"].tolist(), [0, 0])
+        # The second player picks up an onion
+        env.step_n([(stay, e), (stay, Action.INTERACT)])
+        _, _, _, info = env.step_repeat((stay, stay), 8)
+        episode_stats = info["episode"]["ep_game_stats"]
+        self.assertEqual(episode_stats["onion_pickup"], [[], [1]])
+        episode_stats_str = str(episode_stats)
+        env.reset()
+        self.assertIs(env.game_stats, game_stats)
+        self.assertEqual(str(episode_stats), episode_stats_str)
+        self.assertNotEqual(str(env.game_stats), episode_stats_str)
+
+        # Planners are also kept for a new mdp with the same dynamics, and pointed at it
+        env.mdp_generator_fn = lambda outside_info: OvercookedGridworld.from_layout_name("cramped_room")
+        env.reset()
+        self.assertIs(env.mp, mp)
+        self.assertIs(env.mp.mdp, env.mdp)
+
+        # A different mdp drops the planners
+        env.mdp_generator_fn = lambda outside_info: OvercookedGridworld.from_layout_name("asymmetric_advantages")
+        env.reset()
+        self.assertIsNone(env._mp)
+        self.assertEqual(env.state, env.mdp.get_standard_start_state(reset_info={}))
+
+    def test_vec_env(self):
+        np.random.seed(4)
+        other_mdp = OvercookedGridworld.from_layout_name("cramped_room")
+        mdps = [self.base_mdp, other_mdp, self.base_mdp]
+        make_envs = lambda: [OvercookedEnv.from_mdp(mdp, horizon=7, info_level=0) for mdp in mdps]
+        featurize_fn = lambda mdp, state: mdp.lossless_state_encoding(state)
+        batch_featurize_fn = lambda mdp, states: np.array([mdp.lossless_state_encoding(state) for state in states])
+        vec_env = OvercookedVecEnv(make_envs(), featurize_fn=featurize_fn)
+        batch_vec_env = OvercookedVecEnv(make_envs(), batch_featurize_fn=batch_featurize_fn)
+        ref_envs = make_envs()
+        self.assertEqual(batch_vec_env.mdp_groups, [[0, 2], [1]])
+
+        obs = vec_env.reset()
+        self.assertEqual(obs.shape, (3, 2) + featurize_fn(self.base_mdp, vec_env.states[0])[0].shape)
+        self.assertTrue(np.array_equal(batch_vec_env.reset(), obs))
+        for t in range(10):
+            actions = np.random.randint(Action.NUM_ACTIONS, size=(3, 2))
+            obs, rewards, dones, infos = vec_env.step(actions)
+            batch_obs, _, _, _ = batch_vec_env.step(actions)
+            self.assertTrue(np.array_equal(batch_obs, obs))
+            for env_idx, env in enumerate(ref_envs):
+                joint_action = tuple(Action.INDEX_TO_ACTION[a] for a in actions[env_idx])
+                state, reward, done, _ = env.step(joint_action)
+                self.assertEqual(dones[env_idx], done)
+                self.assertEqual(rewards[env_idx], reward)
+                if done:
+                    self.assertEqual(infos[env_idx]["terminal_state"], state)
+                    env.reset()
+                self.assertEqual(vec_env.states[env_idx], env.state)
+                self.assertTrue(np.array_equal(obs[env_idx], featurize_fn(env.mdp, env.state)))
+
+        # Layouts of different sizes give lossless observations of different shapes, which can't be stacked
+        larger_mdp = OvercookedGridworld.from_layout_name("asymmetric_advantages")
+        with self.assertRaises(ValueError):
+            OvercookedVecEnv([OvercookedEnv.from_mdp(mdp, horizon=7, info_level=0) for mdp in [self.base_mdp, larger_mdp]],
+                             featurize_fn=featurize_fn)
+
     def test_execute_plan(self):
         action_plan = [random_joint_action() for _ in range(10)]
         self.env.execute_plan(self.base_mdp.get_standard_start_state(), action_plan)
@@ -876,6 +1172,57 @@ class TestOvercookedEnvironment(unittest.TestCase):
             print(e.with_traceback())
             self.fail("Failed to get rollouts from environment:\n{}".format(e))
 
+    def test_parallel_rollouts(self):
+        class UniformAgent(Agent):
+            def action(self, state):
+                return Action.INDEX_TO_ACTION[np.random.randint(Action.NUM_ACTIONS)], {}
+
+        rnd_agent_pair = AgentPair(UniformAgent(), UniformAgent())
+        env = OvercookedEnv.from_mdp(self.base_mdp, horizon=30, info_level=0)
+        sequential_trajs = env.get_rollouts(rnd_agent_pair, 5, info=False, seed=10)
+        parallel_trajs = env.get_rollouts(rnd_agent_pair, 5, info=False, seed=10, num_workers=2)
+        self.assertEqual(list(sequential_trajs["ep_lengths"]), list(parallel_trajs["ep_lengths"]))
+        for k in ["ep_states", "ep_actions", "ep_rewards"]:
+            self.assertEqual(sequential_trajs[k].tolist(), parallel_trajs[k].tolist())
+        # Games use different seeds
+        self.assertNotEqual(sequential_trajs["ep_actions"][0].tolist(), sequential_trajs["ep_actions"][1].tolist())
+
+    def test_lockstep_rollouts(self):
+        class CyclingPolicy(NNPolicy):
+            def __init__(self):
+                self.num_calls = 0
+
+            def multi_state_policy(self, states, agent_indices):
+                self.num_calls += 1
+                return [np.eye(Action.NUM_ACTIONS)[(state.timestep // 3 + agent_idx) % Action.NUM_ACTIONS]
+                        for state, agent_idx in zip(states, agent_indices)]
+
+        policy = CyclingPolicy()
+        agent_pair = AgentPair(AgentFromPolicy(policy), AgentFromPolicy(policy))
+        env = OvercookedEnv.from_mdp(self.base_mdp, horizon=20, info_level=0)
+        sequential_trajs = env.get_rollouts(agent_pair, 6, info=False, final_state=True)
+        self.assertEqual(policy.num_calls, 6 * 20 * 2)
+
+        policy.num_calls = 0
+        lockstep_trajs = env.get_rollouts(agent_pair, 6, info=False, final_state=True, lockstep_games=4)
+        self.assertEqual(policy.num_calls, 2 * 20 * 2)
+        self.assertEqual(set(lockstep_trajs.keys()), set(sequential_trajs.keys()))
+        for k in ["ep_states", "ep_actions", "ep_rewards", "ep_dones", "ep_lengths", "ep_returns"]:
+            self.assertEqual(lockstep_trajs[k].tolist(), sequential_trajs[k].tolist())
+
+        # Seeded games start from the same (random) states in all modes, whatever the batch size
+        start_state = self.base_mdp.get_standard_start_state(None)
+        def random_start_state_fn(**kwargs):
+            state = start_state.deepcopy()
+            state.players[0].orientation = Direction.ALL_DIRECTIONS[np.random.randint(len(Direction.ALL_DIRECTIONS))]
+            return state
+        env = OvercookedEnv.from_mdp(self.base_mdp, start_state_fn=random_start_state_fn, horizon=5, info_level=0)
+        sequential_trajs = env.get_rollouts(agent_pair, 6, info=False, seed=3)
+        self.assertGreater(len(set(ep_states[0].players[0].orientation for ep_states in sequential_trajs["ep_states"])), 1)
+        for lockstep_games in [2, 4]:
+            lockstep_trajs = env.get_rollouts(agent_pair, 6, info=False, seed=3, lockstep_games=lockstep_games)
+            self.assertEqual(lockstep_trajs["ep_states"].tolist(), sequential_trajs["ep_states"].tolist())
+
     def test_one_player_env(self):
         mdp = OvercookedGridworld.from_layout_name("cramped_room_single")
         env = OvercookedEnv.from_mdp(mdp, horizon=12, info_level=0)
@@ -957,6 +1304,28 @@ class TestOvercookedEnvironment(unittest.TestCase):
             curr_terrain = env.state.all_objects_list
             self.assertFalse(np.array_equal(start_state, curr_terrain))
 
+    def test_mdp_prefetcher(self):
+        layout_names = ["cramped_room", "asymmetric_advantages", "coordination_ring", "forced_coordination"]
+        mdp_fn = lambda outside_info: OvercookedGridworld.from_layout_name(np.random.choice(layout_names))
+        with MdpPrefetcher(mdp_fn, queue_size=2, num_workers=2, compute_planners=True, seed=0) as prefetcher:
+            env = OvercookedEnv(prefetcher, horizon=10, info_level=0)
+            terrains = [env.mdp.terrain_mtx]
+            for _ in range(3):
+                # The prefetched planners are used rather than computed on demand
+                self.assertIs(env.mlam, prefetcher.get_mlam(env.mdp))
+                self.assertIs(env.mlam.mdp, env.mdp)
+                env.reset()
+                terrains.append(env.mdp.terrain_mtx)
+        self.assertTrue(prefetcher.closed)
+        # Workers are seeded differently, so they don't all generate the same layouts
+        self.assertGreater(len(set(str(terrain) for terrain in terrains)), 1)
+
+        # The prefetched planners can't be used by an env with different planner params
+        mlam_params = dict(NO_COUNTERS_PARAMS, counter_goals=[(0, 0)])
+        with MdpPrefetcher(mdp_fn, queue_size=1, seed=0) as prefetcher:
+            with self.assertRaises(AssertionError):
+                OvercookedEnv(prefetcher, horizon=10, mlam_params=mlam_params, info_level=0)
+
     def test_failing_rnd_layout(self):
         with self.assertRaises(TypeError):
             mdp_gen_params = {"None": None}
@@ -1089,7 +1458,42 @@ class TestGymEnvironment(unittest.TestCase):
         self.rnd_agent_pair = AgentPair(FixedPlanAgent([]), FixedPlanAgent([]))
         np.random.seed(0)
 
-    # TODO: write more tests here
+    def test_multi_agent_wrapper(self):
+        np.random.seed(6)
+        mdp = OvercookedGridworld.from_layout_name("3_chefs_cramped_room")
+        featurize_fn = lambda mdp, state: mdp.lossless_state_encoding(state)
+        multi_agent_env = OvercookedMultiAgent(OvercookedEnv.from_mdp(mdp, horizon=10, info_level=0), featurize_fn)
+        self.assertEqual(multi_agent_env.num_agents, 3)
+        obs = multi_agent_env.reset()
+        ref_env = OvercookedEnv.from_mdp(mdp, horizon=10, info_level=0)
+        done = False
+        while not done:
+            agent_order = obs["agent_order"]
+            self.assertEqual(sorted(agent_order), [0, 1, 2])
+            for slot_idx, player_idx in enumerate(agent_order):
+                self.assertTrue(np.array_equal(obs["agent_obs"][slot_idx], featurize_fn(mdp, ref_env.state)[player_idx]))
+                self.assertTrue(np.shares_memory(obs["agent_obs"][slot_idx], multi_agent_env.obs_buffer))
+
+            actions = np.random.randint(Action.NUM_ACTIONS, size=3)
+            joint_action = [None] * 3
+            for slot_idx, player_idx in enumerate(agent_order):
+                joint_action[player_idx] = Action.INDEX_TO_ACTION[actions[slot_idx]]
+            ref_env.step(tuple(joint_action))
+            obs, _, done, info = multi_agent_env.step(actions)
+            self.assertEqual(obs["overcooked_state"], ref_env.state)
+        self.assertIn("episode", info)
+
+        # By default, lossless encodings are written in place (through a uint8 buffer for other dtypes)
+        for obs_dtype in [np.uint8, np.float32]:
+            base_env = OvercookedEnv.from_mdp(mdp, horizon=10, info_level=0)
+            multi_agent_env = OvercookedMultiAgent(base_env, obs_dtype=obs_dtype)
+            obs = multi_agent_env.reset()
+            for _ in range(3):
+                expected_obs = mdp.lossless_state_encoding(obs["overcooked_state"], horizon=10)
+                for slot_idx, player_idx in enumerate(obs["agent_order"]):
+                    self.assertTrue(np.array_equal(obs["agent_obs"][slot_idx], expected_obs[player_idx]))
+                    self.assertEqual(obs["agent_obs"][slot_idx].dtype, obs_dtype)
+                obs, _, _, _ = multi_agent_env.step(np.random.randint(Action.NUM_ACTIONS, size=3))
 
 class TestTrajectories(unittest.TestCase):
 
@@ -1123,5 +1527,147 @@ class TestTrajectories(unittest.TestCase):
             shape_combined = combined[key].shape
             self.assertEqual(shape_combined[0], shape_one[0] + shape_two[0])
 
+    def test_rollout_summary(self):
+        values = np.random.normal(3, 2, size=1000)
+        stats = StreamingStats()
+        for v in values:
+            stats.update(v)
+        self.assertAlmostEqual(stats.mean, np.mean(values))
+        self.assertAlmostEqual(stats.std, np.std(values))
+        self.assertAlmostEqual(stats.std_err, mean_and_std_err(values)[1])
+
+        trajs = self.env.get_rollouts(self.greedy_human_model_pair, num_games=2, info=False, seed=0)
+        summary = self.env.get_rollout_summary(self.greedy_human_model_pair, num_games=2, info=False, seed=0)
+        self.assertEqual(summary.num_episodes, 2)
+        self.assertAlmostEqual(summary.returns.mean, np.mean(trajs["ep_returns"]))
+        self.assertAlmostEqual(summary.returns.std, np.std(trajs["ep_returns"]))
+        self.assertAlmostEqual(summary.lengths.mean, np.mean(trajs["ep_lengths"]))
+        for event_type in EVENT_TYPES:
+            expected_counts = sum(np.array([len(l) for l in ep_infos[-1]["episode"]["ep_game_stats"][event_type]])
+                                  for ep_infos in trajs["ep_infos"])
+            self.assertEqual(list(summary.event_counts[event_type]), list(expected_counts))
+        self.assertEqual(summary.to_dict()["num_episodes"], 2)
+
+    def test_delta_encoded_states(self):
+        trajs = self.env.get_rollouts(self.greedy_human_model_pair, num_games=1, info=False)
+        states = list(trajs["ep_states"][0])
+
+        for prev_state, state in zip(states, states[1:]):
+            self.assertEqual(prev_state.apply(state.diff(prev_state)), state)
+            self.assertEqual(state.apply(prev_state.diff(state)), prev_state)
+
+        encoded_states = DeltaEncodedStates(states, keyframe_interval=25)
+        self.assertEqual(len(encoded_states), len(states))
+        self.assertEqual(list(encoded_states), states)
+        for idx in [0, 1, 24, 25, 26, 137, len(states) - 1, -1]:
+            self.assertEqual(encoded_states[idx], states[idx])
+        self.assertEqual(encoded_states[10:60:7], states[10:60:7])
+        with self.assertRaises(IndexError):
+            encoded_states[len(states)]
+
+        loaded_states = pickle.loads(pickle.dumps(encoded_states))
+        loaded_states.append(states[0])
+        self.assertEqual(list(loaded_states), states + [states[0]])
+
+        # Decoded states don't share player or object states with each other
+        idx = next(i for i in range(1, len(states) - 1) if states[i].players[0] == states[i + 1].players[0])
+        decoded_state, next_decoded_state = encoded_states[idx], encoded_states[idx + 1]
+        decoded_state.players[0].position = (-1, -1)
+        self.assertEqual(next_decoded_state, states[idx + 1])
+        self.assertEqual(list(encoded_states), states)
+
+        # Rollouts can store their states as deltas
+        compact_trajs = self.env.get_rollouts(self.greedy_human_model_pair, num_games=1, info=False, seed=0,
+                                              compact_states="deltas")
+        trajs = self.env.get_rollouts(self.greedy_human_model_pair, num_games=1, info=False, seed=0)
+        self.assertIsInstance(compact_trajs["ep_states"][0], DeltaEncodedStates)
+        self.assertEqual(list(compact_trajs["ep_states"][0]), list(trajs["ep_states"][0]))
+
+    def test_action_trajectory(self):
+        for final_state in [False, True]:
+            trajs = self.env.get_rollouts(self.greedy_human_model_pair, num_games=1, info=False, seed=0,
+                                          final_state=final_state)
+            compact_trajs = self.env.get_rollouts(self.greedy_human_model_pair, num_games=1, info=False, seed=0,
+                                                  final_state=final_state, compact_states=True)
+            states = list(trajs["ep_states"][0])
+            action_traj = compact_trajs["ep_states"][0]
+            self.assertIsInstance(action_traj, ActionTrajectory)
+            self.assertEqual(len(action_traj), len(states))
+            self.assertEqual(list(action_traj), states)
+            for idx in [0, 1, 49, 50, 51, 137, len(states) - 1, -1]:
+                self.assertEqual(action_traj[idx], states[idx])
+            self.assertEqual(action_traj[10:120:7], states[10:120:7])
+
+            # Checking compact trajectories replays them sequentially, rather than indexing each state
+            compact_trajs["env_params"][0]["_variable_mdp"] = False
+            with mock.patch.object(ActionTrajectory, "__getitem__", side_effect=AssertionError("indexed")), \
+                    mock.patch.object(AgentEvaluator, "get_mdps_and_envs_from_trajectories",
+                                      return_value=([self.base_mdp], [self.env.copy()])):
+                AgentEvaluator._check_trajectories_dynamics(compact_trajs, verbose=False)
+
+        # States are rebuilt from the start state and actions, with the mdp bound after loading
+        action_traj = ActionTrajectory(self.base_mdp, states[0], trajs["ep_actions"][0][:-1], checkpoint_interval=30)
+        self.assertEqual(action_traj.joint_actions.dtype, np.int8)
+        loaded_traj = pickle.loads(pickle.dumps(action_traj))
+        with self.assertRaises(AssertionError):
+            loaded_traj.bind_mdp(OvercookedGridworld.from_layout_name("coordination_ring"))
+        loaded_traj.bind_mdp(OvercookedGridworld.from_layout_name("cramped_room"))
+        self.assertEqual(list(loaded_traj), states)
+        loaded_traj.append((Action.STAY, Action.STAY))
+        self.assertEqual(len(loaded_traj), len(states) + 1)
+        self.assertEqual(loaded_traj[-1].players, states[-1].players)
+
+    def test_rollout_arrays(self):
+        trajs = self.env.get_rollouts(self.greedy_human_model_pair, num_games=2, info=False, seed=5, final_state=True)
+        array_trajs = self.env.get_rollout_arrays(self.greedy_human_model_pair, num_games=2, info=False, seed=5,
+                                                  checkpoint_interval=40)
+        horizon = self.env.horizon
+        self.assertEqual(array_trajs["ep_actions"].shape, (2, horizon, 2))
+        self.assertEqual(array_trajs["ep_actions"].dtype, np.int8)
+        self.assertEqual(array_trajs["ep_rewards"].dtype, np.float32)
+        self.assertTrue(np.array_equal(array_trajs["ep_returns"], trajs["ep_returns"]))
+        self.assertTrue(np.array_equal(array_trajs["ep_lengths"], trajs["ep_lengths"]))
+        for i in range(2):
+            length = trajs["ep_lengths"][i]
+            expected_actions = [[Action.ACTION_TO_INDEX[a] for a in joint_action] for joint_action in trajs["ep_actions"][i][:length]]
+            self.assertEqual(array_trajs["ep_actions"][i].tolist(), expected_actions)
+            self.assertEqual(array_trajs["ep_rewards"][i].tolist(), list(trajs["ep_rewards"][i][:length]))
+            self.assertEqual(array_trajs["ep_dones"][i].tolist(), list(trajs["ep_dones"][i][:length]))
+            self.assertEqual(list(array_trajs["ep_states"][i]), list(trajs["ep_states"][i]))
+            self.assertEqual(array_trajs["ep_episode_infos"][i]["ep_sparse_r"], trajs["ep_returns"][i])
+
+    def test_relabel_shaped_rewards(self):
+        rew_shaping_params = {"PLACEMENT_IN_POT_REW": 1, "DISH_PICKUP_REWARD": 2, "SOUP_PICKUP_REWARD": 7,
+                              "DISH_DISP_DISTANCE_REW": 0, "POT_DISTANCE_REW": 0, "SOUP_DISTANCE_REW": 0}
+        mdp = OvercookedGridworld.from_layout_name("cramped_room", rew_shaping_params=rew_shaping_params)
+        # Soups on counters and a held dish, so that soups get picked up both from pots and from counters
+        start_state = mdp.get_standard_start_state(None)
+        for counter_pos in sorted(mdp.get_counter_locations())[:3]:
+            start_state.add_object(SoupState.get_soup(counter_pos, num_onions=3, finished=True))
+        start_state.players[0].set_object(ObjectState("dish", start_state.players[0].position))
+        env = OvercookedEnv.from_mdp(mdp, start_state_fn=lambda **kwargs: start_state.deepcopy(), horizon=400,
+                                     info_level=0)
+        agent_pair = AgentPair(RandomAgent(all_actions=True), RandomAgent(all_actions=True))
+
+        # Trajectories collected with the base shaping params, relabeled with the new ones
+        base_env = OvercookedEnv.from_mdp(OvercookedGridworld.from_layout_name("cramped_room"),
+                                          start_state_fn=env.start_state_fn, horizon=400, info_level=0)
+        base_trajs = base_env.get_rollouts(agent_pair, num_games=10, info=False, seed=1)
+        relabeled = relabel_shaped_rewards(base_trajs, rew_shaping_params, event_types=["soup_pickup"])
+
+        trajs = env.get_rollouts(agent_pair, num_games=10, info=False, seed=1)
+        expected_rewards = np.array([[info["shaped_r_by_agent"] for info in ep_infos] for ep_infos in trajs["ep_infos"]])
+        self.assertEqual(relabeled["ep_shaped_rewards_by_agent"].tolist(), expected_rewards.tolist())
+        self.assertEqual(relabeled["ep_shaped_returns"].tolist(),
+                         [ep_infos[-1]["episode"]["ep_shaped_r"] for ep_infos in trajs["ep_infos"]])
+        soup_pickups = relabeled["ep_event_flags"][..., 0]
+        self.assertGreater(soup_pickups.sum(), (expected_rewards == 7).sum())
+
+        # Trajectories in array form are relabeled the same
+        array_trajs = base_env.get_rollout_arrays(agent_pair, num_games=10, info=False, seed=1)
+        relabeled_arrays = relabel_shaped_rewards(array_trajs, rew_shaping_params)
+        self.assertTrue(np.array_equal(relabeled_arrays["ep_shaped_rewards_by_agent"],
+                                       relabeled["ep_shaped_rewards_by_agent"]))
+
 if __name__ == '__main__':
     unittest.main()